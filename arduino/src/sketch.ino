@@ -18,11 +18,43 @@ ZumoMotors motors;
 ZumoReflectanceSensorArray reflectArray(ZUMO_SENSOR_ARRAY_DEFAULT_EMITTER_PIN);
 ZumoBuzzer buzzer;
 
+/* Period (ms) of the ground readings pushed to the console, 0 for none */
+static uint32_t streamPeriod = 0;
+static unsigned long nextStream = 0;
+
+/* Push the ground readings if it is time to: "S r0 r1 r2 r3 r4 r5" */
+static void streamSensors(){
+    if (! streamPeriod)
+        return;
+    if (! Console.connected()){
+        streamPeriod = 0;
+        return;
+    }
+    unsigned long now = millis();
+    if ((long) (now - nextStream) < 0)
+        return;
+    nextStream = now + streamPeriod;
+    reflectArray.read(groundSensors);
+    Console.print('S');
+    for (int i=0; i<6; i++){
+        Console.print(' ');
+        Console.print(groundSensors[i]);
+    }
+    Console.println();
+}
+
+/* delay() that keeps streaming the ground readings */
+static void streamingDelay(unsigned long ms){
+    unsigned long end = millis() + ms;
+    while ((long) (millis() - end) < 0)
+        streamSensors();
+}
+
 /* Helper to set motors speeds */
 static inline uint32_t setSpeeds(float left, float right, int T){
     if (T < 500) {
         motors.setSpeeds(left * speed_min * leftAdjust, right * speed_min);
-        delay(T*(speed_max/speed_min));
+        streamingDelay(T*(speed_max/speed_min));
     }
     else {
         int speed = speed_min;
@@ -38,7 +70,7 @@ static inline uint32_t setSpeeds(float left, float right, int T){
                 speed -= speed_step;
             }
             motors.setSpeeds(left * speed * leftAdjust, right * speed);
-            delay(1);
+            streamingDelay(1);
         }
     }
     motors.setSpeeds(0, 0);
@@ -47,7 +79,8 @@ static inline uint32_t setSpeeds(float left, float right, int T){
 
 /* Wit for a character to be available on console */
 static inline void waitConsole(){
-    while (! (Console.connected() && Console.available()));
+    while (! (Console.connected() && Console.available()))
+        streamSensors();
 }
 
 /* Invocable function */
@@ -85,6 +118,31 @@ uint32_t isSensorsAboveThreshold(uint32_t params) {
     return res;
 }
 
+/* Move while a test of the ground sensors holds, checked every ms, for
+   at most a length; params (see protocol.moving_param): bits 0-5 the
+   sensors, 6-15 the length, 16-26 the threshold, 27-28 the direction
+   (forward, backward, left, right), 29 whether to move while one of the
+   sensors reads at least the threshold, or while none does. Return the
+   length travelled, at speed_min as short motions. */
+uint32_t moveWhile(uint32_t params){
+    static const int8_t wheels[4][2] = {{1, 1}, {-1, -1}, {-1, 1}, {1, -1}};
+    uint32_t test = params & 0x07FF003F;
+    uint32_t len = (params >> 6) & 0x3FF;
+    uint8_t direction = (params >> 27) & 3;
+    uint32_t above = (params >> 29) & 1;
+    /* ms per unit of length, as setSpeeds for T < 500 */
+    unsigned long unit = 5 * (speed_max/speed_min);
+    unsigned long start = millis(), elapsed = 0;
+    while (elapsed < len*unit && isSensorsAboveThreshold(test) == above){
+        motors.setSpeeds(wheels[direction][0] * speed_min * leftAdjust,
+                         wheels[direction][1] * speed_min);
+        streamingDelay(1);
+        elapsed = millis() - start;
+    }
+    motors.setSpeeds(0, 0);
+    return min(elapsed / unit, len);
+}
+
 uint32_t getGroundSensor(uint32_t index){
     if (index < 6){
         reflectArray.read(groundSensors);
@@ -101,6 +159,12 @@ uint32_t getGroundSensorSum(uint32_t unused){
     return res;
 }
 
+uint32_t streamGroundSensors(uint32_t period){
+    streamPeriod = period;
+    nextStream = millis();
+    return 0;
+}
+
 uint32_t changeLeftAdjust(uint32_t ratio){
     uint32_t res = 0;
     leftAdjust = ((float) ratio)/1000.0;
@@ -118,9 +182,14 @@ LOGO_cmd Commands[] = {
     {'a', getGroundSensorSum},
     {'p', playMusic},
     {'c', changeLeftAdjust},
-    {'t', isSensorsAboveThreshold}
+    {'t', isSensorsAboveThreshold},
+    {'v', streamGroundSensors},
+    {'w', moveWhile}
 };
 
+/* Multi-command frame header, its param is the number of commands */
+#define FRAME 'm'
+
 /* Read command from console into currentCommand */
 void readCommand(){
     waitConsole();
@@ -140,13 +209,31 @@ void setup(){
     while (! Console);
 }
 
-void loop(){
-    readCommand();
+/* Execute currentCommand into res; false if it is unknown */
+static bool runCommand(uint32_t *res){
     for (int i=0; i<N_Commands; i++){
         if (Commands[i].name == currentCommand.name){
-            uint32_t res = Commands[i].procedure(currentCommand.param);
-            Console.println(res);
-            return;
+            *res = Commands[i].procedure(currentCommand.param);
+            return true;
+        }
+    }
+    return false;
+}
+
+void loop(){
+    uint32_t res = 0;
+    readCommand();
+    if (currentCommand.name == FRAME){
+        /* param commands follow, executed in a row with a single reply:
+           the result of the last one */
+        uint32_t n = currentCommand.param;
+        for (uint32_t k=0; k<n; k++){
+            readCommand();
+            runCommand(&res);
         }
+        Console.println(res);
+    }
+    else if (runCommand(&res)){
+        Console.println(res);
     }
 }
@@ -0,0 +1,156 @@
+"""
+asyncio client for the Zumo robots, alongside the blocking zumoturtle
+functions. Each Zumo has its own connection and calibration, so one
+event loop can drive many robots concurrently:
+
+    loop = asyncio.get_event_loop()
+    a, b = Zumo(port=6571), Zumo(port=6572)
+    loop.run_until_complete(asyncio.gather(a.connect(), b.connect()))
+    loop.run_until_complete(asyncio.gather(a.forward(100), b.turnLeft(90)))
+
+Needs trollius, the asyncio of Python 2 (pip install trollius).
+"""
+
+import trollius as asyncio
+from trollius import From, Return
+
+from protocol import encode, sensors_param, motion_duration, NO_READING, \
+    moving_param, moving_length, moved, \
+    FORWARD, BACKWARD, LEFT, RIGHT, GROUND_SENSOR, GROUND_SENSOR_SUM, \
+    MUSIC, LEFT_ADJUST, SENSORS_ABOVE, MOVE_WHILE
+
+try:
+    from zumoadjust import ROTATION_ADJUST, LEFT_ADJUST as DEFAULT_LEFT_ADJUST
+except:
+    ROTATION_ADJUST = 1.0
+    DEFAULT_LEFT_ADJUST = 1.0
+
+
+class Zumo(object):
+    """
+    A robot behind a Bridge console. The methods are coroutines, with the
+    names and arguments of the zumoturtle functions.
+
+    timeout is the time (s) to wait for a reply, on top of the duration
+    of motions. After a timeout, the connection is closed as later
+    replies can't be matched with their command anymore.
+    """
+
+    def __init__(self, host='localhost', port=6571, left_adjust=DEFAULT_LEFT_ADJUST,
+                 rotation_adjust=ROTATION_ADJUST, timeout=5.0, loop=None):
+        self.host, self.port = host, port
+        self.left_adjust = left_adjust
+        self.rotation_adjust = rotation_adjust
+        self.timeout = timeout
+        self.loop = loop or asyncio.get_event_loop()
+        self.reader = self.writer = None
+        # One command at a time: replies come in order
+        self.lock = asyncio.Lock(loop=self.loop)
+
+    @asyncio.coroutine
+    def connect(self):
+        """Open the connection and send the left motor adjustment"""
+        self.reader, self.writer = yield From(asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port, loop=self.loop),
+            self.timeout, loop=self.loop))
+        yield From(self.changeLeftAdjust(self.left_adjust))
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+    @asyncio.coroutine
+    def send_cmd(self, cmd, param, duration=0):
+        """Send a command and return its reply, expected within duration + timeout"""
+        if self.writer is None:
+            raise IOError("Zumo %s:%d is not connected" % (self.host, self.port))
+        with (yield From(self.lock)):
+            self.writer.write(encode(cmd, param))
+            try:
+                line = yield From(asyncio.wait_for(
+                    self.reader.readline(), duration + self.timeout, loop=self.loop))
+            except asyncio.TimeoutError:
+                self.close()
+                raise
+            if not line:
+                self.close()
+                raise IOError("Connection to Zumo %s:%d closed" % (self.host, self.port))
+        raise Return(line.strip())
+
+    @asyncio.coroutine
+    def move(self, cmd, param):
+        yield From(self.send_cmd(cmd, param, motion_duration(param)))
+
+    def forward(self, length):
+        return self.move(FORWARD, length)
+
+    def backward(self, length):
+        return self.move(BACKWARD, length)
+
+    def turnLeft(self, angle):
+        return self.move(LEFT, angle*self.rotation_adjust)
+
+    def turnRight(self, angle):
+        return self.move(RIGHT, angle*self.rotation_adjust)
+
+    @asyncio.coroutine
+    def moveWhile(self, direction, threshold, sensors, length, above):
+        """See zumoturtle.moveWhile"""
+        sent = moving_length(direction, length, self.rotation_adjust)
+        travelled = yield From(self.send_cmd(
+            MOVE_WHILE, moving_param(direction, threshold, sensors, sent, above),
+            sent * motion_duration(1)))
+        raise Return(moved(length, sent, int(travelled)))
+
+    @asyncio.coroutine
+    def changeLeftAdjust(self, ratio):
+        self.left_adjust = ratio
+        yield From(self.send_cmd(LEFT_ADJUST, int(ratio*1000)))
+
+    @asyncio.coroutine
+    def playMusic(self):
+        yield From(self.send_cmd(MUSIC, 0))
+
+    @asyncio.coroutine
+    def sensorsAbove(self, threshold, sensors):
+        res = yield From(self.send_cmd(SENSORS_ABOVE, sensors_param(threshold, sensors)))
+        raise Return(res == "1")
+
+    @asyncio.coroutine
+    def getGroundSensor(self, index):
+        res = NO_READING
+        while res == NO_READING:
+            res = int((yield From(self.send_cmd(GROUND_SENSOR, index))))
+            if res == NO_READING:
+                yield From(asyncio.sleep(0.001, loop=self.loop))
+        raise Return(res)
+
+    @asyncio.coroutine
+    def getGroundSensorSum(self):
+        res = yield From(self.send_cmd(GROUND_SENSOR_SUM, 0))
+        raise Return(int(res))
+
+    def blocking(self):
+        """The robot as blocking functions, to build Primitives"""
+        return Blocking(self)
+
+
+class Blocking(object):
+    """
+    Blocking functions running the coroutines of a Zumo on its loop, with
+    the interface of the zumoturtle module (see primitives.primitives_fr).
+    """
+
+    def __init__(self, zumo):
+        self.zumo = zumo
+
+    def sync(self):
+        """Commands are finished when their function returns"""
+
+    def __getattr__(self, name):
+        coroutine = getattr(self.zumo, name)
+        def f(*args):
+            return self.zumo.loop.run_until_complete(coroutine(*args))
+        f.__name__ = name
+        return f
@@ -0,0 +1,228 @@
+"""
+Arrays of numbers for LOGO, and their bulk primitives.
+
+An Array is an immutable list of numbers whose operators apply element
+by element, with a number or another Array (or list) of the same length:
+
+    donne :t tableau [1 2 3]
+    (:t * 2) + 1            ; [3, 5, 7]
+    somme :t > 1            ; 2
+    applique "carre" intervalle 1 10
+
+Elements are computed by NumPy when it is installed, else in pure
+Python: both give the same values.
+"""
+
+import math
+import operator
+
+from logo import Primitive, Callable, ProgramError
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class Array(object):
+    """Immutable array of numbers, see the module documentation"""
+    __slots__ = ('data',)
+
+    def __init__(self, values=()):
+        if isinstance(values, Array):
+            values = values.data
+        elif not isinstance(values, (list, tuple)):
+            raise ProgramError("Not a list of numbers: %s" % (values,))
+        if numpy is not None:
+            # Empty, of integers as in Python
+            data = numpy.array(values) if len(values) else numpy.array([], dtype=int)
+            if data.ndim != 1 or data.dtype.kind not in "biuf":
+                raise ProgramError("Not a list of numbers: %s" % (values,))
+        else:
+            data = list(values)
+            for value in data:
+                if not isinstance(value, (int, long, float, bool)):
+                    raise ProgramError("Not a list of numbers: %s" % (values,))
+        self.data = data
+
+    @classmethod
+    def wrap(cls, data):
+        """Array of data, computed by the current backend"""
+        array = cls.__new__(cls)
+        array.data = data
+        return array
+
+    def tolist(self):
+        if numpy is not None:
+            return self.data.tolist()
+        return list(self.data)
+
+    def __reduce__(self):
+        return (Array, (self.tolist(),))
+
+    def __len__(self):
+        return len(self.data)
+
+    def __iter__(self):
+        return iter(self.tolist())
+
+    def __getitem__(self, index):
+        return self.tolist()[index]
+
+    def __repr__(self):
+        return repr(self.tolist())
+
+    def __nonzero__(self):
+        raise ProgramError("An array is neither true nor false; use somme or compte")
+
+    __hash__ = None
+
+    def item(self, index):
+        """Element at index, from 1 as in LOGO"""
+        if not 1 <= index <= len(self.data):
+            raise ProgramError("No element %s in an array of %d" % (index, len(self.data)))
+        value = self.data[index - 1]
+        return value.item() if numpy is not None else value
+
+    def map(self, func, vectorized=None):
+        """Array of func of each element; numpy vectorized, if given, instead"""
+        if numpy is not None and vectorized is not None:
+            with numpy.errstate(divide='raise', invalid='raise'):
+                try:
+                    return Array.wrap(vectorized(self.data))
+                except FloatingPointError:
+                    raise ValueError("math domain error")
+        return Array([func(value) for value in self.tolist()])
+
+    def select(self, keep):
+        """Array of the elements for which keep is true, in a list"""
+        if numpy is not None:
+            return Array.wrap(self.data[numpy.array(keep, dtype=bool)])
+        return Array.wrap([value for value, kept in zip(self.data, keep) if kept])
+
+
+def elementwise(op, swap=False):
+    """Operator method applying op element by element"""
+    def f(self, other):
+        if isinstance(other, (list, tuple)):
+            other = Array(other)
+        if isinstance(other, Array):
+            if len(other.data) != len(self.data):
+                raise ProgramError("Arrays of different lengths: %d and %d" % (
+                    len(self.data), len(other.data)))
+            other = other.data
+        elif not isinstance(other, (int, long, float, bool)):
+            return NotImplemented
+        a, b = (other, self.data) if swap else (self.data, other)
+        if numpy is not None:
+            with numpy.errstate(divide='raise', invalid='raise'):
+                try:
+                    return Array.wrap(op(a, b))
+                except FloatingPointError:
+                    raise ZeroDivisionError("division by zero in an array")
+        if isinstance(other, list):
+            return Array.wrap([op(x, y) for x, y in zip(a, b)])
+        elif swap:
+            return Array.wrap([op(a, y) for y in b])
+        return Array.wrap([op(x, b) for x in a])
+    return f
+
+for name, op in [("add", operator.add), ("sub", operator.sub),
+                 ("mul", operator.mul), ("div", operator.div)]:
+    setattr(Array, "__%s__" % name, elementwise(op))
+    setattr(Array, "__r%s__" % name, elementwise(op, swap=True))
+for name, op in [("lt", operator.lt), ("le", operator.le), ("eq", operator.eq),
+                 ("ne", operator.ne), ("ge", operator.ge), ("gt", operator.gt)]:
+    setattr(Array, "__%s__" % name, elementwise(op))
+del name, op
+
+
+def array(values):
+    return values if isinstance(values, Array) else Array(values)
+
+
+def interval(start, end):
+    """Array of the integers from start to end, both included"""
+    start, end = int(start), int(end)
+    if numpy is not None:
+        return Array.wrap(numpy.arange(start, end + 1))
+    return Array.wrap(range(start, end + 1))
+
+
+def total(values):
+    values = array(values)
+    if numpy is not None:
+        return values.data.sum().item()
+    return sum(values.data)
+
+
+def reduction(func, method, name):
+    """func of the elements, or their numpy method"""
+    def f(values):
+        values = array(values)
+        if not len(values):
+            raise ProgramError("%s of an empty array" % name)
+        if numpy is not None:
+            return getattr(values.data, method)().item()
+        return func(values.data)
+    return f
+
+
+def count(values):
+    return len(array(values))
+
+
+def element(index, values):
+    return array(values).item(index)
+
+
+def unary(func, vectorized):
+    """func of a number, or of each element of an Array"""
+    def f(value):
+        if isinstance(value, Array):
+            return value.map(func, vectorized)
+        return func(value)
+    return f
+
+
+def procedure(env, name):
+    """The callable named name, for applique and filtre"""
+    proc = env.get(name)
+    if not isinstance(proc, Callable) or proc.arity != 1:
+        raise ProgramError("%s is not a procedure of one argument" % name)
+    return proc
+
+
+def primitives_fr(env):
+    """
+    The array primitives; applique and filtre call procedures by name
+    in env. sin, cos, tan and racine also apply to each element of arrays.
+    """
+    P = Primitive
+    vectorized = lambda name: getattr(numpy, name, None)
+
+    def apply(name, values):
+        proc = procedure(env, name)
+        return Array([proc.call(env, [value]) for value in array(values)])
+
+    def keep(name, values):
+        proc = procedure(env, name)
+        values = array(values)
+        return values.select([proc.call(env, [value]) for value in values])
+
+    return (
+        P(array, 1, "tableau", True),
+        P(interval, 2, "intervalle", True),
+        P(total, 1, "somme", True),
+        P(reduction(min, "min", "minimum"), 1, "minimum", True),
+        P(reduction(max, "max", "maximum"), 1, "maximum", True),
+        P(count, 1, "compte", True),
+        P(element, 2, "element", True),
+        P(apply, 2, "applique"),
+        P(keep, 2, "filtre"),
+        P(unary(math.sin, vectorized("sin")), 1, "sin", True),
+        P(unary(math.cos, vectorized("cos")), 1, "cos", True),
+        P(unary(math.tan, vectorized("tan")), 1, "tan", True),
+        P(unary(math.sqrt, vectorized("sqrt")), 1, "racine", True),
+        P(unary(math.sqrt, vectorized("sqrt")), 1, "rc", True),
+    )
@@ -0,0 +1,247 @@
+"""
+Benchmarks of the LOGO interpreter stages and of the robot transport.
+
+    python2 bench.py -o results.json
+    python2 bench.py -o new.json --baseline results.json
+
+Each workload is timed separately when tokenized, analyzed and executed
+(by each engine); the startup evaluates the prelude with and without
+the cache of analyzed programs; the transport is measured through zumoturtle against
+a local simulator. Times are the best of several runs. With --baseline,
+metrics worse than the baseline by more than the tolerance are reported
+and the exit status is 1.
+"""
+
+import json
+import os
+import sys
+import time
+
+from logo import Evaluator, Env, Primitive, tokenize
+
+Prelude = os.path.join(os.path.dirname(os.path.abspath(__file__)), "prelude.logo")
+
+
+def robot_stubs():
+    """Primitives of primitives.primitives_fr, without robot"""
+    nothing = lambda *args: None
+    return [Primitive(nothing, 1, name) for name in ("av", "re", "ga", "dr", "p")] + [
+        Primitive(lambda threshold, sensors: False, 2, "sensors"),
+        Primitive(lambda index: 0, 1, "sol"),
+    ]
+
+
+def countdown():
+    """Primitives `depart n` and `encore`, true n times, for tantque"""
+    left = [0]
+    def start(n):
+        left[0] = n
+    def more():
+        left[0] -= 1
+        return left[0] >= 0
+    return [Primitive(start, 1, "depart"), Primitive(more, 0, "encore")]
+
+
+def big_source(procedures=500):
+    """A long program: many small procedures, then their calls"""
+    lines = []
+    for i in range(procedures):
+        lines += ["pour proc%d :a :b" % i,
+                  "    si :a > :b [av :a - :b] sinon [dr (:b - :a) * 2]",
+                  "fin"]
+    lines += ["proc%d %d %d" % (i, i, i % 7) for i in range(procedures)]
+    return "\n".join(lines)
+
+
+def messages_source(lines=1000):
+    """A long drawing script: a message and a comment on each line"""
+    return "\n".join('p "etape %d" av %d dr 90 ; coin %d' % (i, i % 50, i)
+                     for i in range(lines))
+
+
+def prelude_source():
+    with open(Prelude) as source:
+        return source.read()
+
+
+# (name, source or function returning it, extra primitives); sources
+# which are read or generated are only built by bench_interpreter
+Workloads = [
+    ("repete", "repete 20 [repete 20 [repete 20 [repete 5 [av 1]]]]", []),
+    ("recursion", """
+        pour fib :n
+            si :n < 2 :n sinon (fib :n - 1) + fib :n - 2
+        fin
+        fib 18
+    """, []),
+    ("tantque", "depart 20000 tantque encore [av 1]", countdown()),
+    ("lists", """
+        pour construit :n :acc
+            si :n = 0 :acc sinon construit :n - 1 :acc + [:n * 2 :n + 1]
+        fin
+        construit 1000 []
+    """, []),
+    ("prelude", prelude_source, []),
+    ("big", big_source, []),
+    ("messages", messages_source, []),
+]
+
+
+def best(func, repeat, min_time=0.02):
+    """
+    Best time (s) of a call to func, out of repeat measures. Fast
+    functions are called several times per measure, for min_time.
+    """
+    number = 1
+    while True:
+        start = time.time()
+        for i in xrange(number):
+            func()
+        elapsed = time.time() - start
+        if elapsed >= min_time:
+            break
+        number *= 10
+    times = [elapsed]
+    for i in range(repeat - 1):
+        start = time.time()
+        for i in xrange(number):
+            func()
+        times.append(time.time() - start)
+    return min(times) / number
+
+
+def analyze_all(evaluator, tokens):
+    """The nodes of a tokenized program"""
+    i, nodes = 0, []
+    while i < len(tokens):
+        node, i = evaluator.analyze(tokens, i)
+        if node is not None:
+            nodes.append(node)
+    return nodes
+
+
+def bench_interpreter(results, engines, repeat, optimize=False):
+    for name, source, primitives in Workloads:
+        if callable(source):
+            source = source()
+        tokens = list(tokenize(source))
+        results["tokenize/" + name] = (best(lambda: list(tokenize(source)), repeat), "s")
+
+        for engine in engines:
+            def evaluator():
+                env = Env(None, *(robot_stubs() + primitives))
+                return Evaluator(env, engine=engine, optimize=optimize)
+            results["analyze/%s/%s" % (engine, name)] = (
+                best(lambda: analyze_all(evaluator(), tokens), repeat), "s")
+
+            e = evaluator()
+            prog = [e.compile(e.optimize(node)) for node in analyze_all(e, tokens)]
+            def execute():
+                for func in prog:
+                    func(e.env)
+            results["execute/%s/%s" % (engine, name)] = (best(execute, repeat), "s")
+
+
+def bench_startup(results, repeat):
+    """Evaluation of the prelude, analyzed (cold) or from the cache (warm)"""
+    import shutil
+    import tempfile
+    from cache import Cache
+    directory = tempfile.mkdtemp()
+    try:
+        def startup(cache):
+            e = Evaluator(Env(None, *robot_stubs()))
+            cache.eval(e, Prelude)
+            return cache
+        def cold():
+            shutil.rmtree(directory, ignore_errors=True)
+            startup(Cache(directory))
+        results["startup/cold"] = (best(cold, repeat), "s")
+        cache = startup(Cache(directory))
+        results["startup/warm"] = (best(lambda: startup(cache), repeat), "s")
+        assert cache.hits and not cache.misses
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def bench_transport(results, commands, repeat):
+    from simulator import Simulator
+    simulator = Simulator(speed=0, port=0).start()
+    os.environ["ZUMO_PORT"] = str(simulator.port)
+    import zumoturtle
+    if not hasattr(zumoturtle, "send_cmd"):
+        print >>sys.stderr, "No connection to the simulator, transport not measured"
+        return
+
+    rtt = best(lambda: [zumoturtle.send_cmd('s', 0) for i in range(commands)], repeat)
+    results["transport/rtt"] = (rtt / commands, "s")
+    for mode, pipeline, blend in (("sync", False, False), ("pipeline", True, False),
+                                  ("blend", True, True)):
+        zumoturtle.set_pipeline(pipeline, blend)
+        def motions():
+            for i in range(commands):
+                zumoturtle.forward(1)
+            zumoturtle.sync()
+        results["transport/motions/" + mode] = (commands / best(motions, repeat), "cmd/s")
+    zumoturtle.set_pipeline(False)
+
+
+def compare(results, baseline, tolerance):
+    """(name, baseline, value, ratio) of the metrics worse than in baseline by more than tolerance"""
+    regressions = []
+    for name, (value, unit) in sorted(results.items()):
+        if name not in baseline or not baseline[name][0]:
+            continue
+        old = baseline[name][0]
+        # Times: lower is better; rates: higher is better
+        ratio = value / old if unit == "s" else old / value if value else float("inf")
+        if ratio > 1 + tolerance:
+            regressions.append((name, old, value, ratio))
+    return regressions
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Benchmarks of the LOGO interpreter and robot transport")
+    parser.add_argument("-o", "--output", help="write results to this JSON file")
+    parser.add_argument("--baseline", help="JSON results to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="slowdown reported as a regression (default: 0.2, 20%%)")
+    parser.add_argument("--engine", choices=Evaluator.Engines, action="append",
+                        help="engine to execute with (default: all)")
+    parser.add_argument("-O", "--optimize", action="store_true", help="with the optimizer")
+    parser.add_argument("--repeat", type=int, default=5, help="runs of each measure (default: 5)")
+    parser.add_argument("--commands", type=int, default=500,
+                        help="robot commands of each transport measure (default: 500)")
+    parser.add_argument("--no-transport", action="store_true")
+    args = parser.parse_args()
+
+    results = {}
+    bench_interpreter(results, args.engine or Evaluator.Engines, args.repeat, args.optimize)
+    bench_startup(results, args.repeat)
+    if not args.no_transport:
+        bench_transport(results, args.commands, args.repeat)
+
+    for name, (value, unit) in sorted(results.items()):
+        if unit == "s":
+            print "%-32s %10.3f ms" % (name, value * 1000)
+        else:
+            print "%-32s %10.0f %s" % (name, value, unit)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"python": sys.version.split()[0], "optimize": args.optimize,
+                       "results": results}, f, indent=1, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.tolerance)
+        for name, old, value, ratio in regressions:
+            print "\033[31;1mRegression\033[0m %s: %.4g -> %.4g (x%.2f)" % (name, old, value, ratio)
+        if regressions:
+            sys.exit(1)
+        print "No regression against", args.baseline
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+"""
+On-disk cache of analyzed LOGO programs.
+
+The first evaluation of a file records the analysis (procedure
+definitions and bodies, `donne` values, top-level forms), then writes
+it in the cache directory. Next evaluations replay the recording in the
+Evaluator instead of tokenizing and analyzing the source again.
+
+A recording is found by a hash of the source, of the keywords, scoping,
+optimization and move_while of the Evaluator, of the interpreter source, and of
+the names defined in the Evaluator's env (their arity changes how the
+source is analyzed, and loops testing procedures which are ground tests
+are lowered with their test, see optimize.lower_while). Programs whose
+`donne` values are not pure, and so can't be replayed without their
+effects, are not cached.
+"""
+
+import cPickle as pickle
+import hashlib
+import os
+
+import logo
+import optimize
+from logo import Procedure, Primitive
+
+# Version of the recordings format
+FORMAT = 1
+
+_interpreter = []
+
+
+def interpreter_hash():
+    """Hash of the source of the modules producing analyzed nodes"""
+    if not _interpreter:
+        h = hashlib.sha1()
+        for module in (logo, optimize):
+            path = module.__file__
+            if path.endswith(".pyc") and os.path.exists(path[:-1]):
+                path = path[:-1]
+            with open(path, "rb") as f:
+                h.update(f.read())
+        _interpreter.append(h.hexdigest())
+    return _interpreter[0]
+
+
+def defined(env):
+    """{name: value} of everything defined in env and its parents"""
+    names = {}
+    while env is not None:
+        for name, value in env.content.iteritems():
+            names.setdefault(name, value)
+        env = env.parent
+    return names
+
+
+def expression(node):
+    """Text of a standalone node (see optimize.standalone)"""
+    kind = node[0]
+    if kind == 'const':
+        return repr(node[1])
+    elif kind == 'list':
+        return "[%s]" % " ".join(map(expression, node[1]))
+    elif kind == 'lookup':
+        return ":" + node[1]
+    return ":" + node[2]
+
+
+def signature(value):
+    if isinstance(value, Procedure):
+        if value.test is not None:
+            threshold, sensors, above = value.test
+            return "pour/%d %s %s %s" % (value.arity, expression(threshold),
+                                         expression(sensors), above)
+        return "pour/%d" % value.arity
+    elif isinstance(value, Primitive):
+        return "prim/%d" % value.arity
+    return "val/" + repr(value)
+
+
+def key(evaluator, source):
+    h = hashlib.sha1()
+    h.update("%d %s %s %s %s\n" % (FORMAT, interpreter_hash(), evaluator.scoping,
+                                   bool(evaluator.optimizing), evaluator.move_while))
+    h.update(repr(sorted(evaluator.keywords.items())) + "\n")
+    for name, value in sorted(defined(evaluator.env).iteritems()):
+        h.update("%s %s\n" % (name, signature(value)))
+    h.update(source)
+    return h.hexdigest()
+
+
+class NotCacheable(Exception):
+    pass
+
+
+class Dumper(object):
+    """Turn a recording into picklable data, callables referenced by name"""
+
+    def __init__(self, existing):
+        # Procedures defined before the recording
+        self.existing = existing
+        self.ids = {}
+        self.procedures = []
+        self.primitives = set()
+
+    def ref(self, callable):
+        if isinstance(callable, Procedure):
+            if id(callable) not in self.ids:
+                self.ids[id(callable)] = len(self.procedures)
+                self.procedures.append(callable)
+            return ('pour', self.ids[id(callable)])
+        self.primitives.add(callable.name)
+        return ('prim', callable.name)
+
+    def node(self, node):
+        kind = node[0]
+        if kind in ('call', 'tailcall'):
+            return (kind, self.ref(node[1]), map(self.node, node[2])) + node[3:]
+        elif kind == 'global':
+            return ('global', None) + node[2:]
+        elif kind in ('list', 'seq'):
+            return (kind, map(self.node, node[1]))
+        elif kind in ('repeat', 'while'):
+            return (kind, self.node(node[1]), self.node(node[2]))
+        elif kind == 'if':
+            return ('if', self.node(node[1]), self.node(node[2]), self.node(node[3]))
+        elif kind == 'hoist':
+            return ('hoist', [(slot, self.node(expr)) for slot, expr in node[1]],
+                    self.node(node[2]))
+        return node
+
+    def event(self, event):
+        kind = event[0]
+        if kind == 'define':
+            procedure = event[1]
+            outer = procedure.outer and self.ref(procedure.outer)[1]
+            return ('define', self.ref(procedure)[1], procedure.name,
+                    procedure.arg_names, outer)
+        elif kind == 'body':
+            return ('body', self.ref(event[1])[1], event[1].temps, self.node(event[2]))
+        elif kind == 'donne':
+            if not optimize.is_pure(event[3]):
+                raise NotCacheable("donne %s has effects" % event[1])
+            return ('donne', event[1], event[2])
+        return ('form', self.node(event[1]))
+
+    def dump(self, record):
+        events = map(self.event, record)
+        procedures = []
+        for procedure in self.procedures:
+            if self.existing.get(procedure.name) is procedure:
+                procedures.append(('extern', procedure.name))
+            else:
+                procedures.append(('new', procedure.name))
+        return {'procedures': procedures, 'primitives': sorted(self.primitives),
+                'events': events}
+
+
+class Loader(object):
+    """Replay dumped data in an Evaluator"""
+
+    def __init__(self, evaluator, data):
+        self.evaluator = evaluator
+        self.data = data
+        env = evaluator.env
+        self.procedures = [env[name] if kind == 'extern' else None
+                           for kind, name in data['procedures']]
+        self.primitives = dict((name, env[name]) for name in data['primitives'])
+
+    def ref(self, ref):
+        if ref[0] == 'pour':
+            return self.procedures[ref[1]]
+        return self.primitives[ref[1]]
+
+    def node(self, node):
+        kind = node[0]
+        if kind in ('call', 'tailcall'):
+            return (kind, self.ref(node[1]), map(self.node, node[2])) + node[3:]
+        elif kind == 'global':
+            return ('global', self.evaluator.env) + node[2:]
+        elif kind in ('list', 'seq'):
+            return (kind, map(self.node, node[1]))
+        elif kind in ('repeat', 'while'):
+            return (kind, self.node(node[1]), self.node(node[2]))
+        elif kind == 'if':
+            return ('if', self.node(node[1]), self.node(node[2]), self.node(node[3]))
+        elif kind == 'hoist':
+            return ('hoist', [(slot, self.node(expr)) for slot, expr in node[1]],
+                    self.node(node[2]))
+        return node
+
+    def load(self):
+        """Return the compiled top-level forms"""
+        evaluator, prog = self.evaluator, []
+        for event in self.data['events']:
+            kind = event[0]
+            if kind == 'define':
+                index, name, arg_names, outer = event[1:]
+                outer = None if outer is None else self.procedures[outer]
+                self.procedures[index] = evaluator.define_procedure(name, arg_names, outer)
+            elif kind == 'body':
+                procedure = self.procedures[event[1]]
+                procedure.temps = event[2]
+                evaluator.set_body(procedure, self.node(event[3]))
+            elif kind == 'donne':
+                evaluator.env[event[1]] = event[2]
+            else:
+                prog.append(evaluator.compile(evaluator.optimize(self.node(event[1]))))
+        return prog
+
+
+class Cache(object):
+    """Directory of recordings; hits and misses count evaluations"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.hits = self.misses = 0
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".pickle")
+
+    def parse(self, evaluator, source):
+        """Return the compiled top-level forms of source (a string)"""
+        k = key(evaluator, source)
+        try:
+            with open(self.path(k), "rb") as f:
+                data = pickle.load(f)
+        except Exception:
+            data = None
+        if data is not None:
+            self.hits += 1
+            return Loader(evaluator, data).load()
+
+        self.misses += 1
+        existing = dict((name, value) for name, value in evaluator.env.content.iteritems()
+                        if isinstance(value, Procedure))
+        evaluator.record = []
+        try:
+            prog = evaluator.parse(source)
+            record = evaluator.record
+        finally:
+            evaluator.record = None
+        self.save(k, Dumper(existing), record)
+        return prog
+
+    def save(self, k, dumper, record):
+        try:
+            data = pickle.dumps(dumper.dump(record), pickle.HIGHEST_PROTOCOL)
+        except (NotCacheable, pickle.PicklingError, TypeError):
+            return
+        # Written at once, for concurrent interpreters
+        tmp = "%s.%d" % (self.path(k), os.getpid())
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.rename(tmp, self.path(k))
+        except (IOError, OSError):
+            # Not cached, the program runs anyway
+            pass
+
+    def load(self, evaluator, path):
+        """Return the compiled top-level forms of the LOGO file path"""
+        with open(path) as f:
+            return self.parse(evaluator, f.read())
+
+    def eval(self, evaluator, path):
+        """Execute the LOGO file path"""
+        return evaluator.run(self.load(evaluator, path))
@@ -1,6 +1,20 @@
+"""
+Calibration of a Zumo, written to zumoadjust.py:
+
+    python2 calibration.py          # by answering questions
+    python2 calibration.py --auto   # alone, on the calibration mat
+
+The calibration mat is white with two black lines, 3 cm wide, across
+the way of the robot: the first one a few cm ahead of it, the second
+one --line-gap mm further (from edge to edge).
+"""
+
+import math
 import os
 
+import zumoturtle
 from zumoturtle import forward, backward, turnLeft, turnRight, changeLeftAdjust
+from simulator import WHEELBASE, SENSOR_LEFT
 
 LEFICHIERQUITUE = "zumoadjust.py"
 def vtff():
@@ -56,9 +70,201 @@ def onpollueledisque(a, b, c):
     with open(LEFICHIERQUITUE, "w") as f:
         f.write("LEFT_ADJUST=%f\n" % a)
         f.write("ROTATION_ADJUST=%f\n" % b)
-        f.write("BLACK_THRES=%d\n" % c) # TODO
+        f.write("BLACK_THRES=%d\n" % c)
+
+
+class CalibrationError(Exception):
+    pass
+
+
+class Calibrator(object):
+    """
+    Calibration on the mat, with the ground sensors. Each run crosses
+    both lines: the sensors meet a line at distances whose differences
+    give the angle of the robot to it. The turn of the robot from the
+    first line to the second gives its drift, and crossing the first one
+    again after a full turn its rotation error. The white and black
+    readings give the threshold.
+
+    robot has the functions of zumoturtle; applied is the rotation
+    adjustment its turns already apply (zumoturtle.ROTATION_ADJUST).
+    """
+    # A line is under the sensors when their sum is more than this
+    # times the sum on white
+    LINE_FACTOR = 2
+    # Readings of the white level
+    SAMPLES = 5
+
+    def __init__(self, robot, left_adjust=1.0, rotation_adjust=1.0, applied=1.0,
+                 line_gap=300.0, coarse=10, skew=40, max_travel=1000):
+        self.robot = robot
+        self.left_adjust = left_adjust
+        self.rotation_adjust = rotation_adjust
+        self.applied = applied
+        self.line_gap = line_gap
+        self.coarse = coarse
+        self.skew = skew
+        self.max_travel = max_travel
+        self.black_thres = None
+        # Distance travelled from the start of the run
+        self.position = 0
+
+    def move_to(self, position):
+        if position > self.position:
+            self.robot.forward(position - self.position)
+        elif position < self.position:
+            self.robot.backward(self.position - position)
+        self.position = position
+
+    def turn(self, angle):
+        """Turn left by angle (degrees, right if negative), adjusted"""
+        angle *= self.rotation_adjust / self.applied
+        if angle > 0:
+            self.robot.turnLeft(angle)
+        else:
+            self.robot.turnRight(-angle)
+
+    def find_line(self, white):
+        """
+        Move forward, coarsely, onto the next line and across it; return
+        where it was met and the highest sum of readings on it.
+        """
+        robot, black = self.robot, 0
+        while robot.getGroundSensorSum() > self.LINE_FACTOR * white:
+            self.advance()
+        while True:
+            reading = robot.getGroundSensorSum()
+            if reading > self.LINE_FACTOR * white:
+                break
+            self.advance()
+        start = self.position
+        while reading > self.LINE_FACTOR * white:
+            black = max(black, reading)
+            self.advance()
+            reading = robot.getGroundSensorSum()
+        return start, black
+
+    def advance(self, step=None):
+        if self.position >= self.max_travel:
+            raise CalibrationError("Pas de ligne a moins de %d" % self.max_travel)
+        self.move_to(self.position + (step or self.coarse))
+
+    def crossing(self, start):
+        """
+        From start, before a line, move forward one by one until both
+        sensors 0 and 5 are on it, or until skew after the first sensor
+        on it (the robot is far from across the line); return {sensor
+        index: where it met the line}.
+        """
+        robot, met = self.robot, {}
+        self.move_to(start)
+        while True:
+            for index in range(len(SENSOR_LEFT)):
+                if index not in met and robot.getGroundSensor(index) >= self.black_thres:
+                    met[index] = self.position
+            if 0 in met and 5 in met or \
+               len(met) > 1 and self.position - min(met.values()) >= self.skew:
+                return met
+            self.advance(1)
+
+    @staticmethod
+    def angle(met, step):
+        """
+        Angle (radians) of the robot to the perpendicular of a line,
+        from the sensors which met it farthest apart; step is the mm
+        per unit of forward.
+        """
+        i, j = min(met), max(met)
+        return math.atan((met[i] - met[j]) * step / (SENSOR_LEFT[i] - SENSOR_LEFT[j]))
+
+    def run(self, tolerance=0.0):
+        """
+        Measure once, from the start of the mat, and come back to it.
+        The drift is corrected before the rotation error is measured;
+        errors beyond tolerance are corrected. Return both (radians).
+        """
+        robot = self.robot
+        self.position = 0
+        white = sum(robot.getGroundSensorSum() for i in range(self.SAMPLES)) / float(self.SAMPLES)
+        first, black = self.find_line(white)
+        # Half way between white and black, for each sensor
+        self.black_thres = int((white + black) / 2 / len(SENSOR_LEFT))
+        line1 = self.crossing(max(0, first - self.coarse))
+        second, black = self.find_line(white)
+        line2 = self.crossing(second - self.coarse)
+
+        # mm per unit of forward
+        both = set(line1) & set(line2)
+        if not both:
+            raise CalibrationError("Aucun capteur n'a croise les deux lignes")
+        step = self.line_gap / (sum(line2[i] - line1[i] for i in both) / float(len(both)))
+        drift = self.angle(line2, step) - self.angle(line1, step)
+
+        # Back to the first line along the same curve, for the heading
+        # of the first crossing, far enough for the sensors to stay off
+        # the line while turning
+        spin = max(0, first - 3 * self.coarse)
+        self.move_to(spin)
+        if abs(drift) > tolerance:
+            # Ratio of the left to the right wheel speeds, from the turn
+            # over the distance between the lines
+            a = drift * WHEELBASE / (2 * self.line_gap)
+            self.left_adjust /= (1 - a) / (1 + a)
+            robot.changeLeftAdjust(self.left_adjust)
+        self.turn(360)
+        again = self.crossing(spin)
+        self.move_to(spin)
+        # Back to the heading of the start, with the same error
+        self.turn(-360)
+        self.move_to(0)
+        error = self.angle(again, step) - self.angle(line1, step)
+        if abs(error) > tolerance:
+            self.rotation_adjust *= 2 * math.pi / (2 * math.pi + error)
+        return drift, error
+
+    def calibrate(self, runs=4, tolerance=math.radians(1), report=None):
+        """
+        Run until both errors are within tolerance (radians), at most runs
+        times; return left_adjust, rotation_adjust and black_thres.
+        """
+        for i in range(runs):
+            drift, error = self.run(tolerance)
+            if report is not None:
+                report(i, drift, error)
+            if abs(drift) <= tolerance and abs(error) <= tolerance:
+                break
+        return self.left_adjust, self.rotation_adjust, self.black_thres
+
+
+def auto(args):
+    print "Posez le Zumo au debut du tapis de calibration, face aux lignes"
+    raw_input()
+    left_adjust, rotation_adjust, black_thres = recyclage()
+    changeLeftAdjust(left_adjust)
+    calibrator = Calibrator(zumoturtle, left_adjust, rotation_adjust,
+                            zumoturtle.ROTATION_ADJUST, args.line_gap)
+    def report(i, drift, error):
+        print "Essai %d: derive %.1f degres, erreur de rotation %.1f degres" % (
+            i + 1, math.degrees(drift), math.degrees(error))
+    try:
+        result = calibrator.calibrate(args.runs, report=report)
+    except CalibrationError as err:
+        print "Calibration impossible:", err
+        return
+    print "LEFT_ADJUST=%f ROTATION_ADJUST=%f BLACK_THRES=%d" % result
+    onpollueledisque(*result)
 
 def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Calibration of a Zumo, written to " + LEFICHIERQUITUE)
+    parser.add_argument("--auto", action="store_true",
+                        help="calibrate alone, with the ground sensors, on the calibration mat")
+    parser.add_argument("--line-gap", type=float, default=300.0,
+                        help="distance (mm) between the lines of the mat (default: 300)")
+    parser.add_argument("--runs", type=int, default=4, help="most runs on the mat (default: 4)")
+    args = parser.parse_args()
+    if args.auto:
+        return auto(args)
     print "Mettez le Zumo face a une ligne noire et de preference pas contre un mur"
     raw_input()
     left_adjust, rotation_adjust, black_thres = recyclage()
@@ -0,0 +1,108 @@
+"""
+Index of the names known to an Evaluator, for the completion of the REPL.
+
+The index is kept up to date by the environments it is attached to (see
+Env.__setitem__), as `pour` and `donne` define names, and answers prefix
+queries from a trie instead of scanning every name:
+
+    index = SymbolIndex(evaluator.env, evaluator.keywords.values())
+    index.complete("ca")        # ['carre', ...]
+"""
+
+from logo import Procedure, Primitive
+
+# Completions come by kind in this order, then alphabetically; the
+# arguments of the procedure being typed first
+Ranks = {'argument': 0, 'procedure': 1, 'primitive': 2, 'keyword': 3, 'variable': 4}
+
+
+class Trie(object):
+    """Words and their values, by prefix"""
+
+    # Key of the value of a word in its node (not a character)
+    END = ''
+
+    def __init__(self):
+        self.root = {}
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def __setitem__(self, word, value):
+        node = self.root
+        for char in word:
+            node = node.setdefault(char, {})
+        if self.END not in node:
+            self.size += 1
+        node[self.END] = value
+
+    def get(self, word, default=None):
+        node = self.root
+        for char in word:
+            node = node.get(char)
+            if node is None:
+                return default
+        return node.get(self.END, default)
+
+    def items(self, prefix=""):
+        """(word, value) of the words starting with prefix"""
+        node = self.root
+        for char in prefix:
+            node = node.get(char)
+            if node is None:
+                return []
+        res, stack = [], [(prefix, node)]
+        while stack:
+            word, node = stack.pop()
+            for char, child in node.iteritems():
+                if char == self.END:
+                    res.append((word, child))
+                else:
+                    stack.append((word + char, child))
+        return res
+
+
+def kind(value):
+    if isinstance(value, Procedure):
+        return 'procedure'
+    elif isinstance(value, Primitive):
+        return 'primitive'
+    return 'variable'
+
+
+class SymbolIndex(object):
+    """The names of env and its parents, and the keywords"""
+
+    def __init__(self, env=None, keywords=()):
+        self.names = Trie()
+        for keyword in keywords:
+            self.names[keyword] = 'keyword'
+        if env is not None:
+            self.attach(env)
+
+    def attach(self, env):
+        """Index the names of env and its parents, and those they will define"""
+        chain = []
+        while env is not None:
+            chain.append(env)
+            env = env.parent
+        # Inner names hide outer ones
+        for env in reversed(chain):
+            env.index = self
+            for name, value in env.content.iteritems():
+                self.define(name, value)
+
+    def define(self, name, value):
+        self.names[name] = kind(value)
+
+    def complete(self, prefix, arguments=()):
+        """
+        Names starting with prefix, best first; arguments are the names
+        of the arguments of the procedure being typed.
+        """
+        ranks = dict((name, Ranks[kind]) for name, kind in self.names.items(prefix))
+        for name in arguments:
+            if name.startswith(prefix):
+                ranks[name] = Ranks['argument']
+        return sorted(ranks, key=lambda name: (ranks[name], name))
@@ -0,0 +1,249 @@
+"""
+Check many LOGO scripts at once, without robot, on all cores.
+
+    python2 corpus.py eleves/ ateliers/*.logo --json rapport.json
+
+Each script runs on a Planner (see planner.py), in a pool of worker
+processes. Every worker analyzes the prelude once; the scripts it runs
+then get their own environment on top of it, as the sessions of
+server.py. A script is stopped after --timeout seconds or --max-steps
+steps of the vm engine (calls and loop iterations), whichever comes
+first: steps are only counted where the vm may suspend a task, so the
+timeout is also enforced by an alarm signal, which stops the procedures
+called by primitives (applique...) as well. The report has, for each script, its status, its result or
+error, what it printed, its commands, its steps and its duration.
+"""
+
+import json
+import multiprocessing
+import os
+import signal
+import sys
+import time
+from StringIO import StringIO
+
+from logo import Evaluator, Env, Primitive, ProgramError
+from planner import Planner, Prelude, TooLong
+from primitives import primitives_fr
+import arrays
+import vm
+
+
+class OutOfSteps(ProgramError):
+    pass
+
+
+class Timeout(ProgramError):
+    pass
+
+
+class Quit(Exception):
+    """`q` in a script: it ends there"""
+
+
+class Binding(object):
+    """The functions of the Planner of the script being run"""
+
+    def __init__(self):
+        self.planner = None
+
+    def __getattr__(self, name):
+        def f(*args):
+            return getattr(self.planner, name)(*args)
+        f.__name__ = name
+        return f
+
+
+class Budget(object):
+    """
+    At most max_steps steps, and timeout seconds; spend() raises when
+    exceeded. The clock is only read every CHECK steps.
+    """
+    CHECK = 1000
+
+    def __init__(self, max_steps=None, timeout=None, clock=time.time):
+        self.max_steps = max_steps
+        self.clock = clock
+        self.deadline = None if timeout is None else clock() + timeout
+        self.timeout = timeout
+        self.steps = 0
+
+    def spend(self):
+        self.steps += 1
+        if self.max_steps is not None and self.steps > self.max_steps:
+            raise OutOfSteps("More than %d steps" % self.max_steps)
+        if self.deadline is not None and not self.steps % self.CHECK and \
+           self.clock() > self.deadline:
+            raise Timeout("More than %gs" % self.timeout)
+
+
+def execute(form, env, budget):
+    """Run a compiled top-level form, spending a step of budget at each suspension"""
+    if type(form) is not vm.Code:
+        return form(env)
+    result = []
+    steps = vm.execute(form, env, result, preemptive=True)
+    value = None
+    try:
+        while True:
+            call = steps.send(value)
+            value = None
+            budget.spend()
+            if call is not None:
+                # A blocking primitive, run at once
+                func, args = call
+                value = func(*args)
+    except StopIteration:
+        return result[0]
+
+
+class Runner(object):
+    """
+    Runs scripts one after the other in an environment with the prelude
+    analyzed once. planner holds the options of the Planner of each
+    script (see planner.Planner).
+    """
+
+    def __init__(self, prelude=Prelude, max_steps=None, timeout=None, **planner):
+        def quit():
+            raise Quit()
+        self.binding = Binding()
+        self.planner = planner
+        self.max_steps, self.timeout = max_steps, timeout
+        evaluator = Evaluator(Env(None, *primitives_fr(self.binding)), engine="vm")
+        evaluator.env["q"] = Primitive(quit, 0, "q")
+        evaluator.env["quit"] = Primitive(quit, 0, "quit")
+        self.binding.planner = Planner(**planner)
+        with open(prelude) as source:
+            evaluator.eval(source)
+        self.env = evaluator.env
+
+    def expired(self, signum, frame):
+        raise Timeout("More than %gs" % self.timeout)
+
+    def run(self, path):
+        """
+        The report of the script at path. The timeout is enforced by
+        SIGALRM: run it in the main thread of the process.
+        """
+        planner = self.binding.planner = Planner(trace=True, **self.planner)
+        evaluator = Evaluator(self.env, engine="vm")
+        for primitive in arrays.primitives_fr(evaluator.env):
+            evaluator.env[primitive.name] = primitive
+        budget = Budget(self.max_steps, self.timeout)
+        report = {"status": "ok", "result": None}
+        stdout, sys.stdout = sys.stdout, StringIO()
+        start = time.time()
+        handler = None
+        try:
+            if self.timeout is not None:
+                handler = signal.signal(signal.SIGALRM, self.expired)
+                signal.setitimer(signal.ITIMER_REAL, self.timeout)
+            try:
+                with open(path) as source:
+                    for form in evaluator.forms(source):
+                        report["result"] = execute(form, evaluator.env, budget)
+            finally:
+                if handler is not None:
+                    signal.setitimer(signal.ITIMER_REAL, 0)
+                    signal.signal(signal.SIGALRM, handler)
+        except Quit:
+            pass
+        except Exception as err:
+            report["status"] = {OutOfSteps: "steps", Timeout: "timeout",
+                                TooLong: "too long"}.get(type(err), "error")
+            report["error"] = "%s: %s" % (err.__class__.__name__, err)
+            where = getattr(err, 'where', None)
+            if where is not None:
+                report["line"], report["column"] = where
+        finally:
+            report["output"], sys.stdout = sys.stdout.getvalue(), stdout
+        report["elapsed"] = time.time() - start
+        report["steps"] = budget.steps
+        report["robot"] = planner.summary()
+        report["trace"] = planner.trace
+        # Results which are not JSON values (arrays...) are reported as text
+        if not isinstance(report["result"], (int, long, float, basestring, bool, type(None))):
+            report["result"] = str(report["result"])
+        return path, report
+
+
+# The Runner of a worker process
+_runner = None
+
+def init_worker(options):
+    global _runner
+    _runner = Runner(**options)
+
+def run_script(path):
+    return _runner.run(path)
+
+
+def scripts(paths):
+    """The .logo files of paths, which are files or directories"""
+    res = []
+    for path in paths:
+        if not os.path.isdir(path):
+            res.append(path)
+            continue
+        for directory, dirs, files in os.walk(path):
+            dirs.sort()
+            res.extend(os.path.join(directory, name) for name in sorted(files)
+                       if name.endswith(".logo"))
+    return res
+
+
+def run_corpus(paths, jobs=None, **options):
+    """
+    Run the scripts in a pool of jobs processes (one per core by
+    default); return {script: report}. options are those of Runner.
+    """
+    pool = multiprocessing.Pool(jobs, init_worker, (options,))
+    try:
+        return dict(pool.imap_unordered(run_script, paths))
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Run many LOGO scripts without robot, on all cores")
+    parser.add_argument("paths", nargs="+", help="LOGO scripts, or directories of them")
+    parser.add_argument("-j", "--jobs", type=int, help="worker processes (default: one per core)")
+    parser.add_argument("--timeout", type=float, default=10.0,
+                        help="seconds of computation of a script (default: 10)")
+    parser.add_argument("--max-steps", type=int, default=10**7,
+                        help="calls and loop iterations of a script (default: 10000000)")
+    parser.add_argument("--max-time", type=float, default=3600.0,
+                        help="stop scripts moving the robot longer than this (s, default: 3600)")
+    parser.add_argument("--blend", action="store_true",
+                        help="blend motions in the same direction, as repl.py --blend")
+    parser.add_argument("--json", metavar="FILE", help="write the report to FILE (default: stdout)")
+    args = parser.parse_args()
+
+    try:
+        from zumoadjust import ROTATION_ADJUST
+    except ImportError:
+        ROTATION_ADJUST = 1.0
+    paths = scripts(args.paths)
+    start = time.time()
+    report = run_corpus(paths, args.jobs, max_steps=args.max_steps, timeout=args.timeout,
+                        max_time=args.max_time, blend=args.blend,
+                        rotation_adjust=ROTATION_ADJUST)
+    elapsed = time.time() - start
+    failed = sorted(path for path, script in report.items() if script["status"] != "ok")
+    for path in failed:
+        print >>sys.stderr, "\033[1;31m[ERROR]\033[0m %s: %s" % (path, report[path]["error"])
+    print >>sys.stderr, "%d scripts en %.1f s, %d en erreur" % (len(paths), elapsed, len(failed))
+
+    out = open(args.json, "w") if args.json else sys.stdout
+    try:
+        json.dump({"scripts": report, "elapsed": elapsed}, out, indent=1, sort_keys=True)
+    finally:
+        if args.json:
+            out.close()
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
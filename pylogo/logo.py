@@ -12,16 +12,36 @@ Example LOGO program
 
 import math
 import re
+from collections import namedtuple, OrderedDict
 
 # http://slps.github.io/zoo/logo/sdf.html
 
-class ParseError(Exception):
+class LogoError(Exception):
+    """An error in a LOGO program, possibly located at a source token"""
+    token = None
+
+    def at(self, token):
+        """Locate this error at token, unless already located"""
+        if self.token is None:
+            self.token = token
+        return self
+
+    @property
+    def where(self):
+        if self.token is None:
+            return None
+        return self.token.line, self.token.col
+
+class ParseError(LogoError):
     pass
 
 class UnterminatedExpression(ParseError):
     pass
 
-class ProgramError(Exception):
+class EndOfTokens(Exception):
+    """Analysis reached the end of the tokens (see Evaluator.token)"""
+
+class ProgramError(LogoError):
     pass
 
 class UnknowIdentifier(ProgramError):
@@ -30,10 +50,164 @@ class UnknowIdentifier(ProgramError):
 class TrollException(ProgramError):
     pass
 
+class StackOverflow(ProgramError):
+    pass
+
+
+NUMBER, WORD, VAR, OPERATOR, BRACKET, STRING = \
+    "number", "word", "var", "operator", "bracket", "string"
+
+class Token(namedtuple("Token", "kind text line rank source")):
+    """
+    A lexical token, found on source line number line. Its column is
+    computed on demand from its rank among the lexemes of that line.
+    """
+    __slots__ = ()
+
+    @property
+    def col(self):
+        for rank, match in enumerate(Lexer.Pattern.finditer(self.source)):
+            if rank == self.rank:
+                return match.start() + 1
+
+class Lexer(object):
+    """
+    Split LOGO source into Tokens, one line at a time. A string may
+    span several lines: the lexer keeps it pending until its closing quote.
+    """
+
+    Pattern = re.compile(r'''
+        ;.*                         # comment, up to the end of line
+      | "[^"]*"?                    # string, maybe continued on next lines
+      | [<>]=?|[=+\-*/]             # operator
+      | [\[\]()]                     # bracket
+      | [^\s;"<>=+\-*/\[\]()]+       # number, word or :var
+    ''', re.VERBOSE)
+
+    # Token kind, by first character of the lexeme (default: WORD)
+    Kinds = dict.fromkeys("0123456789", NUMBER)
+    Kinds.update(dict.fromkeys("<>=+-*/", OPERATOR))
+    Kinds.update(dict.fromkeys("[]()", BRACKET))
+    Kinds.update({':': VAR, '"': STRING, ';': None})
+
+    def __init__(self):
+        self.lineno = 0
+        self.pending = None
+
+    def scan(self, line):
+        """Return the list of tokens completed by this line of source"""
+        self.lineno += 1
+        # A string left open takes the rest of the line, hence its quote is
+        # the last one: with an even number of quotes, all strings are closed
+        quotes = line.count('"')
+        if self.pending is not None or quotes & 1:
+            return self.scan_strings(line)
+        lexemes = self.Pattern.findall(line)
+        # A comment takes the rest of the line: it is the last lexeme
+        if lexemes and lexemes[-1][0] == ';':
+            lexemes.pop()
+        new, kind, lineno = tuple.__new__, self.Kinds.get, self.lineno
+        res = [new(Token, (kind(lexeme[0], WORD), lexeme, lineno, rank, line))
+               for rank, lexeme in enumerate(lexemes)]
+        if quotes:
+            for n, token in enumerate(res):
+                if token.kind == STRING:
+                    res[n] = self.string(token, [token.text[1:-1]])
+        return res
+
+    def scan_strings(self, line):
+        res = []
+        if self.pending is not None:
+            parts, token = self.pending
+            close = line.find('"')
+            if close < 0:
+                parts.append(line)
+                return res
+            parts.append(line[:close])
+            self.pending = None
+            res.append(self.string(token, parts))
+            # Blank the end of the string, so that ranks stay valid
+            line = " " * (close+1) + line[close+1:]
+
+        for rank, lexeme in enumerate(self.Pattern.findall(line)):
+            kind = self.Kinds.get(lexeme[0], WORD)
+            token = Token(kind, lexeme, self.lineno, rank, line)
+            if kind == STRING:
+                if len(lexeme) > 1 and lexeme[-1] == '"':
+                    res.append(self.string(token, [lexeme[1:-1]]))
+                else:
+                    self.pending = ([lexeme[1:]], token)
+            elif kind is not None:
+                res.append(token)
+        return res
+
+    @staticmethod
+    def string(token, parts):
+        # Words of a string are separated by single spaces
+        return token._replace(text=" ".join(" ".join(parts).split()))
+
+    def close(self):
+        """Signal the end of the source"""
+        if self.pending is not None:
+            parts, token = self.pending
+            raise UnterminatedExpression("Unterminated String").at(token)
+
+def tokenize_lines(source):
+    """
+    Generate, for each line of source (a string or a file-like object),
+    the list of Tokens it completes
+    """
+    if isinstance(source, basestring):
+        source = source.splitlines(True)
+    lexer = Lexer()
+    for line in source:
+        yield lexer.scan(line)
+    lexer.close()
+
+def tokenize(source):
+    """Generate the Tokens of source, a string or a file-like object"""
+    for tokens in tokenize_lines(source):
+        for token in tokens:
+            yield token
+
+class TokenStream(list):
+    """
+    The tokens of tokenize_lines, read as the analyzer reaches them:
+    when tokens[i] raises IndexError, tokens.pull(i) reads more lines and
+    returns the token, or raises EndOfTokens at the end of the source.
+    """
+
+    # Number of tokens read ahead of the requested one when pulling
+    Lookahead = 256
+
+    def __init__(self, lines):
+        super(TokenStream, self).__init__()
+        self.lines = iter(lines)
+
+    def pull(self, i):
+        end = i + self.Lookahead
+        for tokens in self.lines:
+            self.extend(tokens)
+            if end < len(self):
+                break
+        if i >= len(self):
+            raise EndOfTokens(i)
+        return self[i]
+
+    def release(self, i):
+        """Forget the tokens before index i, return the new index of i"""
+        if i < self.Lookahead:
+            return i
+        del self[:i]
+        return 0
+
 
 class Env(object):
     """An environment object, referencing its outer environment"""
 
+    # SymbolIndex told of the names defined (see completion.py)
+    index = None
+
     def __init__(self, parent=None, *callables, **content):
         self.parent = parent
         self.content = {k: v for k, v in content.iteritems()}
@@ -49,6 +223,8 @@ class Env(object):
 
     def __setitem__(self, key, val):
         self.content[key] = val
+        if self.index is not None:
+            self.index.define(key, val)
 
     def __contains__(self, key):
         if key in self.content:
@@ -57,6 +233,14 @@ class Env(object):
             return key in self.parent
         return False
 
+    def get(self, key, default=None):
+        """Return env[key] if key is defined, else default"""
+        if key in self.content:
+            return self.content[key]
+        elif self.parent is not None:
+            return self.parent.get(key, default)
+        return default
+
     def keys(self):
         res = set(self.content.keys())
         if self.parent:
@@ -64,9 +248,64 @@ class Env(object):
         return res
 
     @classmethod
-    def lookup(klass, name):
+    def lookup(klass, name, token=None):
         """Return a lambda(env) -> env[name]"""
-        return lambda env: env[name]
+        if token is None:
+            return lambda env: env[name]
+        def f(env):
+            try:
+                return env[name]
+            except UnknowIdentifier as err:
+                err.at(token)
+                raise
+        return f
+
+class Frame(object):
+    """
+    The environment of a procedure call: argument values are kept in a
+    list, in the order of the procedure arg_names, and read by slot.
+    Unbound names are looked up in the parent (calling) environment.
+    """
+    __slots__ = ('parent', 'procedure', 'values', 'static')
+
+    def __init__(self, parent, procedure, values):
+        self.parent = parent
+        self.procedure = procedure
+        self.values = values
+        # Frame of the innermost call of the enclosing procedure, for
+        # procedures defined inside another one (see Evaluator.scoping)
+        self.static = None
+        if procedure.outer is not None:
+            env = parent
+            while isinstance(env, Frame) and env.procedure is not procedure.outer:
+                env = env.parent
+            if isinstance(env, Frame):
+                self.static = env
+
+    def __getitem__(self, key):
+        names = self.procedure.arg_names
+        if key in names:
+            return self.values[names.index(key)]
+        return self.parent[key]
+
+    def __contains__(self, key):
+        return key in self.procedure.arg_names or key in self.parent
+
+    def get(self, key, default=None):
+        names = self.procedure.arg_names
+        if key in names:
+            return self.values[names.index(key)]
+        return self.parent.get(key, default)
+
+    def keys(self):
+        return set(self.procedure.arg_names) | self.parent.keys()
+
+    def up(self, depth):
+        """Return the frame depth static links above, or None"""
+        frame = self
+        while depth and frame is not None:
+            frame, depth = frame.static, depth-1
+        return frame
 
 class Callable(object):
     def __init__(self, name):
@@ -75,27 +314,119 @@ class Callable(object):
 class Procedure(Callable):
     """A user defined procedure, with named arguments"""
 
-    def __init__(self, arg_names, body, name=''):
+    def __init__(self, arg_names, body, name='', outer=None):
         super(Procedure, self).__init__(name)
         self.arg_names = arg_names
         self.body = body
+        # The procedure in which this one is defined, if any
+        self.outer = outer
+        # Extra frame slots, after the arguments (see optimize.py)
+        self.temps = 0
+        # Pure procedures have a Memo of their results, and know the
+        # pure procedures calling them (see optimize.memoize)
+        self.pure = False
+        self.memo = None
+        # The test of the ground sensors it is, if any (see optimize.ground_test)
+        self.test = None
 
     @property
     def arity(self):
         return len(self.arg_names)
 
+    def bind(self, env, args):
+        """Return the environment in which the body runs for these args"""
+        if self.temps:
+            args = args + [None] * self.temps
+        return Frame(env, self, args)
+
     def call(self, env, args):
-        bound_args = dict(zip(self.arg_names, args))
-        env = Env(parent=env, **bound_args)
-        return self.body(env)
+        memo = self.memo
+        if memo is not None:
+            key = memo.key(args)
+            if key is not None:
+                res = memo.get(key)
+                if res is not Memo.Missing:
+                    return res
+        res = self.body(self.bind(env, args))
+        # Tail calls of the body are run here, without growing the stack
+        while type(res) is TailCall:
+            res = res.procedure.body(res.procedure.bind(res.env, res.args))
+        if memo is not None and key is not None:
+            memo.put(key, res)
+        return res
+
+class Memo(object):
+    """
+    The results of a pure procedure by argument values, at most size of
+    them: the least recently used ones are forgotten first.
+    """
+    Missing = object()
+
+    def __init__(self, size=1024):
+        self.size = size
+        self.table = OrderedDict()
+        self.hits = self.misses = 0
+
+    @staticmethod
+    def key(args):
+        """Key of argument values, None if they can't be one"""
+        # 1, 1.0 and True are equal, but their results may not be
+        key = tuple(args) + tuple(map(type, args))
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    def get(self, key):
+        """Result for key, or Memo.Missing"""
+        table = self.table
+        res = table.pop(key, self.Missing)
+        if res is self.Missing:
+            self.misses += 1
+        else:
+            self.hits += 1
+            table[key] = res
+        return res
+
+    def put(self, key, value):
+        table = self.table
+        table[key] = value
+        if len(table) > self.size:
+            table.popitem(last=False)
+
+    def clear(self):
+        self.table.clear()
+
+class TailCall(object):
+    """A procedure call left to the caller's Procedure.call (trampoline)"""
+    __slots__ = ('procedure', 'env', 'args')
+
+    def __init__(self, procedure, env, args):
+        self.procedure = procedure
+        self.env = env
+        self.args = args
 
 class Primitive(Callable):
-    """A logo primitive, with unnamed arguments"""
+    """
+    A logo primitive, with unnamed arguments. A pure primitive has no
+    effect and its value only depends on its arguments. A blocking one
+    waits for something else than the interpreter (the robot...): tasks
+    run other tasks meanwhile (see scheduler.py).
+    """
 
-    def __init__(self, func, arity=1, name=''):
+    # Is it the test of the ground sensors (`sensors`)? For a motion, the
+    # primitives moving the same way until and while such a test holds
+    # (see primitives.primitives_fr and optimize.lower_while)
+    ground_test = False
+    guarded = None
+
+    def __init__(self, func, arity=1, name='', pure=False, blocking=False):
         super(Primitive, self).__init__(name)
         self.func = func
         self.arity = arity
+        self.pure = pure
+        self.blocking = blocking
 
     def call(self, env, args):
         return self.func(*args)
@@ -141,6 +472,110 @@ def logo_while(condition, body):
             body(env)
     return f
 
+def local(slot):
+    """Return a lambda(frame) -> value of the argument in slot"""
+    return lambda frame: frame.values[slot]
+
+def outer(depth, slot, name, token=None):
+    """
+    Return a lambda(frame) -> value of the argument in slot of the frame
+    depth static links above
+    """
+    def f(frame):
+        up = frame.up(depth)
+        if up is None:
+            raise UnknowIdentifier(name).at(token)
+        return up.values[slot]
+    return f
+
+def global_lookup(env, name, token=None):
+    """Return a lambda(frame) -> env[name], whatever the frame"""
+    lookup = Env.lookup(name, token)
+    return lambda frame: lookup(env)
+
+def call(procedure, args):
+    """Return a lambda(env) calling procedure with evaluated args"""
+    return lambda env: procedure.call(env, map(lambda x: x(env), args))
+
+def tail_call(procedure, args, drop_frame):
+    """
+    Return a lambda(frame) -> TailCall of procedure with evaluated args.
+    If drop_frame, the callee doesn't need the current frame in its
+    environment chain and gets the current frame's parent instead.
+    """
+    def f(frame):
+        values = map(lambda x: x(frame), args)
+        return TailCall(procedure, frame.parent if drop_frame else frame, values)
+    return f
+
+class Failed(object):
+    """The error raised by a hoisted expression, in its slot"""
+    __slots__ = ('error',)
+
+    def __init__(self, error):
+        self.error = error
+
+def hoisting(slots, body):
+    """
+    Return a lambda(frame) filling slots with their expression's value,
+    then executing body. Errors are raised when a slot is read.
+    """
+    def f(frame):
+        values = frame.values
+        for slot, expr in slots:
+            try:
+                values[slot] = expr(frame)
+            except Exception as err:
+                values[slot] = Failed(err)
+        return body(frame)
+    return f
+
+def temp(slot):
+    """Return a lambda(frame) -> value of a hoisted expression"""
+    def f(frame):
+        value = frame.values[slot]
+        if type(value) is Failed:
+            raise value.error
+        return value
+    return f
+
+def closure(node):
+    """
+    Compile an analyzed node (see Evaluator.analyze) to a lambda(env).
+    This is the default execution engine.
+    """
+    kind = node[0]
+    if kind == 'const':
+        return const(node[1])
+    elif kind == 'local':
+        return local(node[1])
+    elif kind == 'lookup':
+        return Env.lookup(node[1], node[2])
+    elif kind == 'global':
+        return global_lookup(node[1], node[2], node[3])
+    elif kind == 'outer':
+        return outer(node[1], node[2], node[3], node[4])
+    elif kind == 'call':
+        return call(node[1], map(closure, node[2]))
+    elif kind == 'tailcall':
+        return tail_call(node[1], map(closure, node[2]), node[3])
+    elif kind == 'list':
+        return logo_list(map(closure, node[1]))
+    elif kind == 'seq':
+        return sequentially(map(closure, node[1]))
+    elif kind == 'repeat':
+        return repetition(closure(node[1]), closure(node[2]))
+    elif kind == 'if':
+        return conditional(closure(node[1]), closure(node[2]), closure(node[3]))
+    elif kind == 'while':
+        return logo_while(closure(node[1]), closure(node[2]))
+    elif kind == 'temp':
+        return temp(node[1])
+    elif kind == 'hoist':
+        return hoisting([(slot, closure(expr)) for slot, expr in node[1]],
+                        closure(node[2]))
+    raise ValueError("Unknown node " + repr(kind))
+
 class Evaluator(object):
     Keywords_fr = {
         "LOOP": "repete",
@@ -153,210 +588,538 @@ class Evaluator(object):
     }
 
     Builtin_operators = {
-        "+": Primitive(lambda a,b: a+b, 2, '+'),
-        "-": Primitive(lambda a,b: a-b, 2, '-'),
-        "*": Primitive(lambda a,b: a*b, 2, '*'),
-        "/": Primitive(lambda a,b: a/b, 2, '/'),
-        "<": Primitive(lambda a,b: a<b, 2, '<'),
-        "<=": Primitive(lambda a,b: a<=b, 2, '<='),
-        "=": Primitive(lambda a,b: a==b, 2, '='),
-        ">=": Primitive(lambda a,b: a>=b, 2, '>='),
-        ">": Primitive(lambda a,b: a>b, 2, '>'),
+        "+": Primitive(lambda a,b: a+b, 2, '+', True),
+        "-": Primitive(lambda a,b: a-b, 2, '-', True),
+        "*": Primitive(lambda a,b: a*b, 2, '*', True),
+        "/": Primitive(lambda a,b: a/b, 2, '/', True),
+        "<": Primitive(lambda a,b: a<b, 2, '<', True),
+        "<=": Primitive(lambda a,b: a<=b, 2, '<=', True),
+        "=": Primitive(lambda a,b: a==b, 2, '=', True),
+        ">=": Primitive(lambda a,b: a>=b, 2, '>=', True),
+        ">": Primitive(lambda a,b: a>b, 2, '>', True),
     }
 
     Builtin_primitives = {
-        "sin": Primitive(math.sin, 1, "sin"),
-        "cos": Primitive(math.cos, 1, "cos"),
-        "tan": Primitive(math.tan, 1, "tan"),
+        "sin": Primitive(math.sin, 1, "sin", True),
+        "cos": Primitive(math.cos, 1, "cos", True),
+        "tan": Primitive(math.tan, 1, "tan", True),
+        "non": Primitive(lambda a: not a, 1, "non", True),
     }
 
     Builtin = {}
     Builtin.update(Builtin_operators)
     Builtin.update(Builtin_primitives)
 
-    def __init__(self, env=None, keywords=Keywords_fr):
+    Engines = ("closure", "vm")
+
+    Scopings = ("dynamic", "lexical")
+
+    def __init__(self, env=None, keywords=Keywords_fr, engine="closure",
+                 scoping="dynamic", stack_budget=None, optimize=False,
+                 profile=False, move_while=False):
+        """
+        With dynamic scoping (the default), a variable which is not an
+        argument of the running procedure is looked up in its caller, then
+        in the caller's caller, and so on. With lexical scoping, it is
+        looked up in the procedures it is written in (using their innermost
+        running call), then in the global environment.
+
+        stack_budget is the memory (in bytes) that the calls in progress
+        may use on the vm engine (default: vm.STACK_BUDGET). The closure
+        engine runs calls on the Python stack, except tail calls: deep
+        recursion raises StackOverflow after about sys.getrecursionlimit()
+        calls, whatever stack_budget. repl.py and server.py use vm.
+
+        With optimize, constant expressions are computed at analyze time,
+        invariant expressions are moved out of loops and the results of
+        pure procedures are remembered (see optimize.py).
+
+        With move_while, loops of a motion while a test of the ground
+        sensors holds become motions the robot stops itself on the test
+        (see optimize.lower_loops). The robot then stops as soon as the
+        test fails, not after a whole number of steps.
+
+        With profile, the calls of procedures and primitives analyzed from
+        now on are measured in self.profiler (see profiler.py).
+        """
+        if scoping not in self.Scopings:
+            raise ValueError("Unknown scoping %r, expected one of %s" % (
+                scoping, ", ".join(self.Scopings)))
         self.env = Env(parent=env, **self.Builtin)
         self.keywords = keywords
+        self.scoping = scoping
+        self.engine = engine
+        self.compile = self.get_engine(engine, stack_budget)
+        if optimize:
+            from optimize import optimize
+            self.optimize = optimize
+        else:
+            self.optimize = lambda node, procedure=None: node
+        self.optimizing = optimize
+        self.move_while = move_while
+        if move_while:
+            from optimize import lower_loops
+            optimized = self.optimize
+            self.optimize = lambda node, procedure=None: lower_loops(optimized(node, procedure))
+        # Analysis events, when a list (see cache.py)
+        self.record = None
+        self.profiler = None
+        if profile:
+            from profiler import Profiler
+            self.profiler = Profiler()
+            engine = self.compile
+            self.compile = lambda node: engine(self.profiler.instrument(node))
+        # Procedures being analyzed, innermost last
+        self.scopes = []
+        self.analyzers = {
+            keywords["IF"]: self.analyze_if,
+            keywords["LOOP"]: self.analyze_repetition,
+            keywords["DEF_PROC"]: self.analyze_procedure,
+            keywords["MAKE_VAR"]: self.analyze_var,
+            keywords["WHILE"]: self.analyze_while,
+        }
+
+    @staticmethod
+    def get_engine(name, stack_budget=None):
+        """Return the function compiling analyzed nodes for an engine"""
+        if name == "closure":
+            return closure
+        elif name == "vm":
+            import vm
+            if stack_budget is None:
+                return vm.compile
+            return lambda node: vm.compile(node, stack_budget=stack_budget)
+        raise ValueError("Unknown engine %r, expected one of %s" % (
+            name, ", ".join(Evaluator.Engines)))
+
+    def is_keyword(self, token, keyword):
+        return token.kind == WORD and token.text.lower() == self.keywords[keyword]
+
+    @staticmethod
+    def token(tokens, i):
+        """
+        Return the token at index i of a list or TokenStream,
+        raise EndOfTokens past the end
+        """
+        try:
+            return tokens[i]
+        except IndexError:
+            if not isinstance(tokens, TokenStream):
+                raise EndOfTokens(i)
+            return tokens.pull(i)
+
+    @classmethod
+    def peek(klass, tokens, i):
+        """Return the token at index i, or None past the end"""
+        try:
+            return klass.token(tokens, i)
+        except EndOfTokens:
+            return None
 
-    def analyze_number(self, numbrepr, tokens, i):
+    def analyze_number(self, token, tokens, i):
         res = None
         try:
-            res = const(int(numbrepr,0))
+            res = ('const', int(token.text,0))
         except ValueError:
-            res = const(float(numbrepr))
+            try:
+                res = ('const', float(token.text))
+            except ValueError:
+                raise ParseError("invalid literal for number: " + token.text).at(token)
         return res, i
 
-    def analyze_list(self, tokens, i):
+    def analyze_list(self, start, tokens, i):
         expr = []
         try:
-            while tokens[i] != "]":
+            while True:
+                try:
+                    token = tokens[i]
+                except IndexError:
+                    token = self.token(tokens, i)
+                if token.kind == BRACKET and token.text == "]":
+                    break
                 e, i = self.analyze(tokens, i)
                 expr.append(e)
-        except IndexError:
-            raise UnterminatedExpression("Unterminated list")
+        except EndOfTokens:
+            raise UnterminatedExpression("Unterminated list").at(start)
 
-        return logo_list(expr), i+1
+        return ('list', expr), i+1
 
-    def analyze_procedure(self, tokens, i):
+    def analyze_procedure(self, start, tokens, i):
         try:
-            name = tokens[i]
+            name = self.token(tokens, i).text
             i += 1
             args = []
-            while tokens[i][0] == ':':
-                args.append(tokens[i])
+            while self.token(tokens, i).kind == VAR:
+                args.append(tokens[i].text)
                 i += 1
 
             # Create procedure in env for recursion...
-            self.env[name] = Procedure(args, const(None), name)
+            outer = self.scopes[-1] if self.scopes else None
+            procedure = self.define_procedure(name, args, outer)
 
             funcs = []
-            while tokens[i] != self.keywords["END_PROC"]:
-                f, i = self.analyze(tokens, i)
-                funcs.append(f)
-            body = sequentially(filter(lambda x: x is not None, funcs))
+            self.scopes.append(procedure)
+            try:
+                while not self.is_keyword(self.token(tokens, i), "END_PROC"):
+                    f, i = self.analyze(tokens, i)
+                    funcs.append(f)
+            finally:
+                self.scopes.pop()
+            body = ('seq', filter(lambda x: x is not None, funcs))
+            body = self.optimize(body, procedure)
+            body = self.mark_tail_calls(body, procedure)
 
             # Then bind its actual body
-            self.env[name].body = body
+            self.set_body(procedure, body)
             return None, i+1
-        except IndexError:
-            raise UnterminatedExpression("Unterminated procedure definition")
+        except EndOfTokens:
+            raise UnterminatedExpression("Unterminated procedure definition").at(start)
 
-    def analyze_var(self, tokens, i):
+    def define_procedure(self, name, arg_names, outer=None):
+        """
+        Create procedure name in env, for arg_names. The calls analyzed
+        earlier keep the procedure they called.
+        """
+        procedure = self.env[name] = Procedure(arg_names, const(None), name, outer)
+        if self.record is not None:
+            self.record.append(('define', procedure))
+        return procedure
+
+    def set_body(self, procedure, body):
+        """Compile the analyzed body of procedure"""
+        procedure.body = self.compile(body)
+        if self.profiler is not None:
+            procedure.body = self.profiler.procedure(procedure, procedure.body)
+        if self.optimizing:
+            from optimize import memoize
+            memoize(procedure, body)
+        if self.move_while and not procedure.arity:
+            from optimize import ground_test
+            procedure.test = ground_test(body, inline=True)
+        if self.record is not None:
+            self.record.append(('body', procedure, body))
+
+    def analyze_var(self, start, tokens, i):
         try:
-            name = tokens[i]
-        except IndexError:
-            raise UnterminatedExpression("Missing variable name")
+            name = self.token(tokens, i).text
+        except EndOfTokens:
+            raise UnterminatedExpression("Missing variable name").at(start)
 
+        # The value is computed now, in the global environment
+        scopes, self.scopes = self.scopes, []
         try:
             value, i = self.analyze(tokens, i+1)
-        except IndexError:
-            raise UnterminatedExpression("Missing variable value")
-        self.env[name] = value(self.env)
+        except EndOfTokens:
+            raise UnterminatedExpression("Missing variable value").at(start)
+        finally:
+            self.scopes = scopes
+        self.env[name] = self.compile(self.optimize(value))(self.env)
+        if self.record is not None:
+            self.record.append(('donne', name, self.env[name], value))
         return None, i
 
-    def analyze_string(self, tokens, i):
-        words = []
-        try:
-            while tokens[i] != '"':
-                words.append(tokens[i])
-                i += 1
-        except IndexError:
-            raise UnterminatedExpression("Unterminated String")
-        return const(" ".join(words)), i+1
-
-    def analyze_call(self, procedure, tokens, i):
+    def analyze_call(self, procedure, start, tokens, i):
         args = []
         try:
             for argno in range(procedure.arity):
                 arg, i = self.analyze(tokens, i)
                 args.append(arg)
-        except IndexError:
+        except EndOfTokens:
             msg = "Missing arguments in call to %s. Expected %d; got %d" % (
                 procedure.name, procedure.arity, len(args))
-            raise UnterminatedExpression(msg)
-        return lambda env: procedure.call(env, map(lambda x: x(env), args)), i
+            raise UnterminatedExpression(msg).at(start)
+        return ('call', procedure, args), i
 
-    def analyze_repetition(self, tokens, i):
+    def analyze_repetition(self, start, tokens, i):
         try:
             times, i = self.analyze(tokens, i)
-        except IndexError:
-            raise UnterminatedExpression("Missing loop count")
+        except EndOfTokens:
+            raise UnterminatedExpression("Missing loop count").at(start)
         try:
             expr, i = self.analyze(tokens, i)
-        except IndexError:
-            raise UnterminatedExpression("Missing loop body")
-        return repetition(times, expr), i
+        except EndOfTokens:
+            raise UnterminatedExpression("Missing loop body").at(start)
+        return ('repeat', times, expr), i
 
-    def analyze_if(self, tokens, i):
-        cond, i = self.analyze(tokens, i)
-        cons, i = self.analyze(tokens, i)
-        alt = const(None)
-        if i < len(tokens) and tokens[i] == self.keywords["ELSE"]:
-            alt, i = self.analyze(tokens, i+1)
-        return conditional(cond, cons, alt), i
+    def analyze_if(self, start, tokens, i):
+        try:
+            cond, i = self.analyze(tokens, i)
+            cons, i = self.analyze(tokens, i)
+        except EndOfTokens:
+            raise UnterminatedExpression("Incomplete condition").at(start)
+        alt = ('const', None)
+        token = self.peek(tokens, i)
+        if token is not None and self.is_keyword(token, "ELSE"):
+            try:
+                alt, i = self.analyze(tokens, i+1)
+            except EndOfTokens:
+                raise UnterminatedExpression("Missing else branch").at(token)
+        return ('if', cond, cons, alt), i
 
     def analyze_infix_operator(self, operand, tokens, i):
         op = tokens[i]
-        proc = self.Builtin_operators[op]
+        proc = self.Builtin_operators[op.text]
         try:
             other, i = self.analyze(tokens, i+1)
-        except IndexError:
-            raise UnterminatedExpression("Missing operand for " + op)
-        return lambda env: proc.call(env, (operand(env), other(env))), i
+        except EndOfTokens:
+            raise UnterminatedExpression("Missing operand for " + op.text).at(op)
+        return ('call', proc, [operand, other]), i
 
-    def analyze_parenthesis(self, tokens, i):
+    def analyze_parenthesis(self, start, tokens, i):
         expr = None
         try:
             expr, i = self.analyze(tokens, i)
-        except IndexError:
-            raise UnterminatedExpression("Missing expression after '('")
-        if i >= len(tokens) or tokens[i] != ')':
-            raise UnterminatedExpression("Missing matching ')'")
+        except EndOfTokens:
+            raise UnterminatedExpression("Missing expression after '('").at(start)
+        token = self.peek(tokens, i)
+        if token is None or token.kind != BRACKET or token.text != ')':
+            raise UnterminatedExpression("Missing matching ')'").at(start)
         return expr, i+1
 
-    def analyze_while(self, tokens, i):
+    def analyze_while(self, start, tokens, i):
         try:
             cond, i = self.analyze(tokens, i)
-        except IndexError:
-            raise UnterminatedExpression("Missing condition for while")
+        except EndOfTokens:
+            raise UnterminatedExpression("Missing condition for while").at(start)
         try:
             body, i = self.analyze(tokens, i)
-        except IndexError:
-            raise UnterminatedExpression("Missing body for while")
-        return logo_while(cond, body), i
+        except EndOfTokens:
+            raise UnterminatedExpression("Missing body for while").at(start)
+        return ('while', cond, body), i
+
+    def mark_tail_calls(self, node, procedure):
+        """
+        Turn the calls to procedures whose value is the value of
+        procedure's body into ('tailcall', callee, args, drop_frame) nodes.
+        Calls inside [ ] are list items, hence never tail calls.
+        """
+        kind = node[0]
+        if kind == 'seq' and node[1]:
+            last = self.mark_tail_calls(node[1][-1], procedure)
+            return ('seq', node[1][:-1] + [last])
+        elif kind == 'if':
+            return ('if', node[1], self.mark_tail_calls(node[2], procedure),
+                                   self.mark_tail_calls(node[3], procedure))
+        elif kind == 'call' and isinstance(node[1], Procedure):
+            callee = node[1]
+            if self.scoping == "lexical":
+                # Only its nested procedures need the caller's frame
+                drop_frame = callee.outer is None
+            else:
+                # Dynamic lookups can't see a frame whose names all are
+                # arguments of the callee
+                drop_frame = set(procedure.arg_names) <= set(callee.arg_names)
+            return ('tailcall', callee, node[2], drop_frame)
+        return node
+
+    def analyze_variable(self, name, token):
+        """Resolve a variable reference, as far as possible at analyze time"""
+        if not self.scopes:
+            return ('lookup', name, token)
+        arg_names = self.scopes[-1].arg_names
+        if name in arg_names:
+            return ('local', arg_names.index(name), name)
+        if self.scoping == "dynamic":
+            return ('lookup', name, token)
+        for depth in range(1, len(self.scopes)):
+            arg_names = self.scopes[-1-depth].arg_names
+            if name in arg_names:
+                return ('outer', depth, arg_names.index(name), name, token)
+        return ('global', self.env, name, token)
 
     def analyze(self, tokens, i):
         """
-        analyze(tokens, index) -> (lambda(env), next index)
+        analyze(tokens, index) -> (node, next index)
+
+        tokens is indexable (a list of Token or a TokenStream). A node
+        is a tuple whose first item is its kind:
+            ('const', value)            ('lookup', name, token)
+            ('local', slot, name)       ('global', env, name, token)
+            ('outer', depth, slot, name, token)
+            ('call', callable, [args])  ('list', [items])
+            ('tailcall', procedure, [args], drop_frame)
+            ('seq', [exprs])            ('repeat', times, body)
+            ('if', cond, cons, alt)     ('while', cond, body)
+        and, after self.optimize:
+            ('temp', slot)              ('hoist', [(slot, expr)], loop)
+        Nodes are turned into executable code by self.compile
         """
         res = None
-        tok = tokens[i].lower()
+        try:
+            token = tokens[i]
+        except IndexError:
+            token = self.token(tokens, i)
+        kind = token.kind
         i += 1
 
-        if tok[0].isdigit():
-            res, i = self.analyze_number(tok, tokens, i)
+        if kind == WORD or kind == VAR or kind == OPERATOR:
+            tok = token.text.lower()
+            analyzer = self.analyzers.get(tok) if kind == WORD else None
+            if analyzer is not None:
+                res, i = analyzer(token, tokens, i)
+            else:
+                procedure = self.env.get(tok)
+                if isinstance(procedure, Callable):
+                    res, i = self.analyze_call(procedure, token, tokens, i)
+                else:
+                    res = self.analyze_variable(tok, token)
 
-        elif tok == '"':
-            res, i = self.analyze_string(tokens, i)
+        elif kind == NUMBER:
+            res, i = self.analyze_number(token, tokens, i)
 
-        elif tok == '[':
-            res, i = self.analyze_list(tokens, i)
+        elif kind == STRING:
+            res = ('const', token.text)
 
-        elif tok == '(':
-            res, i = self.analyze_parenthesis(tokens, i)
+        elif token.text == '[':
+            res, i = self.analyze_list(token, tokens, i)
 
-        elif tok == self.keywords["IF"]:
-            res, i = self.analyze_if(tokens, i)
+        elif token.text == '(':
+            res, i = self.analyze_parenthesis(token, tokens, i)
 
-        elif tok == self.keywords["LOOP"]:
-            res, i = self.analyze_repetition(tokens, i)
+        else:
+            raise ParseError("Unexpected '%s'" % token.text).at(token)
 
-        elif tok == self.keywords["DEF_PROC"]:
-            res, i = self.analyze_procedure(tokens, i)
+        try:
+            token = tokens[i]
+        except IndexError:
+            token = self.peek(tokens, i)
+        if token is not None and token.kind == OPERATOR:
+            res, i = self.analyze_infix_operator(res, tokens, i)
 
-        elif tok == self.keywords["MAKE_VAR"]:
-            res, i = self.analyze_var(tokens, i)
+        return res, i
 
-        elif tok == self.keywords["WHILE"]:
-            res, i = self.analyze_while(tokens, i)
+    def eval(self, text):
+        """
+        Execute LOGO source, a string or a file-like object, each
+        top-level form as soon as it is analyzed
+        """
+        return self.run(self.forms(text))
 
-        elif tok in self.env and isinstance(self.env[tok], Callable):
-            res, i = self.analyze_call(self.env[tok], tokens, i)
+    def parse(self, text):
+        """Analyze LOGO source and return its compiled top-level forms"""
+        return list(self.forms(text))
 
-        else:
-            res, i = Env.lookup(tok), i
+    def forms(self, text):
+        """
+        Generate the compiled top-level forms of LOGO source, reading and
+        analyzing it only as far as the form requested
+        """
+        tokens = TokenStream(tokenize_lines(text))
+        i = 0
+        while self.peek(tokens, i) is not None:
+            node, i = self.analyze(tokens, i)
+            i = tokens.release(i)
+            if node is not None:
+                yield self.compile_form(node)
+
+    def compile_form(self, node):
+        """Compile an analyzed top-level form"""
+        if self.record is not None:
+            self.record.append(('form', node))
+        return self.compile(self.optimize(node))
+
+    def run(self, prog):
+        """Execute compiled top-level forms, return the value of the last one"""
+        res = None
+        try:
+            for func in prog:
+                res = func(self.env)
+        except RuntimeError as err:
+            if "recursion" not in str(err):
+                raise
+            raise StackOverflow("Too many nested calls for the Python stack; "
+                                "use the vm engine for deeper recursion")
+        return res
 
-        if i < len(tokens) and tokens[i] in self.Builtin_operators:
-            res, i = self.analyze_infix_operator(res, tokens, i)
 
-        return res, i
+class Parser(object):
+    """
+    Analysis of LOGO source fed one line at a time, as typed in the REPL.
 
-    def eval(self, text):
-        text = re.sub(r';.*\n', ' ', text)
-        tokens = re.sub(r'([<>]=?|=|"|\(|\)|\[|\]|\+|\-|\*|\/)', " \\1 ", text).split()
+    feed(line) returns the compiled top-level forms completed by the
+    line, and keeps the tokens of an incomplete one for the next lines.
+    Inside brackets or a procedure definition, a line is only tokenized:
+    the construct is analyzed once, when it is closed.
+    """
+
+    def __init__(self, evaluator):
+        self.evaluator = evaluator
+        self.reset()
+
+    def reset(self):
+        """Forget the incomplete form"""
+        self.lexer = Lexer()
+        self.tokens = []
+        # Open brackets and procedure definitions, and the index of the
+        # token opening the outermost one
+        self.depth = 0
+        self.start = None
+        # Number of tokens already found incomplete
+        self.tried = 0
+
+    def pending(self):
+        """Is an incomplete form waiting for more lines?"""
+        return bool(self.tokens) or self.lexer.pending is not None
+
+    def arguments(self, line=""):
+        """
+        Names of the arguments of the innermost procedure definition left
+        open by the pending tokens and line, as typed so far.
+        """
+        is_keyword = self.evaluator.is_keyword
+        tokens = self.tokens + Lexer().scan(line)
+        opened = []
+        for i, token in enumerate(tokens):
+            if is_keyword(token, "DEF_PROC"):
+                opened.append(i)
+            elif is_keyword(token, "END_PROC") and opened:
+                opened.pop()
+        if not opened:
+            return []
+        res = []
+        for token in tokens[opened[-1] + 2:]:
+            if token.kind != VAR:
+                break
+            res.append(token.text)
+        return res
+
+    def feed(self, line):
+        if not self.pending():
+            # Error positions are relative to the current form
+            self.lexer.lineno = 0
+        is_keyword = self.evaluator.is_keyword
+        for token in self.lexer.scan(line):
+            if token.text in "[(" and token.kind == BRACKET or is_keyword(token, "DEF_PROC"):
+                if not self.depth:
+                    self.start = len(self.tokens)
+                self.depth += 1
+            elif token.text in ")]" and token.kind == BRACKET or is_keyword(token, "END_PROC"):
+                # Unbalanced: the analyzer reports it
+                self.depth = max(0, self.depth - 1)
+            self.tokens.append(token)
+
+        end = self.start if self.depth else len(self.tokens)
+        if end <= self.tried:
+            return []
+        try:
+            return self.analyze(end)
+        except Exception:
+            self.reset()
+            raise
+
+    def analyze(self, end):
+        evaluator, tokens = self.evaluator, self.tokens[:end]
         i, prog = 0, []
-        while i < len(tokens):
-            func, i = self.analyze(tokens, i)
-            if func is not None:
-                prog.append(func)
-        return sequentially(prog)(self.env)
+        while i < end:
+            try:
+                node, next = evaluator.analyze(tokens, i)
+            except (UnterminatedExpression, EndOfTokens):
+                break
+            i = next
+            if node is not None:
+                prog.append(evaluator.compile_form(node))
+        del self.tokens[:i]
+        if self.depth:
+            self.start -= i
+        self.tried = end - i
+        return prog
@@ -0,0 +1,251 @@
+"""
+Optimization pass for the LOGO interpreter, run between analysis and
+compilation when the Evaluator is created with optimize=True.
+
+ - calls to pure primitives (see Primitive.pure) whose arguments are all
+   constants are computed once, at analyze time;
+ - the branch of a `si` whose condition is constant is the only one kept;
+ - in procedure bodies, the pure expressions of a loop body which don't
+   depend on the loop are computed once before the loop, in extra slots
+   of the procedure's frames;
+ - procedures which only compute a value from their arguments, with
+   pure primitives and pure procedures, remember their latest results
+   (see logo.Memo).
+
+Calls to other primitives (robot motion, sensors, print...) and to
+procedures are never removed nor moved.
+
+Apart from these, when the Evaluator is created with move_while=True,
+`tantque noir [av 5]`, a loop of a motion while a test of the ground
+sensors holds, becomes motions that the robot stops itself on the test,
+without a round trip per step (see lower_loops). This is not an
+optimization: the robot stops as soon as the test fails, not at a
+multiple of the step.
+"""
+
+from logo import Evaluator, Primitive, Procedure, Memo
+from protocol import MAX_MOVE_WHILE
+
+# Results remembered by each pure procedure
+MEMO_SIZE = 1024
+
+
+def is_pure(node):
+    """True if evaluating node has no effect and always gives the same value"""
+    kind = node[0]
+    if kind in ('const', 'local', 'lookup', 'global', 'outer', 'temp'):
+        return True
+    if kind == 'call':
+        return isinstance(node[1], Primitive) and node[1].pure and \
+               all(is_pure(arg) for arg in node[2])
+    if kind == 'list':
+        return all(is_pure(item) for item in node[1])
+    return False
+
+
+def fold(node):
+    """Return node with its constant parts computed"""
+    kind = node[0]
+    if kind == 'call':
+        proc, args = node[1], map(fold, node[2])
+        if isinstance(proc, Primitive) and proc.pure and \
+           all(arg[0] == 'const' for arg in args):
+            try:
+                return ('const', proc.func(*[arg[1] for arg in args]))
+            except Exception:
+                # Left to fail at run time, at the right moment
+                pass
+        return ('call', proc, args)
+    elif kind == 'list':
+        return ('list', map(fold, node[1]))
+    elif kind == 'seq':
+        exprs = map(fold, node[1])
+        # A constant is only useful as the value of the sequence
+        return ('seq', [e for e in exprs[:-1] if e[0] != 'const'] + exprs[-1:])
+    elif kind == 'repeat':
+        return ('repeat', fold(node[1]), fold(node[2]))
+    elif kind == 'if':
+        cond = fold(node[1])
+        if cond[0] == 'const':
+            return fold(node[2] if cond[1] else node[3])
+        return ('if', cond, fold(node[2]), fold(node[3]))
+    elif kind == 'while':
+        cond = fold(node[1])
+        if cond[0] == 'const' and not cond[1]:
+            return ('const', None)
+        return ('while', cond, fold(node[2]))
+    return node
+
+
+def standalone(node):
+    """True if node is pure and has the same value wherever it is written"""
+    kind = node[0]
+    if kind == 'list':
+        return all(standalone(item) for item in node[1])
+    return kind in ('const', 'lookup', 'global')
+
+
+def ground_test(node, inline=False):
+    """
+    (threshold, sensors, above) if node is true when one of the ground
+    sensors reads at least threshold (above) or when none does (not
+    above), else None: node calls `sensors` with pure arguments, or a
+    procedure which is such a test (see Procedure.test), maybe through
+    `non`. With inline, the arguments are also standalone, for the test
+    to be the one of a procedure.
+    """
+    kind = node[0]
+    if kind == 'seq' and len(node[1]) == 1:
+        return ground_test(node[1][0], inline)
+    if kind not in ('call', 'tailcall'):
+        return None
+    proc, args = node[1], node[2]
+    if isinstance(proc, Procedure):
+        return None if args else proc.test
+    if proc.ground_test:
+        if all(standalone(arg) if inline else is_pure(arg) for arg in args):
+            return args[0], args[1], True
+    elif proc is Evaluator.Builtin_primitives["non"]:
+        test = ground_test(args[0], inline)
+        if test is not None:
+            return test[0], test[1], not test[2]
+    return None
+
+
+def lower_loops(node):
+    """node with its loops of motions on a ground test lowered (see lower_while)"""
+    kind = node[0]
+    if kind == 'hoist':
+        return ('hoist', node[1], lower_loops(node[2]))
+    node = Hoister.children(node, lower_loops)
+    if kind == 'while':
+        return lower_while(node[1], node[2]) or node
+    return node
+
+
+def lower_while(cond, body):
+    """
+    The loop `tantque cond [motion n]`, cond being a ground test, as
+    motions stopped by the robot on the test, each as long as possible
+    and repeated until one is stopped:
+        tantque (avtantque threshold sensors max) = max []
+    None if it is not such a loop.
+    """
+    if body[0] == 'list' and len(body[1]) == 1:
+        body = body[1][0]
+    if body[0] != 'call' or not isinstance(body[1], Primitive) or body[1].guarded is None:
+        return None
+    # A motion of 0 or of a variable would not move the same
+    step = body[2][0]
+    if step[0] != 'const' or not step[1] > 0:
+        return None
+    test = ground_test(cond)
+    if test is None:
+        return None
+    threshold, sensors, above = test
+    moving = body[1].guarded[above]
+    length = ('const', MAX_MOVE_WHILE)
+    equal = Evaluator.Builtin_operators["="]
+    return ('while', ('call', equal, [('call', moving, [threshold, sensors, length]), length]),
+            ('list', []))
+
+
+class Hoister(object):
+    """Move the invariant expressions of loops before them"""
+
+    def __init__(self, procedure):
+        self.procedure = procedure
+        self.hoisted = None
+
+    def worth(self, node):
+        """Pure expressions slower than reading a slot"""
+        return node[0] not in ('const', 'local', 'temp') and is_pure(node)
+
+    def node(self, node):
+        kind = node[0]
+        if kind in ('repeat', 'while') and self.hoisted is None:
+            # Outermost loop: the invariants of inner loops go before it too
+            self.hoisted = []
+            try:
+                if kind == 'repeat':
+                    loop = ('repeat', node[1], self.invariants(node[2]))
+                else:
+                    loop = ('while', self.invariants(node[1]), self.invariants(node[2]))
+                if not self.hoisted:
+                    return loop
+                return ('hoist', self.hoisted, loop)
+            finally:
+                self.hoisted = None
+        return self.children(node, self.node)
+
+    def invariants(self, node):
+        """Replace the worthy pure parts of node by temporary slots"""
+        if self.worth(node):
+            slot = self.procedure.arity + self.procedure.temps
+            self.procedure.temps += 1
+            self.hoisted.append((slot, node))
+            return ('temp', slot)
+        return self.children(node, self.invariants)
+
+    @staticmethod
+    def children(node, f):
+        """node with f applied to its sub-expressions"""
+        kind = node[0]
+        if kind in ('call', 'tailcall'):
+            return (kind, node[1], map(f, node[2])) + node[3:]
+        elif kind in ('list', 'seq'):
+            return (kind, map(f, node[1]))
+        elif kind in ('repeat', 'while'):
+            return (kind, f(node[1]), f(node[2]))
+        elif kind == 'if':
+            return ('if', f(node[1]), f(node[2]), f(node[3]))
+        return node
+
+
+def optimize(node, procedure=None):
+    """
+    Return an optimized equivalent of node; if it is the body of
+    procedure, the number of extra slots its frames need is set in
+    procedure.temps.
+    """
+    node = fold(node)
+    if procedure is not None:
+        procedure.temps = 0
+        node = Hoister(procedure).node(node)
+    return node
+
+
+def is_pure_body(node, procedure):
+    """
+    True if node, the body of procedure, only computes a value from its
+    arguments.
+    """
+    kind = node[0]
+    if kind in ('const', 'local', 'temp'):
+        return True
+    if kind in ('call', 'tailcall'):
+        proc = node[1]
+        if isinstance(proc, Primitive):
+            if not proc.pure:
+                return False
+        elif proc is not procedure and not proc.pure:
+            return False
+        return all(is_pure_body(arg, procedure) for arg in node[2])
+    if kind in ('list', 'seq'):
+        return all(is_pure_body(item, procedure) for item in node[1])
+    if kind in ('repeat', 'while'):
+        return is_pure_body(node[1], procedure) and \
+               is_pure_body(node[2], procedure)
+    if kind == 'if':
+        return all(is_pure_body(n, procedure) for n in node[1:])
+    if kind == 'hoist':
+        return all(is_pure_body(expr, procedure) for slot, expr in node[1]) and \
+               is_pure_body(node[2], procedure)
+    # Variables which are not arguments may change between calls
+    return False
+
+
+def memoize(procedure, body, size=MEMO_SIZE):
+    """Give procedure a Memo if its body is pure"""
+    procedure.pure = is_pure_body(body, procedure)
+    procedure.memo = Memo(size) if procedure.pure else None
@@ -0,0 +1,271 @@
+"""
+Dry run of LOGO programs: the path the robot would draw and the time it
+would take, without robot.
+
+    python2 planner.py carre.logo --svg
+    python2 planner.py eleves/*.logo --json rapport.json
+
+A Planner has the functions of the zumoturtle module used by
+primitives.primitives_fr: motions move a model of the robot (see
+simulator.Robot) and add their duration on the robot (see
+protocol.motion_duration) to the predicted time. Sensors read the
+floor given, white by default.
+"""
+
+import json
+import os
+import struct
+import sys
+import zlib
+
+from logo import Evaluator, Env, ProgramError
+from primitives import primitives_fr
+from protocol import motion_duration, encode, decode, blends, sensors_param, \
+    moving_param, moving_length, moved, \
+    FORWARD, BACKWARD, LEFT, RIGHT, GROUND_SENSOR, GROUND_SENSOR_SUM, MUSIC, \
+    LEFT_ADJUST, SENSORS_ABOVE, MOVE_WHILE
+from simulator import Robot, Floor
+
+Prelude = os.path.join(os.path.dirname(os.path.abspath(__file__)), "prelude.logo")
+
+
+class TooLong(ProgramError):
+    pass
+
+
+class Planner(object):
+    """
+    Robot model with the interface of zumoturtle. rotation_adjust is the
+    one of zumoadjust.py: the planned robot turns the requested angles.
+    latency is the time (s) added to each command, for the transport.
+    A program predicted to run longer than max_time (s) is stopped.
+    With blend, consecutive motions in the same direction are one, as in
+    the blended mode of zumoturtle when all are queued. With trace, the
+    commands the robot would get are kept in self.trace, as (cmd, param).
+    """
+
+    def __init__(self, floor=None, x=0.0, y=0.0, heading=90.0,
+                 rotation_adjust=1.0, latency=0.0, max_time=None, blend=False,
+                 trace=False):
+        self.robot = Robot(floor, x, y, heading, rotation_error=1.0 / rotation_adjust)
+        self.rotation_adjust = rotation_adjust
+        self.latency = latency
+        self.max_time = max_time
+        self.blend = blend
+        # Last command, if a motion that the next one may blend with
+        self.last = None
+        self.trace = [] if trace else None
+        self.time = 0.0
+        self.commands = 0
+        self.distance = 0.0
+        # Points of the path, after each straight motion
+        self.path = [(x, y)]
+
+    def move(self, cmd, param):
+        # What the robot gets, see protocol.encode
+        param = decode(encode(cmd, param))[1]
+        if self.blend and blends(self.last, cmd, param):
+            merged = self.last[1] + param
+            self.time += motion_duration(merged) - motion_duration(self.last[1])
+            self.last = (cmd, merged)
+            if self.trace is not None:
+                self.trace[-1] = self.last
+        else:
+            self.commands += 1
+            self.time += motion_duration(param) + self.latency
+            self.last = (cmd, param)
+            if self.trace is not None:
+                self.trace.append(self.last)
+        if self.max_time is not None and self.time > self.max_time:
+            raise TooLong("More than %gs of motions" % self.max_time)
+        robot = self.robot
+        robot.move(cmd, param)
+        if cmd in (FORWARD, BACKWARD):
+            self.distance += param * robot.step
+            self.path.append((robot.x, robot.y))
+
+    def forward(self, length):
+        self.move(FORWARD, length)
+
+    def backward(self, length):
+        self.move(BACKWARD, length)
+
+    def turnLeft(self, angle):
+        self.move(LEFT, angle * self.rotation_adjust)
+
+    def turnRight(self, angle):
+        self.move(RIGHT, angle * self.rotation_adjust)
+
+    def moveWhile(self, direction, threshold, sensors, length, above):
+        sent = moving_length(direction, length, self.rotation_adjust)
+        param = moving_param(direction, threshold, sensors, sent, above)
+        self.command(MOVE_WHILE, param)
+        robot = self.robot
+        travelled = robot.move_while(param)
+        # At the lowest speed, as short motions
+        self.time += travelled * motion_duration(1)
+        if self.max_time is not None and self.time > self.max_time:
+            raise TooLong("More than %gs of motions" % self.max_time)
+        if direction in (FORWARD, BACKWARD):
+            self.distance += travelled * robot.step
+            self.path.append((robot.x, robot.y))
+        return moved(length, sent, travelled)
+
+    def command(self, cmd, param=0):
+        """Count a command which is not a motion"""
+        self.commands += 1
+        self.time += self.latency
+        self.last = None
+        if self.trace is not None:
+            self.trace.append((cmd, param))
+
+    def playMusic(self):
+        self.command(MUSIC)
+
+    def sync(self):
+        pass
+
+    def sensorsAbove(self, threshold, sensors):
+        self.command(SENSORS_ABOVE, sensors_param(threshold, sensors))
+        readings = self.robot.readings()
+        return any(readings[i] >= threshold for i in sensors)
+
+    def getGroundSensor(self, index):
+        self.command(GROUND_SENSOR, index)
+        return self.robot.readings()[index]
+
+    def getGroundSensorSum(self):
+        self.command(GROUND_SENSOR_SUM)
+        return sum(self.robot.readings())
+
+    def changeLeftAdjust(self, ratio):
+        self.command(LEFT_ADJUST, int(ratio * 1000))
+        # In thousandths, as sent to the robot
+        self.robot.left_adjust = int(ratio * 1000) / 1000.0
+
+    def bounds(self):
+        """(xmin, ymin, xmax, ymax) of the path"""
+        xs, ys = zip(*self.path)
+        return min(xs), min(ys), max(xs), max(ys)
+
+    def summary(self):
+        xmin, ymin, xmax, ymax = self.bounds()
+        return {"time": self.time, "distance": self.distance,
+                "commands": self.commands, "bounds": [xmin, ymin, xmax, ymax],
+                "end": [self.robot.x, self.robot.y, self.robot.heading]}
+
+    def svg(self, margin=10):
+        """The path, as an SVG document (y goes up, as on the floor)"""
+        xmin, ymin, xmax, ymax = self.bounds()
+        width, height = xmax - xmin + 2 * margin, ymax - ymin + 2 * margin
+        lines = ['<svg xmlns="http://www.w3.org/2000/svg" width="%.0f" height="%.0f" '
+                 'viewBox="%.1f %.1f %.1f %.1f">' % (width, height, xmin - margin,
+                                                      -ymax - margin, width, height)]
+        lines.append('<polyline fill="none" stroke="black" points="%s"/>' % " ".join(
+            "%.1f,%.1f" % (x, -y) for x, y in self.path))
+        x, y = self.path[0]
+        lines.append('<circle cx="%.1f" cy="%.1f" r="3" fill="green"/>' % (x, -y))
+        lines.append('<circle cx="%.1f" cy="%.1f" r="3" fill="red"/>' % (
+            self.robot.x, -self.robot.y))
+        lines.append('</svg>')
+        return "\n".join(lines) + "\n"
+
+    def png(self, scale=1.0, margin=10):
+        """The path in black on white, as a PNG image"""
+        xmin, ymin, xmax, ymax = self.bounds()
+        width = int((xmax - xmin) * scale) + 2 * margin + 1
+        height = int((ymax - ymin) * scale) + 2 * margin + 1
+        pixels = [bytearray("\xff" * width) for row in range(height)]
+        def pixel(x, y):
+            return (int(round((x - xmin) * scale)) + margin,
+                    height - 1 - margin - int(round((y - ymin) * scale)))
+        for (x0, y0), (x1, y1) in zip(self.path, self.path[1:]):
+            (c0, r0), (c1, r1) = pixel(x0, y0), pixel(x1, y1)
+            steps = max(abs(c1 - c0), abs(r1 - r0), 1)
+            for k in range(steps + 1):
+                pixels[r0 + (r1 - r0) * k // steps][c0 + (c1 - c0) * k // steps] = 0
+        return write_png(width, height, pixels)
+
+
+def write_png(width, height, rows):
+    """PNG image of 8 bits gray rows (bytearrays)"""
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + \
+               struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+    raw = "".join("\0" + str(row) for row in rows)
+    return "\x89PNG\r\n\x1a\n" + \
+        chunk("IHDR", struct.pack(">IIBBBBB", width, height, 8, 0, 0, 0, 0)) + \
+        chunk("IDAT", zlib.compress(raw, 9)) + chunk("IEND", "")
+
+
+def plan(source, planner=None, optimize=False, move_while=False, **options):
+    """Run LOGO source (a string or file) on a Planner and return it"""
+    planner = planner or Planner(**options)
+    evaluator = Evaluator(Env(None, *primitives_fr(planner)), optimize=optimize,
+                          move_while=move_while)
+    with open(Prelude) as prelude:
+        evaluator.eval(prelude)
+    evaluator.eval(source)
+    return planner
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Path and duration of LOGO programs, without robot")
+    parser.add_argument("scripts", nargs="+", help="LOGO scripts")
+    parser.add_argument("--floor", help="ASCII floor read by the sensors, '#' is black")
+    parser.add_argument("--cell", type=float, default=10.0, help="size of floor cells (mm)")
+    parser.add_argument("--start", type=float, nargs=3, metavar=("X", "Y", "HEADING"),
+                        default=(0.0, 0.0, 90.0), help="initial pose (mm, mm, degrees)")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="time (s) added to each robot command")
+    parser.add_argument("--blend", action="store_true",
+                        help="blend motions in the same direction, as repl.py --blend")
+    parser.add_argument("--move-while", action="store_true",
+                        help="loops of a motion on a ground test become motions stopped by the robot, as repl.py --move-while")
+    parser.add_argument("--max-time", type=float, default=3600.0,
+                        help="stop programs moving longer than this (s, default: 3600)")
+    parser.add_argument("--svg", action="store_true", help="write the path of each script to <script>.svg")
+    parser.add_argument("--png", action="store_true", help="write the path of each script to <script>.png")
+    parser.add_argument("--scale", type=float, default=1.0, help="pixels per mm of the PNG")
+    parser.add_argument("--json", metavar="FILE", help="write the summaries of all scripts to FILE")
+    args = parser.parse_args()
+
+    try:
+        from zumoadjust import ROTATION_ADJUST
+    except ImportError:
+        ROTATION_ADJUST = 1.0
+    floor = Floor.load(args.floor, args.cell) if args.floor else None
+    x, y, heading = args.start
+
+    report, failed = {}, False
+    for script in args.scripts:
+        planner = Planner(floor, x, y, heading, ROTATION_ADJUST, args.latency, args.max_time,
+                          args.blend)
+        try:
+            with open(script) as source:
+                plan(source, planner, move_while=args.move_while)
+        except Exception as err:
+            print "\033[1;31m[ERROR]\033[0m %s: %s: %s" % (script, err.__class__.__name__, err)
+            report[script] = {"error": "%s: %s" % (err.__class__.__name__, err)}
+            failed = True
+            continue
+        summary = report[script] = planner.summary()
+        print "%s: %.0f mm en %.1f s, %d commandes, cadre (%.0f, %.0f) - (%.0f, %.0f)" % (
+            (script, summary["distance"], summary["time"], summary["commands"]) +
+            tuple(summary["bounds"]))
+        base = os.path.splitext(script)[0]
+        if args.svg:
+            with open(base + ".svg", "w") as out:
+                out.write(planner.svg())
+        if args.png:
+            with open(base + ".png", "wb") as out:
+                out.write(planner.png(args.scale))
+
+    if args.json:
+        with open(args.json, "w") as out:
+            json.dump(report, out, indent=1, sort_keys=True)
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+The primitives of the french LOGO, shared by repl.py and planner.py
+"""
+
+import math
+
+from logo import Primitive, TrollException
+from protocol import FORWARD, BACKWARD, LEFT, RIGHT, MAX_MOVE_WHILE
+
+
+def wrap_print(text):
+    print text
+
+def preventTroll(func):
+    """Not funny to have high forward values"""
+    def f(*args):
+        for arg in args:
+            if arg > 1000:
+                raise TrollException(arg)
+        return func(*args)
+    return f
+
+def primitives_fr(robot):
+    """
+    The primitives of the french LOGO, moving robot: the zumoturtle
+    module or anything with the same functions (see aiozumo.Blocking,
+    planner.Planner)
+    """
+    P = Primitive
+    T = preventTroll
+    # Waiting for the robot
+    R = lambda func, arity, name: Primitive(func, arity, name, blocking=True)
+
+    # Motions stopped by the robot itself, checking its ground sensors:
+    # `avjusque seuil capteurs max` moves forward until one of the
+    # sensors reads at least seuil, `avtantque` while one does; both at
+    # most max, and give the length travelled
+    def moving(direction, above):
+        def f(threshold, sensors, length):
+            if length > MAX_MOVE_WHILE:
+                raise TrollException(length)
+            return robot.moveWhile(direction, threshold, sensors, length, above)
+        return f
+    guarded = {}
+    for direction, prefix in ((FORWARD, "av"), (BACKWARD, "re"), (LEFT, "ga"), (RIGHT, "dr")):
+        guarded[direction] = (R(moving(direction, False), 3, prefix + "jusque"),
+                              R(moving(direction, True), 3, prefix + "tantque"))
+
+    def motion(func, name, direction):
+        res = R(T(func), 1, name)
+        res.guarded = guarded[direction]
+        return res
+    sensors = R(robot.sensorsAbove, 2, "sensors")
+    sensors.ground_test = True
+
+    return (
+        motion(robot.turnLeft, "ga", LEFT),       motion(robot.turnLeft, "gauche", LEFT),
+        motion(robot.turnRight, "dr", RIGHT),     motion(robot.turnRight, "droite", RIGHT),
+        motion(robot.forward, "av", FORWARD),     motion(robot.forward, "avance", FORWARD),
+        motion(robot.backward, "re", BACKWARD),   motion(robot.backward, "recule", BACKWARD),
+        P(wrap_print, 1, "p"), P(wrap_print, 1, "print"),
+        sensors,
+        R(robot.getGroundSensor, 1, "sol"),
+        P(math.sqrt, 1, "racine", True), P(math.sqrt, 1, "rc", True),
+        P(exit, 0, "q"), P(exit, 0, "quit"),
+    ) + sum(guarded.values(), ())
@@ -0,0 +1,136 @@
+"""
+Profiler of LOGO programs, enabled with Evaluator(profile=True).
+
+Procedure bodies and the primitives of call nodes are wrapped when they
+are compiled, so programs analyzed without profiling run unchanged.
+For each procedure and primitive, the profiler counts calls and sums
+their wall time, inclusive and exclusive of callees, and the part of
+the exclusive time spent waiting (wall time less CPU time): for robot
+primitives, the time waiting for the robot.
+
+While profiling, procedure calls run on the Python stack, including
+with the vm engine. On the closure engine, a tail call replaces its
+caller's frame, so it is measured next to its caller, not inside.
+"""
+
+import time
+
+from logo import Primitive
+
+
+class Stats(object):
+    __slots__ = ('name', 'kind', 'calls', 'inclusive', 'exclusive', 'wait')
+
+    def __init__(self, name, kind):
+        self.name, self.kind = name, kind
+        self.calls = 0
+        self.inclusive = self.exclusive = self.wait = 0.0
+
+
+class Profiler(object):
+    def __init__(self, clock=time.time, cpu=time.clock):
+        self.clock, self.cpu = clock, cpu
+        # (kind, name) -> Stats
+        self.stats = {}
+        # Names of the calls in progress, and the (wall, cpu) time of
+        # their callees so far
+        self.stack = []
+        self.callees = [[0.0, 0.0]]
+        self.active = {}
+        # Stack of names -> exclusive time
+        self.stacks = {}
+        # Primitive -> measured copy
+        self.primitives = {}
+
+    def reset(self):
+        """Forget the measures so far"""
+        self.stats.clear()
+        self.stacks.clear()
+
+    def timed(self, key, func):
+        """Return func, measured as key"""
+        clock, cpu = self.clock, self.cpu
+        stack, callees, active, stacks = self.stack, self.callees, self.active, self.stacks
+        def f(*args):
+            stats = self.stats.get(key)
+            if stats is None:
+                stats = self.stats[key] = Stats(key[1], key[0])
+            stack.append(key[1])
+            callees.append([0.0, 0.0])
+            active[key] = active.get(key, 0) + 1
+            start, start_cpu = clock(), cpu()
+            try:
+                return func(*args)
+            finally:
+                wall, used = clock() - start, cpu() - start_cpu
+                inner_wall, inner_cpu = callees.pop()
+                outer = callees[-1]
+                outer[0] += wall
+                outer[1] += used
+                stats.calls += 1
+                active[key] -= 1
+                if not active[key]:
+                    # Recursive calls are in the outermost one
+                    stats.inclusive += wall
+                exclusive = wall - inner_wall
+                stats.exclusive += exclusive
+                stats.wait += max(0.0, exclusive - (used - inner_cpu))
+                path = tuple(stack)
+                stacks[path] = stacks.get(path, 0.0) + exclusive
+                stack.pop()
+        return f
+
+    def procedure(self, procedure, body):
+        """Return the body of procedure, measured"""
+        return self.timed(('pour', procedure.name), body)
+
+    def primitive(self, primitive):
+        """Return a measured copy of primitive"""
+        profiled = self.primitives.get(primitive)
+        if profiled is None:
+            func = self.timed(('prim', primitive.name), primitive.func)
+            profiled = Primitive(func, primitive.arity, primitive.name, primitive.pure,
+                                 primitive.blocking)
+            self.primitives[primitive] = profiled
+        return profiled
+
+    def instrument(self, node):
+        """Return node, with its primitive calls measured"""
+        kind = node[0]
+        if kind == 'call':
+            proc = node[1]
+            if isinstance(proc, Primitive):
+                proc = self.primitive(proc)
+            return ('call', proc, map(self.instrument, node[2]))
+        elif kind == 'tailcall':
+            return (kind, node[1], map(self.instrument, node[2])) + node[3:]
+        elif kind in ('list', 'seq'):
+            return (kind, map(self.instrument, node[1]))
+        elif kind in ('repeat', 'while'):
+            return (kind, self.instrument(node[1]), self.instrument(node[2]))
+        elif kind == 'if':
+            return ('if', self.instrument(node[1]), self.instrument(node[2]),
+                          self.instrument(node[3]))
+        elif kind == 'hoist':
+            return ('hoist', [(slot, self.instrument(expr)) for slot, expr in node[1]],
+                    self.instrument(node[2]))
+        return node
+
+    def report(self, limit=20):
+        """Text of the ranking by exclusive time"""
+        ranked = sorted(self.stats.values(), key=lambda s: -s.exclusive)
+        total = sum(s.exclusive for s in ranked)
+        wait = sum(s.wait for s in ranked)
+        lines = ["%d appels, %.3fs dont %.3fs d'attente (robot)" % (
+                     sum(s.calls for s in ranked), total, wait),
+                 "%8s %10s %10s %10s  %s" % ("appels", "inclusif", "exclusif", "attente", "nom")]
+        for s in ranked[:limit]:
+            lines.append("%8d %10.4f %10.4f %10.4f  %s%s" % (
+                s.calls, s.inclusive, s.exclusive, s.wait, s.name,
+                "" if s.kind == 'pour' else " (primitive)"))
+        return "\n".join(lines)
+
+    def folded(self):
+        """Folded stacks ("a;b;c microseconds" lines), for flamegraph.pl"""
+        return "".join("%s %d\n" % (";".join(path), round(t * 1e6))
+                       for path, t in sorted(self.stacks.items()))
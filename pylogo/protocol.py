@@ -0,0 +1,140 @@
+"""
+Console protocol of the Zumo sketch (arduino/src/sketch.ino).
+
+A command is 5 bytes: its name, then a big endian 32 bits parameter.
+The robot replies with the decimal result of the command and "\r\n".
+"""
+
+from struct import pack, unpack
+
+from logo import ProgramError
+
+FORWARD, BACKWARD, LEFT, RIGHT = 'f', 'b', 'l', 'r'
+GROUND_SENSOR, GROUND_SENSOR_SUM = 's', 'a'
+MUSIC, LEFT_ADJUST, SENSORS_ABOVE = 'p', 'c', 't'
+# Multi-command frame, see zumoturtle.set_pipeline
+FRAME = 'm'
+# Push the ground readings every param ms (0: stop), see zumoturtle.subscribe
+STREAM = 'v'
+# Move while a test of the ground sensors holds, see moving_param
+MOVE_WHILE = 'w'
+# Start of the pushed readings lines: "S r0 r1 r2 r3 r4 r5"
+STREAM_PREFIX = 'S'
+
+MOTIONS = (FORWARD, BACKWARD, LEFT, RIGHT)
+
+# Reply of getGroundSensor while the reflectance array is not ready
+NO_READING = 4294967295
+
+# Motor speeds of setSpeeds
+SPEED_MAX = 400
+SPEED_MIN = 100
+
+# Longest motion merged from blended ones, as the longest of LOGO
+MAX_BLEND = 1000
+# Longest motion of MOVE_WHILE
+MAX_MOVE_WHILE = 1000
+# Highest threshold of MOVE_WHILE (11 bits)
+MAX_THRESHOLD = 0x7FF
+
+
+def encode(cmd, param):
+    return pack('>cI', cmd, int(param) & 0xffffffff)
+
+
+def decode(data):
+    """(cmd, param) of a 5 bytes command"""
+    return unpack('>cI', data)
+
+
+def sensors_param(threshold, sensors):
+    """Parameter of SENSORS_ABOVE: threshold and bitset of sensor indexes"""
+    bitsensors = 0
+    for i in sensors:
+        assert(0 <= i < 6)
+        bitsensors |= (1 << i)
+    return unpack('>i', pack('>hh', threshold, bitsensors))[0]
+
+
+def moving_param(direction, threshold, sensors, length, above):
+    """
+    Parameter of MOVE_WHILE: move in direction (one of MOTIONS), at
+    most length, while one of sensors reads at least threshold (above),
+    or while none does (not above). Bits 0 to 5 are the sensors, 6 to 15
+    the length, 16 to 26 the threshold (as for SENSORS_ABOVE), 27 and 28
+    the direction and 29 above. Lengths and thresholds out of range raise
+    ProgramError.
+    """
+    threshold = int(threshold)
+    if not 0 <= threshold <= MAX_THRESHOLD:
+        raise ProgramError("Threshold %d out of 0..%d" % (threshold, MAX_THRESHOLD))
+    bitsensors = 0
+    for i in sensors:
+        assert(0 <= i < 6)
+        bitsensors |= (1 << i)
+    length = int(length)
+    if not 0 <= length <= MAX_MOVE_WHILE:
+        raise ProgramError("Length %d out of 0..%d" % (length, MAX_MOVE_WHILE))
+    return bitsensors | length << 6 | threshold << 16 | \
+        MOTIONS.index(direction) << 27 | int(bool(above)) << 29
+
+
+def moving_length(direction, length, rotation_adjust=1.0):
+    """Length of MOVE_WHILE for length in LOGO units; turns are adjusted"""
+    if direction in (LEFT, RIGHT):
+        length *= rotation_adjust
+    return min(MAX_MOVE_WHILE, int(length))
+
+
+def moved(length, sent, travelled):
+    """The part of length travelled by a MOVE_WHILE of length sent, in LOGO units"""
+    if travelled >= sent:
+        return length
+    elif sent == length:
+        return travelled
+    return length * travelled / float(sent)
+
+
+def parse_moving(param):
+    """direction, threshold, sensors bitset, length and above of a MOVE_WHILE parameter"""
+    return (MOTIONS[(param >> 27) & 3], (param >> 16) & 0x7FF, param & 0x3F,
+            (param >> 6) & 0x3FF, bool(param >> 29 & 1))
+
+
+def holds(readings, threshold, bitsensors, above):
+    """Does the test of MOVE_WHILE hold for the readings?"""
+    return any(bitsensors & (1 << i) and value >= threshold
+               for i, value in enumerate(readings)) == above
+
+
+def parse_readings(line):
+    """The six readings of a line pushed by the robot"""
+    return map(int, line.split()[1:])
+
+
+def motion_duration(param):
+    """Time (s) taken by the robot for a motion command of parameter param"""
+    T = 5 * int(param)
+    if T < 500:
+        return T * (SPEED_MAX / SPEED_MIN) / 1000.0
+    # Speed ramp of one step per millisecond
+    return T / 1000.0
+
+
+def blends(last, cmd, param):
+    """Is motion (cmd, param) merged with the previous command last (see blend)?"""
+    return last is not None and cmd in MOTIONS and last[0] == cmd and \
+        last[1] + param <= MAX_BLEND
+
+
+def blend(commands, cmd, param):
+    """
+    Append command (cmd, param) to the list commands, merged with the last
+    one if both are motions in the same direction: the robot then moves
+    in one speed ramp instead of stopping between them.
+    """
+    param = decode(encode(cmd, param))[1]
+    if commands and blends(commands[-1], cmd, param):
+        commands[-1] = (cmd, commands[-1][1] + param)
+    else:
+        commands.append((cmd, param))
@@ -0,0 +1,277 @@
+"""
+Record and replay of the commands sent to the robot.
+
+    python2 repl.py --record session.zlog carre.logo
+    python2 recorder.py session.zlog                        # print it
+    python2 recorder.py session.zlog --to localhost:6571 --speed 10
+    python2 repl.py --replay session.zlog carre.logo
+
+zumoturtle.record writes each command sent to the robot, its parameter,
+its reply and when it was sent and replied, in fixed-width records. The
+recording can then be sent again to a robot or a simulator, at its
+original pace or faster (reissue), or answer a run of the program in
+place of the robot (Player).
+"""
+
+import socket
+import struct
+import sys
+import time
+from collections import namedtuple
+
+from logo import ProgramError
+from protocol import encode, decode, sensors_param, moving_param, moving_length, moved, \
+    MOTIONS, STREAM, STREAM_PREFIX, FORWARD, BACKWARD, LEFT, RIGHT, GROUND_SENSOR, \
+    GROUND_SENSOR_SUM, MUSIC, LEFT_ADJUST, SENSORS_ABOVE, MOVE_WHILE, NO_READING
+
+try:
+    from time import monotonic
+except ImportError:
+    import ctypes
+    import ctypes.util
+
+    class _timespec(ctypes.Structure):
+        _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+    # Python 2: CLOCK_MONOTONIC of the C library on Linux, else the wall clock
+    _clock_gettime = None
+    if sys.platform.startswith('linux'):
+        try:
+            _clock_gettime = ctypes.CDLL(ctypes.util.find_library('rt')).clock_gettime
+        except (OSError, AttributeError):
+            pass
+    CLOCK_MONOTONIC = 1
+
+    def monotonic():
+        """Seconds from an arbitrary point, never going back"""
+        if _clock_gettime is None:
+            return time.time()
+        spec = _timespec()
+        _clock_gettime(CLOCK_MONOTONIC, ctypes.byref(spec))
+        return spec.tv_sec + spec.tv_nsec * 1e-9
+
+
+# File header: magic, version, size of a record, wall clock time of the start
+HEADER = struct.Struct('<4sHHd')
+MAGIC, VERSION = "ZLOG", 1
+# Record: command, flags, parameter, reply, sent and received (monotonic us)
+RECORD = struct.Struct('<cBxxIIQQ')
+# Flags: the reply is known (else the command was in a frame, which has
+# only one reply for all); the command was answered from the sensor
+# stream, without being sent
+REPLIED, STREAMED = 1, 2
+
+
+class Entry(namedtuple("Entry", "cmd param reply sent received streamed")):
+    """A recorded command; reply is None if unknown, times are in s"""
+    __slots__ = ()
+
+    @property
+    def latency(self):
+        return self.received - self.sent
+
+
+class Recorder(object):
+    """Writes the records of commands to the binary file out"""
+
+    def __init__(self, out):
+        self.out = out
+        out.write(HEADER.pack(MAGIC, VERSION, RECORD.size, time.time()))
+
+    def record(self, cmd, param, reply, sent, received, streamed=False):
+        """reply is the reply line of the robot, or None"""
+        flags = STREAMED if streamed else 0
+        try:
+            reply = int(reply) & 0xffffffff
+            flags |= REPLIED
+        except (TypeError, ValueError):
+            reply = 0
+        self.out.write(RECORD.pack(cmd, flags, int(param) & 0xffffffff, reply,
+                                   int(sent * 1e6), int(received * 1e6)))
+
+    def frame(self, commands, reply, sent, received):
+        """Record a frame: the reply is the one of its last command"""
+        for cmd, param in commands[:-1]:
+            self.record(cmd, param, None, sent, received)
+        cmd, param = commands[-1]
+        self.record(cmd, param, reply, sent, received)
+
+    def close(self):
+        self.out.close()
+
+
+def read(source):
+    """The wall clock time of the start and the Entries of a recording"""
+    magic, version, size, start = HEADER.unpack(source.read(HEADER.size))
+    if magic != MAGIC or version != VERSION or size != RECORD.size:
+        raise ValueError("Not a robot recording, or of another version")
+    entries = []
+    data = source.read()
+    for offset in xrange(0, len(data) - size + 1, size):
+        cmd, flags, param, reply, sent, received = RECORD.unpack_from(data, offset)
+        entries.append(Entry(cmd, param, reply if flags & REPLIED else None,
+                             sent / 1e6, received / 1e6, bool(flags & STREAMED)))
+    return start, entries
+
+
+def load(path):
+    with open(path, 'rb') as source:
+        return read(source)
+
+
+class ReplayError(ProgramError):
+    pass
+
+
+class Player(object):
+    """
+    Robot with the interface of zumoturtle answering from a recording:
+    the program must send the recorded commands, and gets the recorded
+    replies. Motions blended in the recording (see protocol.blend) match
+    the motions in the same direction they were made of.
+    """
+
+    def __init__(self, entries, rotation_adjust=1.0):
+        # Settings of the transport are not LOGO commands
+        self.entries = [e for e in entries if e.cmd != STREAM]
+        self.rotation_adjust = rotation_adjust
+        self.next = 0
+        # What is left of the next recorded motion, partly matched
+        self.left = None
+
+    def command(self, cmd, param):
+        """The recorded reply of command (cmd, param), as sent to the robot"""
+        param = decode(encode(cmd, param))[1]
+        if self.next >= len(self.entries):
+            raise ReplayError("End of the recording, at %s %d" % (cmd, param))
+        entry = self.entries[self.next]
+        left = entry.param if self.left is None else self.left
+        if entry.cmd != cmd or param > left or param < left and cmd not in MOTIONS:
+            raise ReplayError("Command %d: %s %d instead of %s %d as recorded" % (
+                self.next, cmd, param, entry.cmd, left))
+        if param < left:
+            self.left = left - param
+            return 0
+        self.next += 1
+        self.left = None
+        return entry.reply
+
+    def done(self):
+        """Have all recorded commands been replayed?"""
+        return self.next == len(self.entries)
+
+    def forward(self, length):
+        self.command(FORWARD, length)
+
+    def backward(self, length):
+        self.command(BACKWARD, length)
+
+    def turnLeft(self, angle):
+        self.command(LEFT, angle * self.rotation_adjust)
+
+    def turnRight(self, angle):
+        self.command(RIGHT, angle * self.rotation_adjust)
+
+    def changeLeftAdjust(self, ratio):
+        self.command(LEFT_ADJUST, int(ratio * 1000))
+
+    def playMusic(self):
+        self.command(MUSIC, 0)
+
+    def moveWhile(self, direction, threshold, sensors, length, above):
+        sent = moving_length(direction, length, self.rotation_adjust)
+        param = moving_param(direction, threshold, sensors, sent, above)
+        return moved(length, sent, self.command(MOVE_WHILE, param))
+
+    def sync(self):
+        pass
+
+    def sensorsAbove(self, threshold, sensors):
+        return self.command(SENSORS_ABOVE, sensors_param(threshold, sensors)) == 1
+
+    def getGroundSensor(self, index):
+        res = NO_READING
+        while res == NO_READING:
+            res = self.command(GROUND_SENSOR, index)
+        return res
+
+    def getGroundSensorSum(self):
+        return self.command(GROUND_SENSOR_SUM, 0)
+
+
+def reissue(entries, sock, speed=1.0, clock=monotonic, sleep=time.sleep):
+    """
+    Send the recorded commands to the robot or simulator connected to
+    sock, one at a time, speed times faster than recorded (as fast as
+    possible if None). Commands answered from the sensor stream were not
+    sent, and are not. Return the Entries of the replay.
+    """
+    replies = sock.makefile('rb')
+    sent = [e for e in entries if not e.streamed]
+    res = []
+    start = clock()
+    for entry in sent:
+        if speed:
+            wait = (entry.sent - sent[0].sent) / speed - (clock() - start)
+            if wait > 0:
+                sleep(wait)
+        t = clock()
+        sock.sendall(encode(entry.cmd, entry.param))
+        line = replies.readline()
+        while line.startswith(STREAM_PREFIX):
+            line = replies.readline()
+        if not line:
+            raise IOError("Connection to the robot closed")
+        res.append(Entry(entry.cmd, entry.param, int(line), t, clock(), False))
+    return res
+
+
+def differences(recorded, replayed):
+    """(index, recorded, replayed) of the commands whose replies differ"""
+    recorded = [e for e in recorded if not e.streamed]
+    return [(i, a, b) for i, (a, b) in enumerate(zip(recorded, replayed))
+            if a.reply is not None and a.reply != b.reply]
+
+
+def latencies(entries):
+    """Mean and highest latency (s) of the commands with a reply"""
+    times = [e.latency for e in entries if e.reply is not None and not e.streamed]
+    if not times:
+        return 0.0, 0.0
+    return sum(times) / len(times), max(times)
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Print or replay a recording of robot commands")
+    parser.add_argument("recording", help="file written by repl.py --record")
+    parser.add_argument("--to", metavar="HOST:PORT",
+                        help="send the commands again to this robot or simulator")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="replay this many times faster than recorded, 0: at once (default: 1)")
+    args = parser.parse_args()
+
+    start, entries = load(args.recording)
+    if not args.to:
+        print "# %s, %d commands" % (time.ctime(start), len(entries))
+        for entry in entries:
+            print "%10.3f %s %10d %10s %8.1fms%s" % (
+                entry.sent - entries[0].sent, entry.cmd, entry.param,
+                "-" if entry.reply is None else entry.reply,
+                entry.latency * 1000, " (stream)" if entry.streamed else "")
+        print "latency: mean %.1fms, max %.1fms" % tuple(t * 1000 for t in latencies(entries))
+        return
+
+    host, port = args.to.rsplit(":", 1)
+    sock = socket.create_connection((host, int(port)))
+    try:
+        replayed = reissue(entries, sock, args.speed or None)
+    finally:
+        sock.close()
+    for i, a, b in differences(entries, replayed):
+        print "command %d: %s %d replied %d instead of %d" % (i, a.cmd, a.param, b.reply, a.reply)
+    print "latency: recorded mean %.1fms, max %.1fms" % tuple(t * 1000 for t in latencies(entries))
+    print "         replayed mean %.1fms, max %.1fms" % tuple(t * 1000 for t in latencies(replayed))
+
+if __name__ == '__main__':
+    main()
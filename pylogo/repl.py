@@ -1,18 +1,37 @@
-from logo import Primitive, Evaluator, Env, UnterminatedExpression, ProgramError, ParseError, TrollException, UnknowIdentifier
-from sys import argv, stdin
-from zumoturtle import forward, backward, turnLeft, turnRight, getGroundSensor, playMusic, sensorsAbove, BLACK_THRES
+from logo import Primitive, Evaluator, Env, Parser, TrollException, UnknowIdentifier
+from cache import Cache
+from scheduler import Scheduler
+from completion import SymbolIndex
+from recorder import Player, load
+from primitives import primitives_fr, wrap_print
+import arrays
 import traceback
-import math
+import argparse
 import os
 
 Autocomplete = []
 
-def repl_init_readline(interpreter):
+# Completed words end at these; ':' is part of variable names
+COMPLETER_DELIMS = ' \t\n[]()"'
+
+def where(err):
+    """Position of a LOGO error in its source, for messages"""
+    if getattr(err, 'where', None) is None:
+        return ""
+    return " \033[0m(ligne %d, colonne %d)" % err.where
+
+def repl_init_readline(interpreter, parser):
+    index = SymbolIndex(interpreter.env, interpreter.keywords.values())
+
     def get_completion(text, state):
         global Autocomplete
         if state == 0:
-            Autocomplete = filter(lambda x: x.startswith(text), interpreter.env.keys())
-        return Autocomplete[state]
+            # The arguments of a procedure being defined come first
+            arguments = parser.arguments(readline.get_line_buffer())
+            Autocomplete = index.complete(text, arguments)
+        if state < len(Autocomplete):
+            return Autocomplete[state]
+        return None
 
     try:
         import readline
@@ -27,42 +46,65 @@ def repl_init_readline(interpreter):
 
         readline.parse_and_bind('tab: complete')
         readline.parse_and_bind('set editing-mode emacs')
+        readline.set_completer_delims(COMPLETER_DELIMS)
         readline.set_completer(get_completion)
     except Exception as err:
         print "\033[1;33m[WARNING]\033[0m Cannot setup readline:", str(err)
         print "      ... No advanced command-line edition features"
 
 
-def repl(interpreter, user_input=raw_input):
-    repl_init_readline(interpreter)
+def report_failed(scheduler):
+    """Print the errors of the background tasks"""
+    for task in scheduler.failed:
+        print "\033[31;1m[ERROR]\033[0m in task %s: %s: %s%s" % (
+            task.name, task.error.__class__.__name__, task.error, where(task.error))
+    del scheduler.failed[:]
+
+def repl(interpreter, user_input=raw_input, scheduler=None, robot=None):
+    """
+    Read and execute LOGO forms. With a scheduler, they run with the
+    tasks started by `lance`, which go on in the background, also while
+    waiting for input. robot plays the music of
+    errors (default: zumoturtle; see server.py for other robots and inputs).
+    """
+    if robot is None:
+        import zumoturtle as robot
+    parser = Parser(interpreter)
+    if user_input is raw_input:
+        repl_init_readline(interpreter, parser)
 
     first_prompt = " \001\033[1m\002(\001\033[31m\002l\001\033[32m\002o\001\033[33m\002g\001\033[34m\002o\001\033[0;1\002m)\001\033[0m \002> "
     cont_prompt  = "    ... > "
-    text, prompt = "", first_prompt
     while True:
         try:
-            text += user_input(prompt)
-            retval = interpreter.eval(text)
-            text, prompt = "", first_prompt
-            if retval is not None:
+            prompt = cont_prompt if parser.pending() else first_prompt
+            # Forms are executed as soon as they are complete
+            if scheduler is not None:
+                line = scheduler.run_during(user_input, prompt)
+                report_failed(scheduler)
+            else:
+                line = user_input(prompt)
+            prog = parser.feed(line + "\n")
+            if scheduler is not None:
+                retval = scheduler.execute(prog, interpreter.env)
+                report_failed(scheduler)
+            else:
+                retval = interpreter.run(prog)
+            robot.sync()
+            if prog and retval is not None:
                 print " =>", retval
-        except UnterminatedExpression:
-            text += "\n"
-            prompt = cont_prompt
-        except UnknowIdentifier as err:
-            print "\033[31;1mJe ne sais pas ce qu'est \033[33m%s\033[0m" % (err)
-            text, prompt = "", first_prompt
-            playMusic()
         except UnknowIdentifier as err:
-            print "\033[31;1mJe ne sais pas ce qu'est \033[33m%s\033[0m" % (err)
-            text, prompt = "", first_prompt
-            playMusic()
+            print "\033[31;1mJe ne sais pas ce qu'est \033[33m%s\033[0m%s" % (err, where(err))
+            parser.reset()
+            robot.playMusic()
         except TrollException as err:
             print "\033[1;33m", str(err), "\033[31mc'est beaucoup trop grand Oo\033[0m"
-            text, prompt = "", first_prompt
+            parser.reset()
         except KeyboardInterrupt:
             print
-            text, prompt = "", first_prompt
+            parser.reset()
+            if scheduler is not None:
+                scheduler.clear()
             continue
         except EOFError:
             print
@@ -70,52 +112,122 @@ def repl(interpreter, user_input=raw_input):
         except Exception as err:
             if "invalid literal" in str(err):
                 litteral = str(err).split(':')[-1].strip()
-                print "\033[31;1mJe ne comprends pas le nombre \033[33m%s\033[0m" % (litteral)
-                playMusic()
+                print "\033[31;1mJe ne comprends pas le nombre \033[33m%s\033[0m%s" % (litteral, where(err))
+                robot.playMusic()
             else:
-                print "\033[31;1m[ERROR]\033[0m", "%s: %s" % (err.__class__.__name__, err)
-            text, prompt = "", first_prompt
+                print "\033[31;1m[ERROR]\033[0m", "%s: %s%s" % (err.__class__.__name__, err, where(err))
+            parser.reset()
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="LOGO interpreter for the Zumo robots")
+    parser.add_argument("scripts", nargs="*", help="LOGO scripts to execute (REPL if none)")
+    parser.add_argument("--engine", choices=Evaluator.Engines, default="vm",
+                        help="execution engine; only vm runs the tasks of `lance` in turn (default: vm)")
+    parser.add_argument("--scoping", choices=Evaluator.Scopings, default="dynamic",
+                        help="where procedures find variables that are not their arguments (default: dynamic)")
+    parser.add_argument("--stack-budget", type=int, metavar="MB",
+                        help="memory for nested procedure calls (vm engine only)")
+    parser.add_argument("-O", "--optimize", action="store_true",
+                        help="compute constant expressions once and move invariant ones out of loops")
+    parser.add_argument("--move-while", action="store_true",
+                        help="loops of a motion while a ground test holds become motions the robot stops itself")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="send robot motions in batches, without waiting for each of them")
+    parser.add_argument("--blend", action="store_true",
+                        help="send robot motions in batches, consecutive ones in the same direction as one")
+    parser.add_argument("--profile", action="store_true",
+                        help="measure the time of procedures and primitives; `profil` prints the report")
+    parser.add_argument("--profile-output", metavar="FILE",
+                        help="write the profile as folded stacks (flamegraph) at the end")
+    parser.add_argument("--sensor-stream", type=int, metavar="MS",
+                        help="have the robot push its ground sensors every MS milliseconds")
+    parser.add_argument("--sensor-max-age", type=int, metavar="MS",
+                        help="oldest pushed sensor values used (default: twice the stream period)")
+    parser.add_argument("--record", metavar="FILE",
+                        help="record the commands sent to the robot and its replies (see recorder.py)")
+    parser.add_argument("--replay", metavar="FILE",
+                        help="answer from a recording instead of the robot, which must get the same commands")
+    parser.add_argument("--stream", action="store_true",
+                        help="run each form of the scripts as soon as it is read, without the cache")
+    parser.add_argument("--cache-dir", metavar="DIR",
+                        default=os.path.join(os.path.expanduser("~"), ".cache", "pylogo"),
+                        help="where analyzed scripts are kept for next runs (default: ~/.cache/pylogo)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="analyze the prelude and scripts again on each run")
+    args = parser.parse_args(argv)
+    if args.stack_budget and args.engine != "vm":
+        parser.error("--stack-budget needs --engine vm: the closure engine calls on the Python stack")
+    return args
+
+def make_evaluator(args, env):
+    """The Evaluator of the command line options args, on env"""
+    budget = args.stack_budget * 2**20 if args.stack_budget else None
+    return Evaluator(env=env, engine=args.engine, scoping=args.scoping, stack_budget=budget,
+                     optimize=args.optimize, move_while=args.move_while,
+                     profile=args.profile or bool(args.profile_output))
 
 def main():
+    args = parse_args()
+    # Connects to the robot: only imported to drive it (not by server.py)
+    import zumoturtle
+    robot = zumoturtle
+    if args.replay:
+        robot = Player(load(args.replay)[1], zumoturtle.ROTATION_ADJUST)
+    else:
+        if args.record:
+            zumoturtle.record(args.record)
+        zumoturtle.set_pipeline(args.pipeline or args.blend, args.blend)
+        if args.sensor_stream:
+            zumoturtle.subscribe(args.sensor_stream, args.sensor_max_age)
+
+    evaluator = make_evaluator(args, Env(None, *primitives_fr(robot)))
+    for primitive in arrays.primitives_fr(evaluator.env):
+        evaluator.env[primitive.name] = primitive
+    profiler = evaluator.profiler
+    if profiler is not None:
+        evaluator.env["profil"] = Primitive(lambda: wrap_print(profiler.report()), 0, "profil")
+        evaluator.env["profilraz"] = Primitive(profiler.reset, 0, "profilraz")
+    scheduler = Scheduler()
+    for primitive in scheduler.primitives_fr(evaluator):
+        evaluator.env[primitive.name] = primitive
+    cache = None if args.no_cache else Cache(args.cache_dir)
+    def run(path, stream=False):
+        with open(path) as source:
+            if stream:
+                # Each form runs once analyzed, and is dropped after
+                prog = evaluator.forms(source)
+            elif cache is not None:
+                prog = cache.parse(evaluator, source.read())
+            else:
+                prog = evaluator.parse(source)
+            try:
+                return scheduler.execute(prog, evaluator.env)
+            finally:
+                report_failed(scheduler)
 
-    def wrap_print(text):
-        print text
-
-    def preventTroll(func):
-        """Not funny to have high forward values"""
-        def f(*args):
-            for arg in args:
-                if arg > 1000:
-                    raise TrollException(arg)
-            return func(*args)
-        return f
-
-    P = Primitive
-    T = preventTroll
-
-    primitives_fr = (
-        P(T(turnLeft), 1, "ga"),  P(T(turnLeft), 1, "gauche"),
-        P(T(turnRight), 1, "dr"), P(T(turnRight), 1, "droite"),
-        P(T(forward), 1, "av"),   P(T(forward), 1, "avance"),
-        P(T(backward), 1, "re"),  P(T(backward), 1, "recule"),
-        P(wrap_print, 1, "p"), P(wrap_print, 1, "print"),
-        P(sensorsAbove, 2, "sensors"),
-        P(getGroundSensor, 1, "sol"),
-        P(math.sqrt, 1, "racine"), P(math.sqrt, 1, "rc"),
-        P(exit, 0, "q"), P(exit, 0, "quit"),
-    )
-
-    evaluator = Evaluator(env=Env(None, *primitives_fr))
-    evaluator.eval(open("prelude.logo").read())
-    if len(argv) > 1:
-        for script in argv[1:]:
+    run("prelude.logo")
+    if args.scripts:
+        for script in args.scripts:
             try:
-                retval = evaluator.eval(open(script).read())
+                retval = run(script, args.stream)
+                robot.sync()
             except Exception as err:
-                print "\033[1;31m[ERROR]\033[0m in execution of", script, ":", str(err)
+                print "\033[1;31m[ERROR]\033[0m in execution of", script, ":", str(err) + where(err)
                 traceback.print_exc()
+        # The tasks started by the scripts
+        scheduler.run()
+        report_failed(scheduler)
+        robot.sync()
+        if profiler is not None:
+            print profiler.report()
     else:
-        repl(evaluator)
+        repl(evaluator, scheduler=scheduler, robot=robot)
+    if args.replay and not robot.done():
+        print "\033[1;33m[WARNING]\033[0m %d recorded commands not replayed" % (
+            len(robot.entries) - robot.next)
+    if args.profile_output:
+        with open(args.profile_output, "w") as out:
+            out.write(profiler.folded())
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
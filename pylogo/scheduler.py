@@ -0,0 +1,245 @@
+"""
+Cooperative scheduler of LOGO tasks, running several programs of one
+Evaluator at a time.
+
+A task runs compiled top-level forms. With the vm engine, it is
+suspended at procedure calls, at each turn of a loop and after each
+primitive, so that the other tasks run too; with the closure engine,
+each form runs at once. The runnable task of highest priority runs
+first, tasks of equal priority in turn.
+
+Blocking primitives (see Primitive.blocking: robot motions and sensors)
+are called by a worker thread, one at a time: the task calling one
+waits for its result while the other tasks run.
+
+`lance "proc"` starts a task calling procedure proc:
+
+    pour clignote repete 10 [p "tic"] fin
+    lance "clignote" repete 3 [av 100 dr 120]
+"""
+
+import collections
+import threading
+import Queue
+
+from logo import Primitive, Callable, ProgramError, StackOverflow
+import vm
+
+
+class Pending(object):
+    """Result of a call made by a Worker"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = self.error = None
+
+    def ready(self):
+        return self.event.is_set()
+
+    def wait(self, timeout=None):
+        """The result, raising the error of the call if it failed"""
+        self.event.wait(timeout)
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+class Worker(object):
+    """Thread calling blocking functions, one at a time"""
+
+    def __init__(self):
+        self.calls = Queue.Queue()
+        thread = threading.Thread(target=self.serve)
+        thread.daemon = True
+        thread.start()
+
+    def serve(self):
+        while True:
+            func, args, pending = self.calls.get()
+            try:
+                pending.value = func(*args)
+            except BaseException as err:
+                pending.error = err
+            pending.event.set()
+
+    def submit(self, func, args):
+        pending = Pending()
+        self.calls.put((func, args, pending))
+        return pending
+
+
+class Task(object):
+    """Compiled top-level forms running in env"""
+
+    def __init__(self, forms, env, priority=0, name=''):
+        # Read as the task reaches them, see Evaluator.forms
+        self.forms = iter(forms)
+        self.env = env
+        self.priority = priority
+        self.name = name
+        self.steps = None
+        # Blocking call waited for
+        self.pending = None
+        self.result = self.error = None
+        self.done = False
+
+    def step(self, quantum, worker):
+        """
+        Run until quantum suspensions, the end, or a blocking call: then
+        return its Pending, after which step is called again.
+        """
+        try:
+            for i in xrange(quantum):
+                if self.steps is None:
+                    form = next(self.forms, None)
+                    if form is None:
+                        self.done = True
+                        return None
+                    if type(form) is not vm.Code:
+                        # Not suspendable
+                        self.result = form(self.env)
+                        continue
+                    self.value = []
+                    self.steps = vm.execute(form, self.env, self.value, preemptive=True)
+                try:
+                    if self.pending is not None:
+                        pending, self.pending = self.pending, None
+                        try:
+                            value = pending.wait()
+                        except Exception as err:
+                            call = self.steps.throw(err)
+                        else:
+                            call = self.steps.send(value)
+                    else:
+                        call = next(self.steps)
+                except StopIteration:
+                    self.result = self.value[0]
+                    self.steps = None
+                    continue
+                if call is not None:
+                    self.pending = worker.submit(*call)
+                    return self.pending
+        except RuntimeError as err:
+            if "recursion" not in str(err):
+                self.fail(err)
+            else:
+                self.fail(StackOverflow("Too many nested calls for the Python stack"))
+        except Exception as err:
+            self.fail(err)
+        return None
+
+    def fail(self, error):
+        self.error = error
+        self.done = True
+
+
+class Scheduler(object):
+    """
+    Runs tasks; each runs for at most quantum suspensions in turn.
+    Failed tasks are kept in self.failed.
+    """
+
+    def __init__(self, quantum=100):
+        self.quantum = quantum
+        self.worker = Worker()
+        # Runnable tasks by priority, and tasks waiting for a blocking call
+        self.runnable = collections.defaultdict(collections.deque)
+        self.waiting = []
+        self.failed = []
+
+    def spawn(self, forms, env, priority=0, name=''):
+        """Start a task running compiled top-level forms in env"""
+        task = Task(forms, env, priority, name)
+        self.runnable[priority].append(task)
+        return task
+
+    def tasks(self):
+        return [task for queue in self.runnable.values() for task in queue] + self.waiting
+
+    def clear(self):
+        """Forget all tasks"""
+        self.runnable.clear()
+        del self.waiting[:]
+
+    def wake(self, timeout=None):
+        """Make runnable the waiting tasks whose call is finished"""
+        if timeout is not None and self.waiting:
+            self.waiting[0].pending.event.wait(timeout)
+        for task in [task for task in self.waiting if task.pending.ready()]:
+            self.waiting.remove(task)
+            self.runnable[task.priority].append(task)
+
+    def next_task(self):
+        """The next runnable task, or None"""
+        for priority in sorted(self.runnable, reverse=True):
+            queue = self.runnable[priority]
+            if queue:
+                return queue.popleft()
+        return None
+
+    def run(self, until=None, stop=None):
+        """
+        Run the tasks until they all finish, until task until does, or
+        until the threading.Event stop is set
+        """
+        while (until is None or not until.done) and not (stop is not None and stop.is_set()):
+            self.wake()
+            task = self.next_task()
+            if task is None:
+                if not self.waiting:
+                    return
+                self.wake(0.01)
+                continue
+            pending = task.step(self.quantum, self.worker)
+            if task.done:
+                if task.error is not None:
+                    self.failed.append(task)
+            elif pending is not None:
+                self.waiting.append(task)
+            else:
+                self.runnable[task.priority].append(task)
+
+    def execute(self, forms, env):
+        """
+        Run compiled forms as a task, with the other tasks, until it
+        finishes; the other tasks are left to run later. Return the value
+        of the forms, or raise their error.
+        """
+        task = self.spawn(forms, env, name="main")
+        self.run(until=task)
+        if task.error is not None:
+            self.failed.remove(task)
+            raise task.error
+        return task.result
+
+    def run_during(self, func, *args):
+        """
+        Return func(*args), running the tasks on another thread meanwhile:
+        the REPL reads a line while the tasks started by `lance` go on.
+        """
+        if not self.tasks():
+            return func(*args)
+        stop = threading.Event()
+        thread = threading.Thread(target=self.run, kwargs={"stop": stop})
+        thread.daemon = True
+        thread.start()
+        try:
+            return func(*args)
+        finally:
+            stop.set()
+            thread.join()
+
+    def primitives_fr(self, evaluator):
+        """
+        `lance "proc"`: start a task calling procedure proc. Only the vm
+        engine suspends it: with the closure engine, a warning is printed.
+        """
+        def start(name):
+            proc = evaluator.env.get(name)
+            if not isinstance(proc, Callable) or proc.arity != 0:
+                raise ProgramError("%s is not a procedure without arguments" % name)
+            if evaluator.engine != "vm":
+                print "\033[1;33m[WARNING]\033[0m lance: %s runs at once on the %s engine (see --engine vm)" % (
+                    name, evaluator.engine)
+            self.spawn([evaluator.compile(('call', proc, []))], evaluator.env, name=name)
+        return (Primitive(start, 1, "lance"),)
@@ -0,0 +1,299 @@
+"""
+LOGO server: many REPL sessions over TCP, for the stations of a workshop.
+
+    python2 server.py --port 6580 --robot robot1.local:6571 --robot robot2.local:6571
+    nc server.local 6580
+
+The prelude is analyzed once, in an environment shared by all sessions
+and never changed by them. Each session has its own Evaluator, whose
+environment only holds the session's `donne` variables and `pour`
+procedures, on top of the shared one.
+
+Without --robot, each session drives a Planner (a dry run, see
+planner.py); else it is bound to the first free robot, and refused if
+there is none. The primitives of the shared environment move the robot
+of the session served by the calling thread, at most --command-rate
+commands per second; `p` prints to its client.
+"""
+
+import SocketServer
+import socket
+import sys
+import threading
+import time
+
+from logo import Evaluator, Env, Primitive, ProgramError
+from planner import Planner, Prelude
+from primitives import primitives_fr
+import arrays
+import repl
+
+# Longest line read from a client
+MAX_LINE = 4096
+
+_local = threading.local()
+
+
+def current():
+    """The Session served by the calling thread"""
+    session = getattr(_local, 'session', None)
+    if session is None:
+        raise ProgramError("Not in a LOGO session")
+    return session
+
+
+class Binding(object):
+    """
+    The zumoturtle functions of the robot of the current session, for the
+    primitives of the shared environment.
+    """
+
+    def __getattr__(self, name):
+        def f(*args):
+            session = current()
+            session.commands.wait()
+            return getattr(session.robot, name)(*args)
+        f.__name__ = name
+        return f
+
+
+class SessionEnv(object):
+    """
+    The environment of the current session, in which applique and filtre
+    call procedures (see arrays.primitives_fr)
+    """
+
+    @staticmethod
+    def env():
+        return current().evaluator.env
+
+    def __getitem__(self, key):
+        return self.env()[key]
+
+    def __setitem__(self, key, value):
+        self.env()[key] = value
+
+    def __contains__(self, key):
+        return key in self.env()
+
+    def __getattr__(self, name):
+        return getattr(self.env(), name)
+
+
+class Output(object):
+    """sys.stdout writing to the client of the current session, if any"""
+
+    def __init__(self, default):
+        self.default = default
+
+    def stream(self):
+        session = getattr(_local, 'session', None)
+        return self.default if session is None else session.wfile
+
+    def write(self, text):
+        self.stream().write(text)
+
+    def flush(self):
+        self.stream().flush()
+
+    # Used by the print statement, one per stream
+    @property
+    def softspace(self):
+        return getattr(self.stream(), 'softspace', 0)
+
+    @softspace.setter
+    def softspace(self, value):
+        try:
+            self.stream().softspace = value
+        except AttributeError:
+            pass
+
+
+class RateLimit(object):
+    """
+    At most rate events per second on average, in bursts of at most
+    burst events: wait() sleeps until the next one is allowed.
+    """
+
+    def __init__(self, rate, burst=1, clock=time.time, sleep=time.sleep):
+        self.rate = float(rate)
+        self.burst = burst
+        self.clock, self.sleep = clock, sleep
+        self.tokens = float(burst)
+        self.last = clock()
+
+    def wait(self):
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        if self.tokens < 1:
+            self.sleep((1 - self.tokens) / self.rate)
+            self.tokens, self.last = 1.0, self.clock()
+        self.tokens -= 1
+
+
+class Robots(object):
+    """Robots bound to one session at a time; without robots, a Planner each"""
+
+    def __init__(self, robots=None):
+        self.free = None if robots is None else list(robots)
+        self.lock = threading.Lock()
+
+    def bind(self):
+        """A robot for a new session, or None if all are bound"""
+        if self.free is None:
+            return Planner()
+        with self.lock:
+            return self.free.pop(0) if self.free else None
+
+    def release(self, robot):
+        if self.free is not None:
+            with self.lock:
+                self.free.append(robot)
+
+
+def shared_env(prelude=Prelude, engine="vm", scoping="dynamic", move_while=False):
+    """
+    The environment shared by sessions: primitives and prelude. It is
+    analyzed without optimize, so that running it changes nothing in it
+    (see optimize.memoize); with move_while for sessions to lower loops
+    on its tests (see Evaluator).
+    """
+    def quit():
+        # Ends the session (see repl.repl)
+        raise EOFError()
+    evaluator = Evaluator(Env(None, *primitives_fr(Binding())), engine=engine, scoping=scoping,
+                          move_while=move_while)
+    for primitive in arrays.primitives_fr(SessionEnv()):
+        evaluator.env[primitive.name] = primitive
+    evaluator.env["q"] = Primitive(quit, 0, "q")
+    evaluator.env["quit"] = Primitive(quit, 0, "quit")
+    with open(prelude) as source:
+        evaluator.eval(source)
+    return evaluator.env
+
+
+class Session(SocketServer.StreamRequestHandler):
+    """A REPL for one client, see Server"""
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            full = server.sessions >= server.max_sessions
+            if not full:
+                server.sessions += 1
+        if full:
+            self.wfile.write("Trop de sessions, reessayez plus tard\n")
+            return
+        try:
+            self.robot = server.robots.bind()
+            if self.robot is None:
+                self.wfile.write("Aucun robot libre, reessayez plus tard\n")
+                return
+            try:
+                self.serve()
+            finally:
+                server.robots.release(self.robot)
+        finally:
+            with server.lock:
+                server.sessions -= 1
+
+    def serve(self):
+        server = self.server
+        self.evaluator = Evaluator(server.env, engine=server.engine, scoping=server.scoping,
+                                   optimize=server.optimize, move_while=server.move_while)
+        self.commands = RateLimit(server.command_rate, server.burst)
+        self.lines = RateLimit(server.line_rate, server.burst)
+        if not isinstance(sys.stdout, Output):
+            sys.stdout = Output(sys.stdout)
+        _local.session = self
+        try:
+            repl.repl(self.evaluator, self.input, robot=self.robot)
+        except socket.error:
+            # Client gone
+            pass
+        finally:
+            _local.session = None
+
+    def input(self, prompt):
+        self.lines.wait()
+        # Without the markers of readline
+        self.wfile.write(prompt.replace("\001", "").replace("\002", ""))
+        line = self.rfile.readline(MAX_LINE)
+        if not line:
+            raise EOFError()
+        return line.rstrip("\r\n")
+
+
+class Server(SocketServer.ThreadingTCPServer):
+    """
+    Serves a Session per connection, each in its own thread, at most
+    max_sessions at a time. env is the shared environment (see
+    shared_env); robots a Robots. Sessions run at most command_rate robot
+    commands and line_rate input lines per second, in bursts of burst.
+    """
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address, env, robots=None, engine="vm", scoping="dynamic",
+                 optimize=False, command_rate=20.0, line_rate=20.0, burst=10,
+                 max_sessions=32, move_while=False):
+        SocketServer.ThreadingTCPServer.__init__(self, address, Session)
+        self.env = env
+        self.robots = robots or Robots()
+        self.engine, self.scoping, self.optimize = engine, scoping, optimize
+        self.move_while = move_while
+        self.command_rate, self.line_rate, self.burst = command_rate, line_rate, burst
+        self.max_sessions = max_sessions
+        self.sessions = 0
+        self.lock = threading.Lock()
+
+
+def connect_robot(address):
+    """Blocking functions of the robot at host:port (needs trollius, see aiozumo)"""
+    import trollius as asyncio
+    from aiozumo import Zumo
+    host, port = address.rsplit(":", 1)
+    zumo = Zumo(host, int(port), loop=asyncio.new_event_loop())
+    zumo.loop.run_until_complete(zumo.connect())
+    return zumo.blocking()
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="LOGO sessions over TCP, sharing one prelude")
+    parser.add_argument("--host", default="", help="address to listen on (default: all)")
+    parser.add_argument("--port", type=int, default=6580, help="port to listen on (default: 6580)")
+    parser.add_argument("--robot", action="append", metavar="HOST:PORT",
+                        help="robot bound to a session at a time (default: a dry run per session)")
+    parser.add_argument("--engine", choices=Evaluator.Engines, default="vm",
+                        help="execution engine (default: vm)")
+    parser.add_argument("--scoping", choices=Evaluator.Scopings, default="dynamic",
+                        help="where procedures find variables that are not their arguments (default: dynamic)")
+    parser.add_argument("-O", "--optimize", action="store_true",
+                        help="optimize the programs of the sessions")
+    parser.add_argument("--move-while", action="store_true",
+                        help="loops of a motion on a ground test become motions stopped by the robot, as repl.py --move-while")
+    parser.add_argument("--command-rate", type=float, default=20.0,
+                        help="robot commands per second of a session (default: 20)")
+    parser.add_argument("--line-rate", type=float, default=20.0,
+                        help="lines per second read from a session (default: 20)")
+    parser.add_argument("--max-sessions", type=int, default=32,
+                        help="sessions at a time (default: 32)")
+    args = parser.parse_args()
+
+    robots = Robots(map(connect_robot, args.robot) if args.robot else None)
+    server = Server((args.host, args.port), shared_env(Prelude, args.engine, args.scoping, args.move_while),
+                    robots, args.engine, args.scoping, args.optimize,
+                    args.command_rate, args.line_rate, max_sessions=args.max_sessions,
+                    move_while=args.move_while)
+    print >>sys.stderr, "LOGO server on port %d" % server.server_address[1]
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
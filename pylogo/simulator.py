@@ -0,0 +1,299 @@
+"""
+Local simulator of a Zumo robot, speaking the console protocol of
+arduino/src/sketch.ino on a TCP port, like the Bridge of a robot:
+
+    python2 simulator.py --floor piste.txt --speed 10
+
+then run repl.py, calibration.py... as with a real robot. The floor is
+an ASCII bitmap, '#' cells being black; x goes right and y up from its
+bottom left corner, the heading is in degrees from the x axis.
+"""
+
+import math
+import select
+import socket
+import threading
+import time
+
+from protocol import decode, motion_duration, parse_moving, holds, MOTIONS, \
+    FORWARD, BACKWARD, LEFT, RIGHT, GROUND_SENSOR, GROUND_SENSOR_SUM, \
+    MUSIC, LEFT_ADJUST, SENSORS_ABOVE, FRAME, STREAM, STREAM_PREFIX, MOVE_WHILE
+
+# Distance between the wheels (mm)
+WHEELBASE = 90.0
+# Position of the reflectance sensors: ahead of the wheels axis, and on
+# the left of the robot's center, from sensor 0 (left) to 5 (right)
+SENSOR_AHEAD = 40.0
+SENSOR_LEFT = (38.0, 22.0, 8.0, -8.0, -22.0, -38.0)
+# Readings of the reflectance sensors
+WHITE, BLACK = 100, 2000
+
+# Wheels directions of the motions, as in setSpeeds(left, right)
+Wheels = {FORWARD: (1, 1), BACKWARD: (-1, -1), LEFT: (-1, 1), RIGHT: (1, -1)}
+
+
+class Floor(object):
+    """Black and white floor; outside of it is white"""
+
+    def __init__(self, rows, cell=10.0):
+        self.rows = [row.rstrip("\n") for row in rows]
+        self.cell = cell
+        self.height = len(self.rows) * cell
+
+    @classmethod
+    def load(cls, path, cell=10.0):
+        with open(path) as f:
+            return cls(f.readlines(), cell)
+
+    def is_black(self, x, y):
+        row = int((self.height - y) // self.cell)
+        col = int(x // self.cell)
+        if 0 <= row < len(self.rows) and 0 <= col < len(self.rows[row]):
+            return self.rows[row][col] == '#'
+        return False
+
+
+class Robot(object):
+    """
+    Kinematic model of a Zumo. left_bias is the speed ratio of the left
+    motor to the right one, rotation_error the ratio of the actual
+    rotation to the requested one: both are what calibration corrects.
+    """
+
+    def __init__(self, floor=None, x=0.0, y=0.0, heading=90.0,
+                 left_bias=1.0, rotation_error=1.0, step=1.0):
+        self.floor = floor or Floor([])
+        self.x, self.y, self.heading = x, y, heading
+        self.left_bias = left_bias
+        self.rotation_error = rotation_error
+        # Distance (mm) of forward 1
+        self.step = step
+        # Sent by the host, see changeLeftAdjust
+        self.left_adjust = 1.0
+
+    def wheels(self, cmd, param):
+        """Distances (mm) travelled by the left and right wheels"""
+        left, right = Wheels[cmd]
+        if cmd in (FORWARD, BACKWARD):
+            travel = param * self.step
+        else:
+            travel = math.radians(param * self.rotation_error) * WHEELBASE / 2
+        return left * travel * self.left_adjust * self.left_bias, right * travel
+
+    def move(self, cmd, param, fraction=1.0):
+        """Apply fraction of a motion command"""
+        dl, dr = self.wheels(cmd, param)
+        dl, dr = dl * fraction, dr * fraction
+        distance, turn = (dl + dr) / 2, (dr - dl) / WHEELBASE
+        theta = math.radians(self.heading)
+        if abs(turn) < 1e-9:
+            self.x += distance * math.cos(theta)
+            self.y += distance * math.sin(theta)
+        else:
+            # Arc of a circle
+            radius = distance / turn
+            self.x += radius * (math.sin(theta + turn) - math.sin(theta))
+            self.y -= radius * (math.cos(theta + turn) - math.cos(theta))
+        self.heading = (self.heading + math.degrees(turn)) % 360
+
+    def move_while(self, param, each=None):
+        """
+        Run a MOVE_WHILE command (see protocol.moving_param) one unit of
+        length at a time, calling each() after each; return the length
+        travelled.
+        """
+        direction, threshold, sensors, length, above = parse_moving(param)
+        travelled = 0
+        while travelled < length and holds(self.readings(), threshold, sensors, above):
+            self.move(direction, 1)
+            travelled += 1
+            if each is not None:
+                each()
+        return travelled
+
+    def sensor_position(self, index):
+        theta = math.radians(self.heading)
+        left = SENSOR_LEFT[index]
+        return (self.x + SENSOR_AHEAD * math.cos(theta) - left * math.sin(theta),
+                self.y + SENSOR_AHEAD * math.sin(theta) + left * math.cos(theta))
+
+    def readings(self):
+        return [BLACK if self.floor.is_black(*self.sensor_position(i)) else WHITE
+                for i in range(len(SENSOR_LEFT))]
+
+
+class Simulator(object):
+    """
+    TCP server of a simulated robot, one connection at a time like the
+    Bridge console. speed is the time scale: 1 for the duration of the
+    real motions, 10 for 10 times faster, 0 to not wait at all.
+    """
+
+    def __init__(self, robot=None, speed=1.0, host='localhost', port=6571):
+        self.robot = robot or Robot()
+        self.speed = speed
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind((host, port))
+        self.server.listen(1)
+        self.port = self.server.getsockname()[1]
+        # Number of commands executed
+        self.commands = 0
+        self.stream_period = 0
+        self.next_stream = 0
+
+    def serve_forever(self):
+        while True:
+            try:
+                conn, addr = self.server.accept()
+            except socket.error:
+                # Closed
+                return
+            try:
+                self.handle(conn)
+            except socket.error:
+                pass
+            finally:
+                conn.close()
+
+    def start(self):
+        """Serve in a background thread"""
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def close(self):
+        self.server.close()
+
+    def handle(self, conn):
+        self.conn, self.received = conn, ""
+        self.stream_period = 0
+        while True:
+            cmd, param = self.read_command()
+            if cmd is None:
+                return
+            if cmd == FRAME:
+                # One reply, the result of the last command
+                res = 0
+                for k in range(param):
+                    cmd, param = self.read_command()
+                    if cmd is None:
+                        return
+                    last = self.execute(cmd, param)
+                    if last is not None:
+                        res = last
+                conn.sendall("%d\r\n" % res)
+            else:
+                res = self.execute(cmd, param)
+                if res is not None:
+                    conn.sendall("%d\r\n" % res)
+
+    def read_command(self):
+        """Next (cmd, param) received, pushing readings meanwhile"""
+        while len(self.received) < 5:
+            timeout = None
+            if self.stream_period:
+                timeout = max(0, self.next_stream - time.time())
+            if select.select([self.conn], [], [], timeout)[0]:
+                data = self.conn.recv(4096)
+                if not data:
+                    return None, None
+                self.received += data
+            self.stream()
+        data, self.received = self.received[:5], self.received[5:]
+        return decode(data)
+
+    def stream(self):
+        """Push the readings if it is time to"""
+        now = time.time()
+        if self.stream_period and now >= self.next_stream:
+            self.next_stream = now + self.stream_period / 1000.0
+            self.conn.sendall(STREAM_PREFIX + "".join(
+                " %d" % value for value in self.robot.readings()) + "\r\n")
+
+    def execute(self, cmd, param):
+        """Run a command and return its result; None for unknown commands"""
+        robot = self.robot
+        self.commands += 1
+        if cmd in MOTIONS:
+            self.motion(cmd, param)
+            return 0
+        elif cmd == GROUND_SENSOR:
+            if param < 6:
+                return robot.readings()[param]
+            return 0xffffffff
+        elif cmd == GROUND_SENSOR_SUM:
+            return sum(robot.readings())
+        elif cmd == SENSORS_ABOVE:
+            threshold, sensors = (param >> 16) & 0x7FF, param & 0x3F
+            readings = robot.readings()
+            return int(any(sensors & (1 << i) and readings[i] >= threshold
+                           for i in range(6)))
+        elif cmd == MOVE_WHILE:
+            return robot.move_while(param, self.unit if self.speed else None)
+        elif cmd == LEFT_ADJUST:
+            robot.left_adjust = param / 1000.0
+            return 0
+        elif cmd == MUSIC:
+            return 0
+        elif cmd == STREAM:
+            self.stream_period = param
+            self.next_stream = time.time()
+            return 0
+        self.commands -= 1
+        return None
+
+    def unit(self):
+        """Wait for a unit of MOVE_WHILE, at the lowest speed as short motions"""
+        time.sleep(motion_duration(1) / self.speed)
+        self.stream()
+
+    def motion(self, cmd, param):
+        """Move the robot, in real time if speed > 0"""
+        if not self.speed:
+            self.robot.move(cmd, param)
+            return
+        duration = motion_duration(param) / self.speed
+        start = done = time.time()
+        moved = 0.0
+        while moved < 1.0:
+            # Small steps, for the readings pushed meanwhile
+            time.sleep(min(0.01, max(0, start + duration - done)))
+            done = time.time()
+            fraction = min(1.0, (done - start) / duration) if duration else 1.0
+            self.robot.move(cmd, param, fraction - moved)
+            moved = fraction
+            self.stream()
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Zumo robot simulator")
+    parser.add_argument("--port", type=int, default=6571)
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="time scale of motions, 0 for no waiting (default: 1, real time)")
+    parser.add_argument("--floor", help="ASCII floor, '#' is black")
+    parser.add_argument("--cell", type=float, default=10.0, help="size of floor cells (mm)")
+    parser.add_argument("--start", type=float, nargs=3, metavar=("X", "Y", "HEADING"),
+                        default=(0.0, 0.0, 90.0), help="initial pose (mm, mm, degrees)")
+    parser.add_argument("--left-bias", type=float, default=1.0,
+                        help="speed of the left motor relative to the right one")
+    parser.add_argument("--rotation-error", type=float, default=1.0,
+                        help="actual rotation relative to the requested one")
+    args = parser.parse_args()
+
+    floor = Floor.load(args.floor, args.cell) if args.floor else None
+    x, y, heading = args.start
+    robot = Robot(floor, x, y, heading, args.left_bias, args.rotation_error)
+    simulator = Simulator(robot, args.speed, port=args.port)
+    print "Zumo simulator on port", simulator.port
+    try:
+        simulator.serve_forever()
+    except KeyboardInterrupt:
+        print
+        print "%d commands, robot at (%.0f, %.0f) heading %.0f" % (
+            simulator.commands, robot.x, robot.y, robot.heading)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+import time
+import pytest
+asyncio = pytest.importorskip("trollius")
+from trollius import From
+
+from aiozumo import Zumo
+from protocol import decode, motion_duration, MOTIONS
+from logo import Evaluator, Env
+from repl import primitives_fr
+
+
+class FakeRobot(object):
+    """Replies like the sketch; motions take their real duration"""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.commands = []
+
+    @asyncio.coroutine
+    def handle(self, reader, writer):
+        while True:
+            try:
+                data = yield From(reader.readexactly(5))
+            except asyncio.IncompleteReadError:
+                break
+            cmd, param = decode(data)
+            self.commands.append((cmd, param))
+            res = 0
+            if cmd in MOTIONS:
+                yield From(asyncio.sleep(motion_duration(param), loop=self.loop))
+            elif cmd == 's':
+                res = 1000 + param
+            elif cmd == 't':
+                res = 1
+            if cmd != 'x':
+                writer.write("%d\r\n" % res)
+        writer.close()
+
+    def start(self):
+        server = self.loop.run_until_complete(asyncio.start_server(
+            self.handle, '127.0.0.1', 0, loop=self.loop))
+        return server.sockets[0].getsockname()[1]
+
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+def connected(loop, timeout=5.0):
+    robot = FakeRobot(loop)
+    zumo = Zumo('127.0.0.1', robot.start(), timeout=timeout, loop=loop)
+    loop.run_until_complete(zumo.connect())
+    return robot, zumo
+
+
+def test_commands(loop):
+    robot, zumo = connected(loop)
+    loop.run_until_complete(zumo.forward(10))
+    assert loop.run_until_complete(zumo.getGroundSensor(2)) == 1002
+    assert loop.run_until_complete(zumo.sensorsAbove(500, [0, 5])) is True
+    assert robot.commands == [('c', 1000), ('f', 10), ('s', 2), ('t', 500 << 16 | 33)]
+    zumo.close()
+
+
+def test_concurrent_robots(loop):
+    (r1, z1), (r2, z2) = connected(loop), connected(loop)
+    start = time.time()
+    loop.run_until_complete(asyncio.gather(z1.forward(40), z2.forward(40), loop=loop))
+    # Both robots move at the same time
+    assert time.time() - start < 2 * motion_duration(40)
+    assert r1.commands[-1] == r2.commands[-1] == ('f', 40)
+
+
+def test_timeout(loop):
+    robot, zumo = connected(loop, timeout=0.05)
+    with pytest.raises(asyncio.TimeoutError):
+        loop.run_until_complete(zumo.send_cmd('x', 0))
+    with pytest.raises(IOError):
+        loop.run_until_complete(zumo.forward(1))
+
+
+def test_evaluator_primitives(loop):
+    robot, zumo = connected(loop)
+    zumo.rotation_adjust = 2
+    evaluator = Evaluator(Env(None, *primitives_fr(zumo.blocking())))
+    assert evaluator.eval("repete 2 [av 1 dr 3] sol 1") == 1001
+    assert robot.commands[1:] == [('f', 1), ('r', 6), ('f', 1), ('r', 6), ('s', 1)]
@@ -0,0 +1,80 @@
+import pickle
+import pytest
+import arrays
+from arrays import Array
+from logo import Evaluator, ProgramError
+
+
+@pytest.fixture(params=["python", "numpy"])
+def backend(request, monkeypatch):
+    if request.param == "python":
+        monkeypatch.setattr(arrays, "numpy", None)
+    else:
+        monkeypatch.setattr(arrays, "numpy", pytest.importorskip("numpy"))
+    return request.param
+
+
+@pytest.fixture(params=Evaluator.Engines)
+def evaluator(request, backend):
+    evaluator = Evaluator(engine=request.param)
+    for primitive in arrays.primitives_fr(evaluator.env):
+        evaluator.env[primitive.name] = primitive
+    evaluator.eval("""
+    donne :t tableau [1 2 3]
+    pour carre :x * :x :x fin
+    pour grand :x > :x 4 fin
+    """)
+    return evaluator
+
+
+@pytest.mark.parametrize("source, expected", [
+    ("(:t * 2) + 1", [3, 5, 7]),
+    ("10 - :t", [9, 8, 7]),
+    ("[1 1 1] + :t", [2, 3, 4]),
+    (":t / 2", [0, 1, 1]),
+    (":t > 1", [False, True, True]),
+    (":t = [1 0 3]", [True, False, True]),
+    ("intervalle 2 5", [2, 3, 4, 5]),
+    ("applique \"carre\" :t", [1, 4, 9]),
+    ("filtre \"grand\" intervalle 1 6", [5, 6]),
+    ("cos tableau [0 0]", [1.0, 1.0]),
+])
+def test_elementwise(evaluator, source, expected):
+    res = evaluator.eval(source)
+    assert isinstance(res, Array)
+    assert res.tolist() == expected
+
+
+@pytest.mark.parametrize("source, expected", [
+    ("somme :t", 6), ("somme :t > 1", 2), ("somme []", 0),
+    ("minimum :t", 1), ("maximum [4 8 2]", 8), ("compte intervalle 1 10", 10),
+    ("element 3 :t", 3), ("racine 16", 4.0),
+])
+def test_reductions(evaluator, source, expected):
+    res = evaluator.eval(source)
+    assert res == expected and type(res) is type(expected)
+
+
+@pytest.mark.parametrize("source", [
+    ":t + [1 2]", "tableau [\"a\"]", "element 4 :t", "minimum []",
+    "si :t > 1 [1]", "applique \"somme\" 1",
+])
+def test_errors(evaluator, source):
+    with pytest.raises(ProgramError):
+        evaluator.eval(source)
+
+
+def test_division_by_zero(backend):
+    with pytest.raises(ZeroDivisionError):
+        Array([1.0, 2.0]) / 0
+
+
+def test_pickle(backend):
+    assert pickle.loads(pickle.dumps(Array([1, 2]), 2)).tolist() == [1, 2]
+
+
+def test_folded(backend):
+    evaluator = Evaluator(optimize=True)
+    for primitive in arrays.primitives_fr(evaluator.env):
+        evaluator.env[primitive.name] = primitive
+    assert evaluator.eval("somme (intervalle 1 100) * 2") == 10100
@@ -0,0 +1,35 @@
+import bench
+
+
+def test_workloads_run(monkeypatch):
+    monkeypatch.setattr(bench, "Workloads", [
+        w for w in bench.Workloads if w[0] in ("tantque", "prelude")])
+    results = {}
+    bench.bench_interpreter(results, ["closure", "vm"], repeat=1)
+    assert sorted(results) == [
+        "analyze/closure/prelude", "analyze/closure/tantque",
+        "analyze/vm/prelude", "analyze/vm/tantque",
+        "execute/closure/prelude", "execute/closure/tantque",
+        "execute/vm/prelude", "execute/vm/tantque",
+        "tokenize/prelude", "tokenize/tantque"]
+    assert all(value > 0 and unit == "s" for value, unit in results.values())
+
+
+def test_big_source():
+    from logo import Evaluator, Env
+    evaluator = Evaluator(Env(None, *bench.robot_stubs()))
+    evaluator.eval(bench.big_source(10))
+    assert "proc9" in evaluator.env
+
+
+def test_compare():
+    baseline = {"a": (1.0, "s"), "b": (100, "cmd/s"), "c": (1.0, "s")}
+    results = {"a": (1.5, "s"), "b": (50, "cmd/s"), "c": (1.05, "s"), "d": (1, "s")}
+    assert [r[0] for r in bench.compare(results, baseline, 0.1)] == ["a", "b"]
+    assert bench.compare(baseline, baseline, 0.1) == []
+
+
+def test_startup():
+    results = {}
+    bench.bench_startup(results, repeat=1)
+    assert sorted(results) == ["startup/cold", "startup/warm"]
@@ -0,0 +1,119 @@
+import os
+import pytest
+import test_logo
+from logo import Evaluator, Env, Primitive
+from cache import Cache
+
+
+Source = """
+donne :pas 10 * 2
+pour cote 1 fin
+pour fois :n
+  si :n = 0 0 sinon cote * :n
+fin
+pour cote 10 fin
+pour carre :t
+  repete 4 [av :t + :pas]
+fin
+carre 5
+fois 3 + cote
+"""
+
+
+def evaluator(moves, **kwargs):
+    env = Env(None, Primitive(moves.append, 1, "av"))
+    return Evaluator(env, **kwargs)
+
+
+@pytest.fixture
+def cache(tmpdir):
+    return Cache(str(tmpdir.join("cache")))
+
+
+@pytest.mark.parametrize("options", [{}, {"engine": "vm"}, {"optimize": True},
+                                     {"scoping": "lexical"}])
+def test_replay(cache, options):
+    results = []
+    for i in range(2):
+        moves = []
+        e = evaluator(moves, **options)
+        prog = cache.parse(e, Source)
+        results.append((e.run(prog), moves, e.env[":pas"], sorted(e.env.content)))
+    assert cache.misses == cache.hits == 1
+    assert results[0] == results[1]
+    # fois keeps the first cote
+    assert results[0][:3] == (13, [25] * 4, 20)
+    assert {":pas", "carre", "cote", "fois"} <= set(results[0][3])
+
+
+def test_nested_procedures(cache):
+    source = """
+    pour dehors :x
+      pour dedans :y + :x :y fin
+      dedans 2
+    fin
+    dehors 1
+    """
+    for i in range(2):
+        e = Evaluator(scoping="lexical")
+        assert e.run(cache.parse(e, source)) == 3
+        assert e.env["dedans"].outer is e.env["dehors"]
+    assert cache.hits == 1
+
+
+def test_invalidation(cache):
+    moves = []
+    cache.parse(evaluator(moves), Source)
+    cache.parse(evaluator(moves), Source + "\n")
+    cache.parse(evaluator(moves, optimize=True), Source)
+    cache.parse(evaluator(moves, keywords=dict(Evaluator.Keywords_fr, LOOP="repeter")),
+                Source.replace("repete", "repeter"))
+    # Other arity of a primitive: the source means something else
+    e = Evaluator(Env(None, Primitive(lambda a, b: a, 2, "av")))
+    e.run(cache.parse(e, "av 1 2"))
+    assert cache.hits == 0 and cache.misses == 5
+
+
+def test_uses_previous_definitions(cache):
+    for i in range(2):
+        e = Evaluator()
+        e.eval("pour double :x 2 * :x fin")
+        assert e.run(cache.parse(e, "double 21")) == 42
+    assert cache.hits == 1
+    e = Evaluator()
+    e.eval("pour double :x :y * :x :y fin")
+    assert e.run(cache.parse(e, "double 21 3")) == 63
+    assert cache.hits == 1
+
+
+def test_effects_not_cached(cache, tmpdir):
+    c = test_logo.Counter()
+    for i in range(2):
+        e = Evaluator(Env(None, func=c.primitive()))
+        cache.parse(e, "donne x func")
+    assert c.calls == 2 and cache.hits == 0
+
+
+def test_eval_file(cache, tmpdir):
+    path = tmpdir.join("prog.logo")
+    path.write(Source)
+    for i in range(2):
+        assert cache.eval(evaluator([]), str(path)) == 13
+    assert cache.hits == 1
+    assert len(os.listdir(cache.directory)) == 1
+
+
+def test_lowered_test_redefined(cache):
+    moves = []
+    sensors = Primitive(lambda threshold, sensors: False, 2, "sensors")
+    sensors.ground_test = True
+    av = Primitive(lambda length: None, 1, "av")
+    av.guarded = (Primitive(lambda *args: 0, 3, "avjusque"),
+                  Primitive(lambda *args: moves.append(args) or 0, 3, "avtantque"))
+    for threshold in (250, 250, 500):
+        e = Evaluator(Env(None, sensors, av, *av.guarded), move_while=True)
+        e.eval("pour noir sensors %d [0 5] fin" % threshold)
+        # The loop is lowered with the test of noir
+        e.run(cache.parse(e, "tantque noir [av 5]"))
+    assert cache.hits == 1
+    assert [args[0] for args in moves] == [250, 250, 500]
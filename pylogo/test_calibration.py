@@ -0,0 +1,71 @@
+import pytest
+from calibration import Calibrator, CalibrationError
+from planner import Planner
+from simulator import Robot, Floor
+
+
+def mat(gap=300, width=400):
+    """The calibration mat, in cells of 1 mm: lines from y=100 and y=100+gap"""
+    rows = []
+    for y in range(100 + gap + 100, -1, -1):
+        black = 100 <= y < 130 or 100 + gap <= y < 130 + gap
+        rows.append(("#" if black else ".") * width)
+    return Floor(rows, cell=1.0)
+
+
+def robot(left_bias=1.0, rotation_error=1.0, floor=None):
+    planner = Planner()
+    planner.robot = Robot(floor or mat(), 200.0, 0.0, 90.0, left_bias, rotation_error)
+    return planner
+
+
+def test_calibrate():
+    planner = robot(left_bias=1.04, rotation_error=0.93)
+    calibrator = Calibrator(planner)
+    left_adjust, rotation_adjust, black_thres = calibrator.calibrate()
+    assert abs(left_adjust * 1.04 - 1) < 0.01
+    assert abs(rotation_adjust * 0.93 - 1) < 0.01
+    assert 100 < black_thres < 2000
+    # Back at the start
+    assert abs(planner.robot.y) < 5
+    assert abs(planner.robot.heading - 90) < 2
+
+
+def test_large_rotation_error():
+    # The robot misses the line by 65 degrees after its first full turn
+    planner = robot(left_bias=1.02, rotation_error=0.82)
+    left_adjust, rotation_adjust, black_thres = Calibrator(planner).calibrate()
+    assert abs(left_adjust * 1.02 - 1) < 0.01
+    assert abs(rotation_adjust * 0.82 - 1) < 0.01
+
+
+def test_already_calibrated():
+    planner = robot()
+    reports = []
+    calibrator = Calibrator(planner)
+    assert calibrator.calibrate(report=lambda *args: reports.append(args))[:2] == (1.0, 1.0)
+    assert len(reports) == 1
+
+
+def test_applied_rotation_adjust():
+    # Turns of the planner already corrected by 1.1
+    planner = robot(rotation_error=0.8)
+    planner.rotation_adjust = 1.1
+    calibrator = Calibrator(planner, rotation_adjust=1.1, applied=1.1)
+    rotation_adjust = calibrator.calibrate()[1]
+    assert abs(rotation_adjust * 0.8 - 1) < 0.01
+
+
+def test_no_line():
+    calibrator = Calibrator(robot(floor=Floor([])))
+    with pytest.raises(CalibrationError):
+        calibrator.run()
+
+
+def test_no_common_sensor():
+    calibrator = Calibrator(robot())
+    # The lines met by different sensors: the robot is far from across them
+    crossings = iter([{0: 100, 1: 140}, {4: 400, 5: 440}])
+    calibrator.crossing = lambda start: next(crossings)
+    with pytest.raises(CalibrationError):
+        calibrator.run()
@@ -0,0 +1,61 @@
+from logo import Evaluator, Env, Primitive, Parser
+from completion import Trie, SymbolIndex
+
+
+def test_trie():
+    trie = Trie()
+    for word in ("av", "avance", "arc", "re"):
+        trie[word] = len(word)
+    trie["av"] = 0
+    assert len(trie) == 4
+    assert trie.get("avance") == 6
+    assert trie.get("ava") is None
+    assert sorted(trie.items("av")) == [("av", 0), ("avance", 6)]
+    assert sorted(w for w, v in trie.items()) == ["arc", "av", "avance", "re"]
+    assert trie.items("x") == []
+
+
+def make_evaluator():
+    primitives = Env(None, Primitive(lambda x: x, 1, "av"), Primitive(lambda: 0, 0, "avg"))
+    return Evaluator(Env(primitives))
+
+
+def test_ranking():
+    evaluator = make_evaluator()
+    evaluator.eval("pour avancer :n av :n fin")
+    evaluator.eval("pour carre :c av :c fin")
+    evaluator.eval("donne :avant 3")
+    index = SymbolIndex(evaluator.env, evaluator.keywords.values())
+    # Procedures, primitives, keywords, variables
+    assert index.complete("av") == ["avancer", "av", "avg"]
+    assert index.complete("")[:2] == ["avancer", "carre"]
+    assert index.complete("")[-1] == ":avant"
+    assert index.complete("po") == ["pour"]
+    # Arguments first
+    assert index.complete(":", [":cote", ":avant"]) == [":avant", ":cote"]
+    assert index.complete(":a", [":cote"]) == [":avant"]
+
+
+def test_incremental():
+    evaluator = make_evaluator()
+    index = SymbolIndex(evaluator.env, evaluator.keywords.values())
+    assert index.complete("ca") == []
+    evaluator.eval("pour carre :c av :c fin")
+    evaluator.eval("donne :cote 10")
+    assert index.complete("ca") == ["carre"]
+    assert index.complete(":c") == [":cote"]
+    # Redefined as another kind
+    evaluator.eval("pour av2 1 fin")
+    evaluator.env["av"] = 1
+    assert index.complete("av") == ["av2", "avg", "av"]
+
+
+def test_parser_arguments():
+    parser = Parser(make_evaluator())
+    assert parser.arguments("pour carre :cote :n av") == [":cote", ":n"]
+    parser.feed("pour carre :cote\n")
+    assert parser.arguments("av :") == [":cote"]
+    parser.feed("av :cote\n")
+    assert parser.arguments("fin") == []
+    parser.feed("fin\n")
+    assert parser.arguments("av") == []
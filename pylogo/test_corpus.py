@@ -0,0 +1,77 @@
+import pytest
+from corpus import Runner, Budget, OutOfSteps, Timeout, run_corpus, scripts
+
+
+@pytest.fixture
+def corpus(tmpdir):
+    sources = {
+        "carre.logo": "pour carre :c repete 4 [av :c dr 90] fin\ncarre 100 p \"fini\" 7",
+        "boucle.logo": "tantque 1 = 1 [av 1]",
+        "erreur.logo": "av 10\nre truc",
+        "quitte.logo": "av 10 q av 20",
+        "applique.logo": "pour tourne :n tantque 1 = 1 [dr 1] fin applique \"tourne\" [1]",
+    }
+    for name, source in sources.items():
+        tmpdir.join("eleves", name).write(source, ensure=True)
+    tmpdir.join("eleves", "notes.txt").write("")
+    return tmpdir
+
+
+def test_scripts(corpus):
+    found = scripts([str(corpus.join("eleves"))])
+    assert [path.rsplit("/", 1)[1] for path in found] == \
+        ["applique.logo", "boucle.logo", "carre.logo", "erreur.logo", "quitte.logo"]
+
+
+def test_runner(corpus):
+    runner = Runner(max_steps=10000)
+    path, report = runner.run(str(corpus.join("eleves", "carre.logo")))
+    assert report["status"] == "ok" and report["result"] == 7
+    assert report["output"] == "fini\n"
+    assert report["trace"] == [('f', 100), ('r', 90)] * 4
+    assert report["robot"]["distance"] == 400 and report["steps"] > 8
+
+    report = runner.run(str(corpus.join("eleves", "boucle.logo")))[1]
+    assert report["status"] == "steps"
+    assert report["steps"] == 10001
+    report = runner.run(str(corpus.join("eleves", "erreur.logo")))[1]
+    assert report["status"] == "error" and "truc" in report["error"]
+    assert report["line"] == 2 and report["trace"] == [('f', 10)]
+    report = runner.run(str(corpus.join("eleves", "quitte.logo")))[1]
+    assert report["status"] == "ok" and report["trace"] == [('f', 10)]
+    # Scripts don't see the definitions of the previous ones
+    assert "carre" not in runner.env.content
+
+
+def test_runner_timeout(corpus):
+    # The loop runs in a procedure called by applique: no steps are counted
+    runner = Runner(max_steps=10000, timeout=0.2)
+    report = runner.run(str(corpus.join("eleves", "applique.logo")))[1]
+    assert report["status"] == "timeout" and report["steps"] < 10
+    assert report["elapsed"] < 2
+    assert runner.run(str(corpus.join("eleves", "carre.logo")))[1]["status"] == "ok"
+
+
+def test_budget():
+    now = [0.0]
+    budget = Budget(timeout=1, clock=lambda: now[0])
+    for i in range(Budget.CHECK):
+        budget.spend()
+    now[0] = 2
+    # Only checked every CHECK steps
+    for i in range(Budget.CHECK - 1):
+        budget.spend()
+    with pytest.raises(Timeout):
+        budget.spend()
+    with pytest.raises(OutOfSteps):
+        budget = Budget(max_steps=2)
+        for i in range(3):
+            budget.spend()
+
+
+def test_run_corpus(corpus):
+    paths = scripts([str(corpus)])
+    report = run_corpus(paths, jobs=2, max_steps=10000, timeout=1)
+    assert sorted(report) == sorted(paths)
+    assert sorted(script["status"] for script in report.values()) == \
+        ["error", "ok", "ok", "steps", "timeout"]
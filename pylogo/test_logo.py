@@ -1,6 +1,8 @@
 import pytest
-from logo import Evaluator, Env, Primitive
-from logo import UnknowIdentifier, UnterminatedExpression
+from StringIO import StringIO
+from logo import Evaluator, Env, Primitive, Parser, TokenStream, tokenize
+from logo import NUMBER, WORD, VAR, OPERATOR, BRACKET, STRING
+from logo import UnknowIdentifier, UnterminatedExpression, ParseError, StackOverflow
 
 def logo_eval(text, **env):
     return Evaluator(Env(parent=None, **env)).eval(text)
@@ -186,3 +188,209 @@ def test_infix_condition():
 def test_priority():
     assert logo_eval('(3*3) + (4*4)') == 25
     assert logo_eval('3 * (3+4) * 4') == 84
+
+
+def test_tokenize():
+    tokens = list(tokenize('av :n+1 ; comment\n[ "un  mot" ] 3'))
+    assert [(t.kind, t.text) for t in tokens] == [
+        (WORD, "av"), (VAR, ":n"), (OPERATOR, "+"), (NUMBER, "1"),
+        (BRACKET, "["), (STRING, "un mot"), (BRACKET, "]"), (NUMBER, "3")]
+    assert [(t.line, t.col) for t in tokens] == [
+        (1, 1), (1, 4), (1, 6), (1, 7), (2, 1), (2, 3), (2, 13), (2, 15)]
+
+
+def test_tokenize_multiline_string():
+    tokens = list(tokenize('"un\ndeux" 3'))
+    assert [(t.kind, t.text, t.line) for t in tokens] == [
+        (STRING, "un deux", 1), (NUMBER, "3", 2)]
+
+
+def test_tokenize_quotes_in_comment():
+    tokens = list(tokenize('p "a  b" ; dit "oui\nav "c" ; ""\n1'))
+    assert [(t.kind, t.text, t.line) for t in tokens] == [
+        (WORD, "p", 1), (STRING, "a b", 1), (WORD, "av", 2), (STRING, "c", 2),
+        (NUMBER, "1", 3)]
+    assert [t.col for t in tokens] == [1, 3, 1, 4, 1]
+
+
+def test_eval_stream():
+    assert logo_eval(StringIO("pour double :n\n  2 * :n\nfin\ndouble 21")) == 42
+
+
+def test_comment_at_end():
+    assert logo_eval("42 ; no newline") == 42
+
+
+def test_error_position():
+    with pytest.raises(UnknowIdentifier) as err:
+        logo_eval("pour f\n  1 + :x\nfin\nf")
+    assert err.value.where == (2, 7)
+
+    with pytest.raises(UnterminatedExpression) as err:
+        logo_eval("1\n  [ 2 3")
+    assert err.value.where == (2, 3)
+
+    with pytest.raises(ParseError) as err:
+        logo_eval("3 ]")
+    assert err.value.where == (1, 3)
+
+
+def test_dynamic_scoping():
+    source = """
+    pour voir
+      0 + :x
+    fin
+    pour montre :x
+      voir
+    fin
+    montre 42
+    """
+    assert logo_eval(source) == 42
+    with pytest.raises(UnknowIdentifier):
+        Evaluator(scoping="lexical").eval(source)
+
+
+def test_lexical_scoping():
+    source = """
+    donne :x 1
+    pour addition :a :b
+      pour add :n
+        + :a + :n :x
+      fin
+      add :b
+    fin
+    addition 16 25
+    """
+    assert Evaluator(scoping="lexical").eval(source) == 42
+    assert logo_eval(source) == 42
+
+
+def test_variable_slots():
+    evaluator = Evaluator(scoping="lexical")
+    evaluator.eval("pour f :a :b fin")
+    node, i = evaluator.analyze(list(tokenize(":b")), 0)
+    assert node[0] == 'lookup'
+    evaluator.scopes.append(evaluator.env["f"])
+    node, i = evaluator.analyze(list(tokenize(":b")), 0)
+    assert node == ('local', 1, ':b')
+
+
+def test_var_in_procedure_is_global():
+    with pytest.raises(UnknowIdentifier):
+        logo_eval("pour f :n donne x :n fin")
+
+
+def test_tail_recursion():
+    source = """
+    pour compte :n :acc
+      si :n = 0 :acc sinon compte :n - 1 :acc + 1
+    fin
+    compte 100000 0
+    """
+    assert logo_eval(source) == 100000
+
+
+def test_tail_call_other_procedure():
+    source = """
+    pour compte :n :acc
+      si :n = 0 :acc sinon compte :n - 1 :acc + 1
+    fin
+    pour depuis :n
+      compte :n 0
+    fin
+    depuis 100000
+    """
+    assert logo_eval(source) == 100000
+
+
+def test_deep_recursion_error():
+    source = """
+    pour somme :n
+      si :n = 0 0 sinon :n + somme :n - 1
+    fin
+    somme 100000
+    """
+    with pytest.raises(StackOverflow):
+        logo_eval(source)
+
+
+def test_redefinition():
+    source = """
+    pour cote 1 fin
+    pour carre 4 * cote fin
+    pour cote 10 fin
+    carre
+    """
+    # carre keeps calling the cote it was defined with
+    assert logo_eval(source) == 4
+    # Also in a tail call: the :x of the first b is its argument
+    source = """
+    pour b :x (:x) fin
+    pour a :x b 1 fin
+    pour b :y (:x) fin
+    a 5
+    """
+    assert logo_eval(source) == 1
+
+
+def test_eval_streams_forms():
+    log = []
+    def lines():
+        for i in range(1000):
+            log.append("read")
+            yield "av %d\n" % i
+    evaluator = Evaluator(Env(None, Primitive(log.append, 1, "av")))
+    evaluator.eval(lines())
+    # Forms run as they are read, after a bounded read ahead
+    assert log.index(0) < TokenStream.Lookahead
+    assert log.index(999) == len(log) - 1
+
+
+def feed_lines(parser, lines):
+    """Feed lines, return the results of the forms they complete, line by line"""
+    return [[func(parser.evaluator.env) for func in parser.feed(line)] for line in lines]
+
+
+def test_parser_procedure_lines():
+    evaluator = Evaluator()
+    evaluator.record = []
+    parser = Parser(evaluator)
+    results = feed_lines(parser, ["pour fact :n\n",
+                                  "  si :n = 0 1\n",
+                                  "  sinon :n * fact :n - 1\n",
+                                  "fin fact 5\n"])
+    assert results == [[], [], [], [120]]
+    assert not parser.pending()
+    # Analyzed once, when complete
+    assert [event[0] for event in evaluator.record].count('define') == 1
+
+
+def test_parser_runs_complete_forms():
+    moves = []
+    parser = Parser(Evaluator(Env(None, Primitive(moves.append, 1, "av"),
+                                  Primitive(lambda s: s, 1, "p"))))
+    results = feed_lines(parser, ['av 1 repete 2 [\n', 'av 2]\n', 'av\n', '3 p "a\n', 'b"\n'])
+    assert moves == [1, 2, 2, 3]
+    assert results == [[None], [2], [], [None], ["a b"]]
+
+
+def test_parser_error_resets():
+    parser = Parser(Evaluator())
+    parser.feed("repete 2 [\n")
+    with pytest.raises(ParseError) as err:
+        parser.feed("  )]\n")
+    assert err.value.where == (2, 3)
+    assert not parser.pending()
+    assert feed_lines(parser, ["1 + 2\n"]) == [[3]]
+
+
+def test_index_error_not_incomplete():
+    # An IndexError of a primitive run at analysis is not the end of the form
+    evaluator = Evaluator(Env(None, Primitive(lambda: [][0], 0, "vide")))
+    parser = Parser(evaluator)
+    for line in ["donne :x vide\n", "pour f donne :x vide fin\n"]:
+        with pytest.raises(IndexError):
+            parser.feed(line)
+        assert not parser.pending()
+    with pytest.raises(IndexError):
+        evaluator.eval("pour f donne :x vide fin")
@@ -0,0 +1,193 @@
+import pytest
+import test_logo
+from logo import Evaluator, Env, Primitive, UnknowIdentifier
+from optimize import optimize, fold, lower_loops
+
+
+def opt_eval(text, engine="closure", **env):
+    return Evaluator(Env(parent=None, **env), engine=engine, optimize=True).eval(text)
+
+
+@pytest.mark.parametrize("engine", Evaluator.Engines)
+@pytest.mark.parametrize("name", sorted(
+    n for n in dir(test_logo) if n.startswith("test_") and n != "test_deep_recursion_error"))
+def test_logo_suite(name, engine, monkeypatch):
+    """The whole interpreter test suite, with the optimizer"""
+    monkeypatch.setattr(test_logo, "logo_eval",
+                        lambda text, **env: opt_eval(text, engine, **env))
+    getattr(test_logo, name)()
+
+
+def analyze(text):
+    evaluator = Evaluator()
+    return evaluator.analyze(list(test_logo.tokenize(text)), 0)[0]
+
+
+def test_fold_constants():
+    assert fold(analyze("3 + 4 * 2")) == ('const', 11)
+    assert fold(analyze("cos 0")) == ('const', 1.0)
+
+
+def test_fold_keeps_errors():
+    node = fold(analyze("1 / 0"))
+    assert node[0] == 'call'
+    with pytest.raises(ZeroDivisionError):
+        opt_eval("1 / 0")
+
+
+def test_fold_keeps_effects():
+    c = test_logo.Counter()
+    assert opt_eval("si 1 < 2 [func 1 + 1] sinon [3]", func=c.primitive()) == [1, 2]
+    assert opt_eval("1 + 1 func", func=c.primitive()) == 2
+
+
+def test_dead_branch():
+    assert fold(analyze("si 1 > 2 [1] sinon [2]")) == ('list', [('const', 2)])
+    assert fold(analyze("tantque 1 > 2 [f]")) == ('const', None)
+
+
+def test_hoist_invariant():
+    calls = []
+    def double(x):
+        calls.append(x)
+        return 2 * x
+    source = """
+    pour boucle :n :x
+      repete :n [p :x + double :x]
+    fin
+    boucle 5 3
+    """
+    printed = []
+    env = dict(double=Primitive(double, 1, "double", True),
+               p=Primitive(printed.append, 1, "p"))
+    for engine in Evaluator.Engines:
+        del calls[:], printed[:]
+        opt_eval(source, engine, **env)
+        assert printed == [9] * 5
+        assert calls == [3]
+
+
+def test_hoist_never_moves_effects():
+    c = test_logo.Counter()
+    source = """
+    pour boucle :n
+      repete :n [+ :n func]
+    fin
+    boucle 4
+    """
+    opt_eval(source, func=c.primitive())
+    assert c.calls == 4
+
+
+def test_hoist_error_deferred():
+    source = """
+    pour boucle :n
+      repete :n [:inconnue + 1]
+    fin
+    boucle %d
+    """
+    for engine in Evaluator.Engines:
+        assert opt_eval(source % 0, engine) == 0
+        with pytest.raises(UnknowIdentifier):
+            opt_eval(source % 2, engine)
+
+
+def test_hoist_slots():
+    evaluator = Evaluator(optimize=True)
+    evaluator.eval("pour f :a repete 2 [repete 3 [:a * 2 + cos :a]] fin")
+    assert evaluator.env["f"].temps == 1
+    assert optimize(('const', 1)) == ('const', 1)
+
+
+Fib = """
+pour fib :n
+    si :n < 2 :n sinon (fib :n - 1) + fib :n - 2
+fin
+"""
+
+
+@pytest.mark.parametrize("engine", Evaluator.Engines)
+def test_memoize_pure(engine):
+    evaluator = Evaluator(engine=engine, optimize=True)
+    evaluator.eval(Fib + "pour double_fib :n * 2 fib :n fin")
+    fib, double = evaluator.env["fib"], evaluator.env["double_fib"]
+    assert fib.pure and double.pure
+    assert evaluator.eval("double_fib 30") == 1664080
+    assert fib.memo.misses == 31 and fib.memo.hits == 28
+    assert evaluator.eval("double_fib 30") == 1664080
+    assert double.memo.hits == 1
+    # Results depend on the types of the arguments
+    assert evaluator.eval("pour moitie :n / :n 2 fin moitie 3") == 1
+    assert evaluator.eval("moitie 3.0") == 1.5
+
+
+@pytest.mark.parametrize("source", [
+    "pour f :n av :n fin",
+    "pour f :n p :n fin",
+    "pour f :n + :n :x fin",
+    "pour f :n g :n fin",
+    "pour f :n si :n = 0 [0] sinon [g :n] fin",
+])
+def test_memoize_never_effects(source):
+    calls = []
+    evaluator = Evaluator(Env(None, Primitive(calls.append, 1, "av"),
+                              Primitive(calls.append, 1, "p")), optimize=True)
+    evaluator.eval("donne :x 1 pour g :n av :n fin")
+    evaluator.eval(source)
+    assert not evaluator.env["f"].pure and evaluator.env["f"].memo is None
+
+
+def test_memoize_redefinition():
+    calls = []
+    evaluator = Evaluator(Env(None, Primitive(calls.append, 1, "av")), optimize=True)
+    evaluator.eval("pour g :n * :n 2 fin pour f :n g :n + 1 fin")
+    assert evaluator.eval("f 1") == 4
+    # f keeps the first g and its results
+    evaluator.eval("pour g :n av :n fin")
+    assert evaluator.env["f"].pure and evaluator.eval("f 1") == 4
+    # A new f calls the new g: it has effects
+    evaluator.eval("pour f :n g :n + 1 fin")
+    assert not evaluator.env["f"].pure
+    evaluator.eval("f 1 f 1")
+    assert calls == [2, 2]
+
+
+def test_memo_bounded():
+    from logo import Memo
+    memo = Memo(2)
+    for n in range(3):
+        memo.put(Memo.key([n]), n)
+    assert memo.get(Memo.key([0])) is Memo.Missing
+    assert memo.get(Memo.key([2])) == 2
+    assert Memo.key([[1, 2]]) is None
+
+
+def test_lower_while():
+    moves = []
+    def move(threshold, sensors, length):
+        moves.append((threshold, sensors, length))
+        # Stopped by the test the third time
+        return length if len(moves) < 3 else 10
+    sensors = Primitive(lambda threshold, sensors: True, 2, "sensors")
+    sensors.ground_test = True
+    av = Primitive(lambda length: None, 1, "av")
+    av.guarded = (Primitive(lambda *args: 0, 3, "avjusque"), Primitive(move, 3, "avtantque"))
+    env = dict(sensors=sensors, av=av, avtantque=av.guarded[1])
+    evaluator = Evaluator(Env(None, **env), move_while=True)
+    evaluator.eval("pour noir sensors 250 [0 5] fin")
+    evaluator.eval("pour pasnoir non noir fin")
+    assert evaluator.env["noir"].test == (('const', 250), ('list', [('const', 0), ('const', 5)]), True)
+    assert evaluator.env["pasnoir"].test[2] is False
+    evaluator.eval("tantque noir [av 5]")
+    assert moves == [(250, [0, 5], 1000)] * 3
+    # Only with move_while, the optimizer keeps the loop
+    evaluator = Evaluator(Env(None, **env), optimize=True)
+    evaluator.eval("pour noir sensors 250 [0 5] fin")
+    assert evaluator.env["noir"].test is None
+    assert opt_eval("tantque 0 [av 5]", **env) is None
+    # Not the loops of other bodies or tests
+    for source in ("tantque noir [av 5 av 5]", "tantque noir [av 0]", "tantque 1 [av 5]",
+                   "tantque (sensors 250 [0]) = 1 [av 5]"):
+        tokens = list(test_logo.tokenize(source))
+        node = lower_loops(evaluator.analyze(tokens, 0)[0])
+        assert node[2] != ('list', []), source
@@ -0,0 +1,129 @@
+import pytest
+from logo import Evaluator, Env, TrollException, ProgramError
+from planner import Planner, Prelude, TooLong, plan
+from primitives import primitives_fr
+from protocol import motion_duration, sensors_param
+from simulator import Floor
+
+
+def approx(a, b):
+    return abs(a - b) < 1e-6
+
+
+def test_square():
+    planner = plan("repete 4 [av 100 dr 90]")
+    assert planner.commands == 8
+    assert approx(planner.time, 4 * (motion_duration(100) + motion_duration(90)))
+    assert planner.distance == 400
+    assert [(round(x), round(y)) for x, y in planner.path] == [
+        (0, 0), (0, 100), (100, 100), (100, 0), (0, 0)]
+    assert [round(v) for v in planner.bounds()] == [0, 0, 100, 100]
+    assert approx(planner.robot.heading, 90)
+
+
+def test_robot_parameters():
+    # What the robot gets: integers, and corrected angles
+    planner = plan("av 10.7 ga 90", rotation_adjust=1.5, latency=0.01)
+    assert planner.distance == 10
+    assert approx(planner.robot.heading, 180)
+    assert approx(planner.time, motion_duration(10) + motion_duration(135) + 0.02)
+
+
+def test_sensors():
+    floor = Floor(["#"], cell=1000)
+    # The robot goes up out of the black square
+    planner = plan("tantque noir [av 10]", floor=floor, x=500, y=500)
+    assert round(planner.robot.y) == 970
+
+
+def test_max_time():
+    with pytest.raises(TooLong):
+        plan("tantque 1 [av 100]", max_time=60)
+
+
+def test_exports():
+    planner = plan("av 100 dr 90 av 50")
+    svg = planner.svg()
+    assert svg.startswith("<svg") and 'points="0.0,-0.0 0.0,-100.0 50.0,-100.0"' in svg
+    png = planner.png(scale=0.5)
+    assert png.startswith("\x89PNG\r\n\x1a\n") and png.endswith("IEND\xaeB`\x82")
+
+
+def test_blend():
+    source = "repete 4 [repete 10 [av 10] dr 90] sensors 250 [0] dr 20 dr 20"
+    planner, blended = plan(source), plan(source, blend=True)
+    assert (planner.commands, blended.commands) == (47, 10)
+    assert blended.path[-1] == planner.path[-1]
+    assert approx(blended.time, 4 * (motion_duration(100) + motion_duration(90)) +
+                  motion_duration(40))
+    assert blended.time < planner.time / 1.5
+    # Sensors wait for the motions: not blended across them
+    assert plan("av 10 noir av 10", blend=True).commands == 3
+    # The trace has the commands as the robot gets them
+    assert plan("av 10 noir av 10 av 5", blend=True, trace=True).trace == \
+        [('f', 10), ('t', sensors_param(250, [0, 1, 2, 4, 5])), ('f', 15)]
+
+
+def test_move_while():
+    floor = Floor(["....", "####", "....", "...."], cell=100)
+    source = "tantque non noir [av 5] tantque noircentre [av 2]"
+    planner = plan(source, floor=floor, x=150, y=0, latency=0.01, trace=True)
+    lowered = plan(source, floor=floor, x=150, y=0, latency=0.01, trace=True, move_while=True)
+    assert planner.commands == 164
+    # One motion stopped by the robot for each loop
+    assert [cmd for cmd, param in lowered.trace] == ['w', 'w']
+    assert lowered.time < planner.time
+    assert round(planner.robot.y) == round(lowered.robot.y) == 261
+    # Stopped as soon as the test fails, not at a multiple of the step
+    assert round(plan("tantque non noir [av 5]", floor=floor, x=150, y=0).robot.y) == 165
+    assert round(plan("tantque non noir [av 5]", floor=floor, x=150, y=0,
+                      move_while=True).robot.y) == 161
+    # Not an optimization: -O alone keeps the loop
+    assert round(plan("tantque non noir [av 5]", floor=floor, x=150, y=0,
+                      optimize=True).robot.y) == 165
+    # Only loops of constant motions
+    assert plan("donne :x 5 tantque non noir [av :x]", floor=floor, x=150,
+                move_while=True).commands > 2
+
+
+def test_guarded_motions():
+    floor = Floor(["....", "####", "....", "...."], cell=100)
+    planner = plan("donne :a avjusque 1000 [0 5] 500 donne :b avtantque 1000 [0 5] 500",
+                   floor=floor, x=150, y=0)
+    assert round(planner.robot.y) == 261
+    assert planner.distance == 261
+    with pytest.raises(TrollException):
+        plan("avjusque 1000 [0] 2000")
+    # Not wrapped to a threshold of 0
+    with pytest.raises(ProgramError):
+        plan("avjusque 2048 [0] 10")
+    with pytest.raises(ProgramError):
+        plan("avjusque 1000 [0] 0 - 10")
+
+
+@pytest.mark.parametrize("scoping", Evaluator.Scopings)
+def test_move_while_lookups(scoping):
+    """Lowered loops read the variables of their test as the test did"""
+    floor = Floor(["....", "####", "....", "...."], cell=100)
+    def run(source, move_while):
+        planner = Planner(floor, 150, 0)
+        evaluator = Evaluator(Env(None, *primitives_fr(planner)), scoping=scoping,
+                              move_while=move_while)
+        with open(Prelude) as prelude:
+            evaluator.eval(prelude)
+        evaluator.eval(source)
+        return planner.robot.y
+    # $ of the prelude, changed after noir was defined: white is above it
+    source = "donne $ 100 tantque non noir [av 5]"
+    assert run(source, False) == run(source, True) == 0
+    # :s of the caller with dynamic scoping, the global one with lexical scoping
+    source = """
+    pour noirs sensors :s [0 1 2 4 5] fin
+    donne :s 250
+    pour cherche :s tantque non noirs [av 5] fin
+    cherche 100
+    """
+    if scoping == "dynamic":
+        assert run(source, False) == run(source, True) == 0
+    else:
+        assert run(source, False) > run(source, True) > 150
@@ -0,0 +1,71 @@
+import time
+import pytest
+from logo import Evaluator, Env, Primitive
+
+
+def profiled(engine="closure", **env):
+    return Evaluator(Env(None, **env), engine=engine, profile=True)
+
+
+Source = """
+pour fib :n
+  si :n < 2 :n sinon (fib :n - 1) + fib :n - 2
+fin
+pour deux
+  fib 5
+  fib 5
+fin
+deux
+"""
+
+
+@pytest.mark.parametrize("engine", Evaluator.Engines)
+def test_counts(engine):
+    evaluator = profiled(engine)
+    assert evaluator.eval(Source) == 5
+    stats = evaluator.profiler.stats
+    assert stats['pour', 'deux'].calls == 1
+    assert stats['pour', 'fib'].calls == 2 * 15
+    assert stats['prim', '<'].calls == 2 * 15
+    assert stats['prim', '+'].calls == 2 * 7
+
+
+def test_times():
+    evaluator = profiled(attends=Primitive(lambda: time.sleep(0.02), 0, "attends"))
+    evaluator.eval("pour fib :n si :n < 2 :n sinon (fib :n - 1) + fib :n - 2 fin "
+                   "pour f attends fib 3 0 fin f")
+    stats = evaluator.profiler.stats
+    f, fib, wait = stats['pour', 'f'], stats['pour', 'fib'], stats['prim', 'attends']
+    assert f.inclusive >= 0.02 > f.exclusive
+    # Recursive calls are counted once in inclusive time
+    assert fib.inclusive <= f.inclusive - wait.inclusive
+    assert abs(fib.inclusive - fib.exclusive - sum(
+        s.inclusive for k, s in stats.items() if k[0] == 'prim' and k[1] != 'attends')) < 1e-3
+    # Sleeping is waiting, not computing
+    assert wait.wait > 0.015
+
+
+def test_folded():
+    evaluator = profiled()
+    evaluator.eval(Source)
+    lines = evaluator.profiler.folded().splitlines()
+    paths = [line.rsplit(" ", 1)[0] for line in lines]
+    assert "deux" in paths and "deux;fib;fib;<" in paths
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
+
+
+def test_report_and_reset():
+    evaluator = profiled()
+    evaluator.eval(Source)
+    report = evaluator.profiler.report(limit=2).splitlines()
+    assert len(report) == 4 and report[0].startswith("103 appels")
+    evaluator.profiler.reset()
+    evaluator.eval("deux")
+    assert evaluator.profiler.stats['pour', 'deux'].calls == 1
+
+
+def test_off():
+    evaluator = Evaluator()
+    evaluator.eval("pour f :x :x fin")
+    assert evaluator.profiler is None
+    assert evaluator.env["f"].body.__name__ == "<lambda>"
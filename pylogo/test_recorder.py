@@ -0,0 +1,79 @@
+import socket
+from StringIO import StringIO
+import pytest
+from logo import Evaluator, Env
+from primitives import primitives_fr
+from protocol import sensors_param, NO_READING
+from recorder import Recorder, Player, ReplayError, Entry, RECORD, HEADER, \
+    read, reissue, differences, latencies, monotonic
+from simulator import Simulator, Robot, Floor, BLACK, WHITE
+
+
+def recording(*commands):
+    """Recording of (cmd, param, reply) sent 0.1s apart, replied 0.01s later"""
+    out = StringIO()
+    out.close = lambda: None
+    recorder = Recorder(out)
+    for i, (cmd, param, reply) in enumerate(commands):
+        recorder.record(cmd, param, reply, i * 0.1, i * 0.1 + 0.01)
+    return out.getvalue()
+
+
+def test_round_trip():
+    out = StringIO()
+    recorder = Recorder(out)
+    recorder.record('s', 2, "1234\r\n", 10.0, 10.002)
+    recorder.frame([('f', 100), ('l', 90)], "0", 11.0, 12.5)
+    recorder.record('t', sensors_param(1000, [0, 5]), True, 13.0, 13.0, streamed=True)
+    data = out.getvalue()
+    assert len(data) == HEADER.size + 4 * RECORD.size
+    start, entries = read(StringIO(data))
+    assert entries[0] == Entry('s', 2, 1234, 10.0, 10.002, False)
+    assert entries[1].reply is None and entries[2].reply == 0
+    assert entries[2].latency == 1.5
+    assert entries[3].reply == 1 and entries[3].streamed
+    assert latencies(entries) == (pytest.approx(0.751), 1.5)
+    with pytest.raises(ValueError):
+        read(StringIO("ZUMO" + data[4:]))
+
+
+def test_monotonic():
+    a = monotonic()
+    assert monotonic() >= a
+
+
+def test_player():
+    data = recording(('f', 100, "0"), ('s', 1, str(NO_READING)), ('s', 1, "1800"),
+                     ('t', sensors_param(1000, [1]), "1"), ('r', 90, "0"))
+    player = Player(read(StringIO(data))[1])
+    evaluator = Evaluator(Env(None, *primitives_fr(player)))
+    # The recorded motion was blended from these
+    assert evaluator.eval("repete 4 [av 25] sol 1") == 1800
+    assert evaluator.eval("sensors 1000 [1]") is True
+    assert not player.done()
+    with pytest.raises(ReplayError):
+        evaluator.eval("ga 90")
+    evaluator.eval("dr 45 dr 45")
+    assert player.done()
+    with pytest.raises(ReplayError):
+        evaluator.eval("av 10")
+
+
+def test_reissue():
+    floor = Floor(["##", ".."], cell=100)
+    simulator = Simulator(Robot(floor, 50, 0), speed=0, port=0).start()
+    try:
+        data = recording(('f', 50, "0"), ('s', 0, str(WHITE)), ('f', 50, "0"),
+                         ('s', 0, str(WHITE)))
+        entries = read(StringIO(data))[1]
+        sock = socket.create_connection(('localhost', simulator.port))
+        slept = []
+        replayed = reissue(entries, sock, speed=10, sleep=slept.append)
+        sock.close()
+    finally:
+        simulator.close()
+    assert [e.cmd for e in replayed] == ['f', 's', 'f', 's']
+    # At ten times the recorded pace
+    assert len(slept) == 3 and all(t <= 0.03 for t in slept)
+    # The robot is on black after the second motion
+    assert [(i, b.reply) for i, a, b in differences(entries, replayed)] == [(3, BLACK)]
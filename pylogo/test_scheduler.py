@@ -0,0 +1,121 @@
+import time
+import pytest
+from logo import Evaluator, Env, Primitive, UnknowIdentifier, ProgramError
+from scheduler import Scheduler
+
+
+def setup(engine="vm", quantum=1, **primitives):
+    log = []
+    env = Env(None, Primitive(log.append, 1, "note"),
+              *[Primitive(func, arity, name, blocking=blocking)
+                for name, (func, arity, blocking) in primitives.items()])
+    evaluator = Evaluator(env, engine=engine)
+    scheduler = Scheduler(quantum)
+    for primitive in scheduler.primitives_fr(evaluator):
+        evaluator.env[primitive.name] = primitive
+    return evaluator, scheduler, log
+
+
+def test_round_robin():
+    evaluator, scheduler, log = setup()
+    scheduler.spawn(evaluator.parse('repete 3 [note "a"]'), evaluator.env)
+    scheduler.spawn(evaluator.parse('repete 3 [note "b"]'), evaluator.env)
+    scheduler.run()
+    assert "".join(log) == "ababab"
+
+
+def test_closure_forms_not_suspended():
+    evaluator, scheduler, log = setup("closure")
+    scheduler.spawn(evaluator.parse('repete 3 [note "a"] note "c"'), evaluator.env)
+    scheduler.spawn(evaluator.parse('repete 3 [note "b"]'), evaluator.env)
+    scheduler.run()
+    assert "".join(log) == "aaabbbc"
+
+
+def test_streamed_forms():
+    evaluator, scheduler, log = setup()
+    def lines():
+        for i in range(1000):
+            log.append("read")
+            yield "note %d\n" % i
+    scheduler.execute(evaluator.forms(lines()), evaluator.env)
+    # Each form is analyzed when the task reaches it
+    assert "read" in log[log.index(0):]
+    assert log.count("read") == 1000
+
+
+def test_priority():
+    evaluator, scheduler, log = setup()
+    scheduler.spawn(evaluator.parse('repete 3 [note "a"]'), evaluator.env)
+    scheduler.spawn(evaluator.parse('repete 3 [note "b"]'), evaluator.env, priority=1)
+    scheduler.run()
+    assert "".join(log) == "bbbaaa"
+
+
+def test_blocking_steps_aside():
+    def wait(seconds):
+        time.sleep(seconds)
+        return seconds
+    evaluator, scheduler, log = setup(quantum=100, attends=(wait, 1, True))
+    evaluator.eval('pour compte :n si :n > 0 [note :n compte :n - 1] fin')
+    slow = scheduler.spawn(evaluator.parse('attends 0.2 note "fin"'), evaluator.env)
+    fast = scheduler.spawn(evaluator.parse('compte 50'), evaluator.env)
+    start = time.time()
+    scheduler.run()
+    assert time.time() - start < 0.35
+    assert slow.result is None and log[-1] == "fin" and len(log) == 51
+
+
+def test_blocking_error():
+    def fails(x):
+        raise ProgramError("robot lost")
+    evaluator, scheduler, log = setup(casse=(fails, 1, True))
+    with pytest.raises(ProgramError):
+        scheduler.execute(evaluator.parse('casse 1 note "jamais"'), evaluator.env)
+    assert log == []
+
+
+@pytest.mark.parametrize("engine", Evaluator.Engines)
+def test_lance(engine):
+    evaluator, scheduler, log = setup(engine)
+    evaluator.eval('pour fond repete 2 [note "f"] fin pour erreur note :x fin')
+    assert scheduler.execute(evaluator.parse(
+        'lance "fond" lance "erreur" note "m" 42'), evaluator.env) == 42
+    scheduler.run()
+    assert sorted(log) == ["f", "f", "m"]
+    [failed] = scheduler.failed
+    assert failed.name == "erreur" and isinstance(failed.error, UnknowIdentifier)
+    with pytest.raises(ProgramError):
+        scheduler.execute(evaluator.parse('lance "note"'), evaluator.env)
+
+
+def test_background_task():
+    evaluator, scheduler, log = setup()
+    evaluator.eval('pour boucle note "b" boucle fin')
+    # The main task returns, the endless one goes on
+    assert scheduler.execute(evaluator.parse('lance "boucle" note "m" 42'),
+                             evaluator.env) == 42
+    assert len(scheduler.tasks()) == 1
+    # Also while the REPL waits for input
+    count = len(log)
+    assert scheduler.run_during(lambda seconds: time.sleep(seconds) or "av 1", 0.05) == "av 1"
+    assert len(log) > count + 10
+    count = len(log)
+    assert scheduler.execute(evaluator.parse('note "m" 7'), evaluator.env) == 7
+    assert "m" in log[count:]
+    scheduler.clear()
+    assert scheduler.run_during(lambda: "fin") == "fin"
+
+
+def test_lance_with_repl_defaults():
+    from repl import parse_args, make_evaluator
+    log = []
+    evaluator = make_evaluator(parse_args([]), Env(None, Primitive(log.append, 1, "note")))
+    scheduler = Scheduler()
+    for primitive in scheduler.primitives_fr(evaluator):
+        evaluator.env[primitive.name] = primitive
+    evaluator.eval('pour fond repete 200 [note "f"] fin')
+    scheduler.execute(evaluator.parse('lance "fond" repete 200 [note "m"]'), evaluator.env)
+    scheduler.run()
+    # Interleaved, not one task after the other
+    assert "".join(log).count("fm") > 1
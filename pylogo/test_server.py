@@ -0,0 +1,140 @@
+import os
+import socket
+import threading
+import time
+import pytest
+from planner import Planner
+from server import Server, Robots, RateLimit, shared_env
+
+
+@pytest.fixture
+def server(request):
+    robots = getattr(request, "param", None)
+    server = Server(("localhost", 0), shared_env(), robots, max_sessions=2)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+class Client(object):
+    def __init__(self, server):
+        self.sock = socket.create_connection(server.server_address)
+        self.received = ""
+        self.banner = self.read()
+
+    def read(self):
+        """Output up to the next prompt (or the end)"""
+        while not self.received.split("\n")[-1].endswith("> "):
+            data = self.sock.recv(4096)
+            if not data:
+                break
+            self.received += data
+        res, self.received = self.received, ""
+        return res.rsplit("\n", 1)[0] if "\n" in res else ""
+
+    def send(self, line):
+        self.sock.sendall(line + "\n")
+        return self.read()
+
+    def close(self):
+        self.sock.close()
+
+
+def test_sessions_are_isolated(server):
+    a, b = Client(server), Client(server)
+    a.send("donne :x 5")
+    a.send("pour f 1 fin")
+    assert "5" in a.send("p :x")
+    assert "Je ne sais pas ce qu'est" in b.send("p :x")
+    b.send("donne :x 7")
+    assert "7" in b.send("p :x")
+    assert "5" in a.send("p :x")
+    # Only the prelude and primitives are shared
+    assert ":x" not in server.env.content
+    assert "noir" in server.env.content
+    a.close()
+    b.close()
+
+
+def test_prelude_shared(server):
+    a = Client(server)
+    # Procedures of the prelude read the robot of the session
+    assert "=> False" in a.send("noir")
+    a.close()
+
+
+def test_arrays_in_session(server):
+    a = Client(server)
+    a.send("donne :k 2")
+    a.send("pour f :x * :x :k fin")
+    # f reads :k of the session, called by a primitive of the shared env
+    assert "=> [2, 4]" in a.send('applique "f" [1 2]')
+    a.close()
+
+
+def test_multi_line_and_quit(server):
+    a = Client(server)
+    a.send("pour carre :n")
+    a.send("* :n :n")
+    a.send("fin")
+    assert "=> 49" in a.send("carre 7")
+    # The session ends
+    assert a.send("q").strip() == ""
+    assert a.sock.recv(4096) == ""
+
+
+def test_max_sessions(server):
+    a, b = Client(server), Client(server)
+    c = socket.create_connection(server.server_address)
+    assert "Trop de sessions" in c.recv(4096)
+    c.close()
+    a.close()
+    b.close()
+
+
+robots = Robots([Planner(), Planner()])
+
+@pytest.mark.parametrize("server", [robots], indirect=True)
+def test_robot_binding(server):
+    a, b = Client(server), Client(server)
+    a.send("av 100")
+    b.send("repete 2 [re 30]")
+    assert sorted(robot.distance for robot in robots.free) == []
+    a.close()
+    b.close()
+    # Released when the sessions end
+    for i in range(100):
+        if len(robots.free) == 2:
+            break
+        time.sleep(0.01)
+    assert sorted(robot.distance for robot in robots.free) == [60, 100]
+
+
+def test_rate_limit():
+    now, slept = [0.0], []
+    def sleep(t):
+        slept.append(t)
+        now[0] += t
+    limit = RateLimit(2, burst=3, clock=lambda: now[0], sleep=sleep)
+    for i in range(3):
+        limit.wait()
+    assert slept == []
+    limit.wait()
+    assert slept == [0.5]
+    now[0] += 10
+    for i in range(3):
+        limit.wait()
+    assert slept == [0.5]
+
+
+def test_no_robot_connection():
+    # The server drives robots through aiozumo or Planners, never zumoturtle
+    import subprocess
+    import sys
+    out = subprocess.check_output([sys.executable, "-c",
+                                   "import server, sys; print 'zumoturtle' in sys.modules"],
+                                  cwd=os.path.dirname(os.path.abspath(__file__)))
+    assert out == "False\n"
@@ -0,0 +1,139 @@
+import socket
+import time
+import pytest
+from simulator import Simulator, Robot, Floor, BLACK, WHITE
+from protocol import encode, sensors_param, blend, motion_duration, moving_param
+
+
+def approx(a, b):
+    return abs(a - b) < 1e-6
+
+
+@pytest.fixture
+def simulator():
+    floor = Floor([
+        "....",
+        ".##.",
+        "....",
+    ], cell=100)
+    simulator = Simulator(Robot(floor, 150, 50), speed=0, port=0).start()
+    yield simulator
+    simulator.close()
+
+
+def connect(simulator):
+    sock = socket.create_connection(('localhost', simulator.port))
+    sock.settimeout(5)
+    return sock, sock.makefile()
+
+
+def test_straight_moves():
+    robot = Robot()
+    robot.move('f', 100)
+    assert approx(robot.x, 0) and approx(robot.y, 100)
+    robot.move('r', 90)
+    robot.move('b', 30)
+    assert approx(robot.x, -30) and approx(robot.y, 100) and approx(robot.heading, 0)
+
+
+def test_drift_and_rotation_error():
+    robot = Robot(left_bias=1.1)
+    robot.move('f', 100)
+    # The left wheel is faster: turns right
+    assert robot.x > 0 and robot.heading < 90
+    robot.left_adjust = 1 / 1.1
+    heading = robot.heading
+    robot.move('f', 100)
+    assert approx(robot.heading, heading)
+
+    robot = Robot(rotation_error=0.9)
+    robot.move('l', 100)
+    assert approx(robot.heading, 180)
+
+
+def test_partial_moves():
+    robot, parts = Robot(left_bias=1.2), Robot(left_bias=1.2)
+    robot.move('f', 100)
+    for i in range(4):
+        parts.move('f', 100, 0.25)
+    assert approx(robot.x, parts.x) and approx(robot.y, parts.y)
+
+
+def test_sensors(simulator):
+    robot = simulator.robot
+    # Sensors 40mm ahead of (150, 50): white; then over the black cells
+    assert robot.readings() == [WHITE] * 6
+    robot.x, robot.y, robot.heading = 200, 100, 90
+    assert robot.readings() == [BLACK] * 6
+    robot.heading = 0
+    assert robot.readings() == [BLACK] * 3 + [WHITE] * 3
+
+
+def test_protocol(simulator):
+    sock, replies = connect(simulator)
+    sock.sendall(encode('c', 1000) + encode('f', 60) + encode('s', 1) +
+                 encode('t', sensors_param(1000, [0, 5])) + encode('s', 7))
+    assert [replies.readline() for i in range(5)] == \
+        ["0\r\n", "0\r\n", "%d\r\n" % BLACK, "1\r\n", "4294967295\r\n"]
+    assert approx(simulator.robot.y, 110)
+
+    # Frame: one reply for all, unknown commands are skipped
+    sock.sendall(encode('m', 3) + encode('r', 90) + encode('x', 0) + encode('a', 0))
+    assert replies.readline() == "%d\r\n" % (4 * BLACK + 2 * WHITE)
+    assert simulator.commands == 7
+
+
+def test_stream(simulator):
+    sock, replies = connect(simulator)
+    sock.sendall(encode('v', 5))
+    assert replies.readline() == "0\r\n"
+    assert replies.readline() == "S" + " %d" % WHITE * 6 + "\r\n"
+    sock.sendall(encode('v', 0))
+    line = replies.readline()
+    while line.startswith("S"):
+        line = replies.readline()
+    assert line == "0\r\n"
+
+
+def test_timing(simulator):
+    simulator.speed = 10
+    sock, replies = connect(simulator)
+    start = time.time()
+    sock.sendall(encode('f', 200))
+    assert replies.readline() == "0\r\n"
+    # 1s on the robot
+    assert 0.09 < time.time() - start < 0.5
+
+
+def test_blend():
+    commands = []
+    for cmd, param in [('f', 10), ('f', 20.5), ('r', 90), ('r', 36), ('p', 0), ('p', 0),
+                       ('f', 600), ('f', 600), ('b', 5)]:
+        blend(commands, cmd, param)
+    # At most MAX_BLEND in one motion
+    assert commands == [('f', 30), ('r', 126), ('p', 0), ('p', 0), ('f', 600), ('f', 600), ('b', 5)]
+    # The same motion, in less time
+    robot, blended = Robot(left_bias=1.1), Robot(left_bias=1.1)
+    robot.move('f', 10)
+    robot.move('f', 20)
+    blended.move(*commands[0])
+    assert approx(robot.x, blended.x) and approx(robot.y, blended.y)
+    # Short motions stay at the lowest speed: no time saved
+    assert approx(motion_duration(30), motion_duration(10) + motion_duration(20))
+    # Blended past the speed ramp, the robot reaches full speed
+    assert approx(motion_duration(120), 0.6)
+    assert approx(motion_duration(60) + motion_duration(60), 2.4)
+
+
+def test_move_while(simulator):
+    sock, replies = connect(simulator)
+    # Forward until the center sensors are over black, then while they are
+    sock.sendall(encode('w', moving_param('f', 1000, [2], 500, False)))
+    assert replies.readline() == "11\r\n"
+    assert approx(simulator.robot.y, 61)
+    sock.sendall(encode('w', moving_param('f', 1000, [2], 500, True)))
+    assert replies.readline() == "100\r\n"
+    # At most the length asked
+    sock.sendall(encode('w', moving_param('f', 1000, [2], 30, False)))
+    assert replies.readline() == "30\r\n"
+    assert approx(simulator.robot.y, 191)
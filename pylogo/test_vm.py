@@ -0,0 +1,104 @@
+import pytest
+import test_logo
+from logo import Evaluator, Env, Primitive, StackOverflow
+from vm import Code
+
+
+def vm_eval(text, **env):
+    return Evaluator(Env(parent=None, **env), engine="vm").eval(text)
+
+
+# Tests of the limits of the closure engine
+Closure_only = ("test_deep_recursion_error",)
+
+
+@pytest.mark.parametrize("name", sorted(
+    n for n in dir(test_logo) if n.startswith("test_") and n not in Closure_only))
+def test_logo_suite(name, monkeypatch):
+    """The whole interpreter test suite, run on the bytecode engine"""
+    monkeypatch.setattr(test_logo, "logo_eval", vm_eval)
+    getattr(test_logo, name)()
+
+
+def vm_eval_budget(text, budget):
+    return Evaluator(engine="vm", stack_budget=budget).eval(text)
+
+
+def test_logo_suite_budget(monkeypatch):
+    """Tests expecting a StackOverflow pass with a small budget"""
+    monkeypatch.setattr(test_logo, "logo_eval",
+                        lambda text, **env: vm_eval_budget(text, 2**20))
+    test_logo.test_deep_recursion_error()
+
+
+def test_deep_recursion():
+    source = """
+    pour somme :n
+      si :n = 0 0 sinon :n + somme :n - 1
+    fin
+    somme 100000
+    """
+    assert vm_eval(source) == 5000050000
+
+
+def test_repl_defaults_deep_recursion():
+    from repl import parse_args, make_evaluator
+    source = """
+    pour somme :n
+      si :n = 0 0 sinon :n + somme :n - 1
+    fin
+    somme 100000
+    """
+    # Nested calls are on the heap by default, bounded by --stack-budget
+    assert make_evaluator(parse_args([]), None).eval(source) == 5000050000
+    with pytest.raises(StackOverflow):
+        make_evaluator(parse_args(["--stack-budget", "1"]), None).eval(source)
+    with pytest.raises(SystemExit):
+        parse_args(["--engine", "closure", "--stack-budget", "1"])
+
+
+def test_tail_call_no_stack():
+    source = """
+    pour boucle :n
+      si :n > 0 [boucle :n - 1]
+    fin
+    pour compte :n
+      si :n = 0 0 sinon compte :n - 1
+    fin
+    compte 10000
+    """
+    # Tail calls don't count, nested calls do
+    assert vm_eval_budget(source, 2**16) == 0
+    with pytest.raises(StackOverflow):
+        vm_eval_budget(source.replace("compte 10000", "boucle 10000"), 2**16)
+
+
+def test_procedure_compiled():
+    evaluator = Evaluator(engine="vm")
+    evaluator.eval("pour carre :n * :n :n fin")
+    assert type(evaluator.env["carre"].body) is Code
+
+
+def test_loop_value():
+    assert vm_eval("repete 3 [1 2]") == 3
+    assert vm_eval("repete 0 [f]") == 0
+
+
+def test_while():
+    calls = []
+    def more():
+        calls.append(1)
+        return len(calls) < 5
+    assert vm_eval("tantque f [1]", f=Primitive(more, 0)) is None
+    assert len(calls) == 5
+
+
+def test_nested_loops():
+    c = test_logo.Counter()
+    assert vm_eval("repete 3 [repete 4 [func]]", func=c.primitive()) == 3
+    assert c.calls == 12
+
+
+def test_unknown_engine():
+    with pytest.raises(ValueError):
+        Evaluator(engine="jit")
@@ -0,0 +1,82 @@
+import imp
+import os
+import pytest
+from recorder import load
+from simulator import Simulator, Robot, Floor, BLACK, WHITE
+
+
+def approx(a, b):
+    return abs(a - b) < 1e-6
+
+
+@pytest.fixture
+def simulator():
+    floor = Floor([
+        "....",
+        ".##.",
+        "....",
+    ], cell=100)
+    # Motions take a while: the next commands are queued meanwhile
+    simulator = Simulator(Robot(floor, 150, 50), speed=10, port=0).start()
+    yield simulator
+    simulator.close()
+
+
+@pytest.fixture
+def turtle(simulator, monkeypatch):
+    """A new zumoturtle module, connected to simulator"""
+    monkeypatch.setenv('ZUMO_PORT', str(simulator.port))
+    path = os.path.join(os.path.dirname(__file__), "zumoturtle.py")
+    turtle = imp.load_source("zumoturtle_test", path)
+    assert hasattr(turtle, "sock"), "not connected to the simulator"
+    yield turtle
+    turtle.close()
+    turtle.stop_recording()
+    turtle.sock.close()
+
+
+def test_pipeline(turtle, simulator, tmpdir):
+    path = str(tmpdir.join("session.zlog"))
+    turtle.record(path)
+    turtle.set_pipeline(True)
+    for i in range(25):
+        turtle.forward(4)
+    turtle.turnRight(90)
+    turtle.sync()
+    robot = simulator.robot
+    assert approx(robot.x, 150) and approx(robot.y, 150) and approx(robot.heading % 360, 0)
+    # Sensors wait for the motions before them
+    assert turtle.sensorsAbove(1000, [0]) is True
+    turtle.stop_recording()
+    entries = load(path)[1]
+    assert [e.cmd for e in entries] == ['f'] * 25 + ['r', 't']
+    # Sent in frames, with one reply for all
+    assert any(e.reply is None for e in entries)
+    assert all(e.reply == 0 for e in entries[:-1] if e.reply is not None)
+
+
+def test_pipeline_blend(turtle, simulator):
+    turtle.set_pipeline(True, blend=True)
+    for i in range(25):
+        turtle.forward(4)
+    turtle.sync()
+    assert approx(simulator.robot.y, 150)
+    # The left adjustment, then a few blended motions
+    assert simulator.commands < 10
+
+
+def test_stream(turtle, simulator):
+    turtle.subscribe(5)
+    assert simulator.stream_period == 5
+    commands = simulator.commands
+    # Answered from the readings pushed by the robot, without commands
+    assert turtle.getGroundSensor(2) == WHITE
+    assert turtle.sensorsAbove(1000, [0, 5]) is False
+    # Readings older than the last motion are not used
+    turtle.forward(60)
+    assert turtle.getGroundSensor(2) == BLACK
+    assert turtle.getGroundSensorSum() == 6 * BLACK
+    assert simulator.commands == commands + 1
+    assert turtle.receive(0.5).startswith("S")
+    turtle.subscribe(0)
+    assert simulator.stream_period == 0 and turtle.max_age is None
@@ -0,0 +1,359 @@
+"""
+Bytecode engine for the LOGO interpreter.
+
+The nodes produced by logo.Evaluator.analyze are flattened into a list of
+(opcode, argument) instructions, executed by a single dispatch loop on a
+value stack. Calls to procedures compiled by this engine don't recurse on
+the Python stack: the caller's frame is pushed on a list instead.
+
+Select it with Evaluator(engine="vm"). Its programs can also run as
+tasks suspended at calls and loops (see execute and scheduler.py).
+"""
+
+import sys
+from logo import Primitive, Frame, LogoError, UnknowIdentifier, StackOverflow, \
+    Failed, Memo, closure, hoisting
+
+CONST, LOOKUP, CALL_PRIM, CALL, POP, LIST, JUMP, JUMP_IF_FALSE, \
+    REPEAT_SETUP, REPEAT_NEXT, RETURN, LOCAL, OUTER, GLOBAL, TAIL_CALL, \
+    TEMP, HOIST = range(17)
+
+Opnames = ("CONST", "LOOKUP", "CALL_PRIM", "CALL", "POP", "LIST", "JUMP",
+           "JUMP_IF_FALSE", "REPEAT_SETUP", "REPEAT_NEXT", "RETURN",
+           "LOCAL", "OUTER", "GLOBAL", "TAIL_CALL", "TEMP", "HOIST")
+
+# Default memory budget for the calls in progress of one run
+STACK_BUDGET = 64 * 2**20
+
+# Approximate memory used by one call in progress: the saved
+# (code, pc, env) record, the callee's Frame and its argument list
+FRAME_SIZE = sys.getsizeof((None, 0, None)) + Frame.__basicsize__ + \
+             sys.getsizeof([None, None]) + 16
+
+
+class Code(object):
+    """A compiled program; calling it with an env runs it"""
+
+    def __init__(self, instructions, name='', tokens=None, stack_budget=STACK_BUDGET):
+        self.instructions = instructions
+        self.name = name
+        # Source token of instructions that may fail, by pc
+        self.tokens = tokens or {}
+        # Maximum number of calls in progress when running this code
+        self.max_depth = max(1, stack_budget // FRAME_SIZE)
+
+    def __call__(self, env):
+        return run(self, env)
+
+    def __repr__(self):
+        return "<Code %s (%d instructions)>" % (self.name, len(self.instructions))
+
+    def disassemble(self):
+        lines = []
+        for pc, (op, arg) in enumerate(self.instructions):
+            if op in (CALL_PRIM, CALL, TAIL_CALL):
+                arg = "%s/%d" % (arg[0].name, arg[1])
+            lines.append("%4d %-14s %s" % (pc, Opnames[op], "" if arg is None else arg))
+        return "\n".join(lines)
+
+
+class Compiler(object):
+    """Emit instructions for analyzed nodes"""
+
+    def __init__(self):
+        self.instructions = []
+        self.tokens = {}
+
+    def emit(self, op, arg=None):
+        self.instructions.append((op, arg))
+        return len(self.instructions) - 1
+
+    def patch(self, pc, target):
+        """Set the jump target of instruction at pc"""
+        self.instructions[pc] = (self.instructions[pc][0], target)
+
+    def here(self):
+        return len(self.instructions)
+
+    def node(self, node, value=True):
+        """
+        Emit code for node. If value is False, the result of the node is
+        not needed and nothing is left on the stack.
+        """
+        kind = node[0]
+        if kind == 'const':
+            if value:
+                self.emit(CONST, node[1])
+        elif kind == 'local':
+            if value:
+                self.emit(LOCAL, node[1])
+        elif kind == 'temp':
+            # Even if unused, the read raises the error of the expression
+            self.emit(TEMP, node[1])
+            if not value:
+                self.emit(POP)
+        elif kind == 'hoist':
+            # Run once per loop entry: the closure engine is fast enough
+            self.emit(HOIST, hoisting([(slot, closure(expr)) for slot, expr in node[1]],
+                                      lambda frame: None))
+            self.node(node[2], value)
+        elif kind == 'lookup':
+            self.tokens[self.emit(LOOKUP, node[1])] = node[2]
+            if not value:
+                self.emit(POP)
+        elif kind == 'global':
+            self.tokens[self.emit(GLOBAL, (node[1], node[2]))] = node[3]
+            if not value:
+                self.emit(POP)
+        elif kind == 'outer':
+            self.tokens[self.emit(OUTER, (node[1], node[2], node[3]))] = node[4]
+            if not value:
+                self.emit(POP)
+        elif kind == 'call':
+            proc, args = node[1], node[2]
+            for arg in args:
+                self.node(arg)
+            op = CALL_PRIM if type(proc) is Primitive else CALL
+            self.emit(op, (proc, len(args)))
+            if not value:
+                self.emit(POP)
+        elif kind == 'tailcall':
+            proc, args = node[1], node[2]
+            for arg in args:
+                self.node(arg)
+            self.emit(TAIL_CALL, (proc, len(args), node[3]))
+            # Only reached if the callee doesn't run on this VM
+            self.emit(RETURN)
+        elif kind == 'list':
+            for item in node[1]:
+                self.node(item, value)
+            if value:
+                self.emit(LIST, len(node[1]))
+        elif kind == 'seq':
+            exprs = node[1]
+            if not exprs:
+                if value:
+                    self.emit(CONST, None)
+                return
+            for expr in exprs[:-1]:
+                self.node(expr, False)
+            self.node(exprs[-1], value)
+        elif kind == 'repeat':
+            # Stack during the loop: [times, remaining iterations]
+            self.node(node[1])
+            self.emit(REPEAT_SETUP)
+            loop = self.emit(REPEAT_NEXT)
+            self.node(node[2], False)
+            self.emit(JUMP, loop)
+            self.patch(loop, self.here())
+            if not value:
+                self.emit(POP)
+        elif kind == 'if':
+            self.node(node[1])
+            to_alt = self.emit(JUMP_IF_FALSE)
+            self.node(node[2], value)
+            to_end = self.emit(JUMP)
+            self.patch(to_alt, self.here())
+            self.node(node[3], value)
+            self.patch(to_end, self.here())
+        elif kind == 'while':
+            loop = self.here()
+            self.node(node[1])
+            to_end = self.emit(JUMP_IF_FALSE)
+            self.node(node[2], False)
+            self.emit(JUMP, loop)
+            self.patch(to_end, self.here())
+            if value:
+                self.emit(CONST, None)
+        else:
+            raise ValueError("Unknown node " + repr(kind))
+
+
+def compile(node, name='', stack_budget=STACK_BUDGET):
+    """Compile an analyzed node to a Code object"""
+    compiler = Compiler()
+    compiler.node(node)
+    compiler.emit(RETURN)
+    return Code(compiler.instructions, name, compiler.tokens, stack_budget)
+
+
+def run(code, env):
+    """Execute code in env and return its result"""
+    result = []
+    for step in execute(code, env, result):
+        pass
+    return result[0]
+
+
+def execute(code, env, result, preemptive=False):
+    """
+    Generator executing code in env, appending its value to result.
+    When preemptive, it yields where the task running it may be
+    suspended: None at calls and loop back-edges, and (func, args)
+    for blocking primitives (see Primitive.blocking), whose result is
+    then sent back. Otherwise it doesn't yield.
+    """
+    stack, frames = [], []
+    push, pop = stack.append, stack.pop
+    instructions, pc = code.instructions, 0
+    max_depth = code.max_depth
+    Missing = Memo.Missing
+    # Local names are much faster than globals in the dispatch loop
+    _CONST, _LOOKUP, _CALL_PRIM, _CALL, _POP, _LIST, _JUMP, _JUMP_IF_FALSE, \
+        _REPEAT_SETUP, _REPEAT_NEXT, _RETURN, _LOCAL, _OUTER, _GLOBAL, \
+        _TAIL_CALL, _TEMP, _HOIST = range(17)
+
+    try:
+        while True:
+            op, arg = instructions[pc]
+            pc += 1
+
+            if op == _CALL_PRIM:
+                func, n = arg[0].func, arg[1]
+                if preemptive:
+                    if n:
+                        args = stack[-n:]
+                        del stack[-n:]
+                    else:
+                        args = []
+                    if arg[0].blocking:
+                        push((yield (func, args)))
+                    else:
+                        push(func(*args))
+                        yield
+                elif n == 1:
+                    stack[-1] = func(stack[-1])
+                elif n == 2:
+                    right = pop()
+                    stack[-1] = func(stack[-1], right)
+                elif n == 0:
+                    push(func())
+                else:
+                    args = stack[-n:]
+                    del stack[-n:]
+                    push(func(*args))
+
+            elif op == _LOCAL:
+                push(env.values[arg])
+
+            elif op == _LOOKUP:
+                push(env[arg])
+
+            elif op == _CONST:
+                push(arg)
+
+            elif op == _POP:
+                pop()
+
+            elif op == _REPEAT_NEXT:
+                remaining = stack[-1]
+                if remaining > 0:
+                    stack[-1] = remaining - 1
+                    if preemptive:
+                        yield
+                else:
+                    pop()
+                    pc = arg
+
+            elif op == _JUMP:
+                if preemptive and arg < pc:
+                    yield
+                pc = arg
+
+            elif op == _JUMP_IF_FALSE:
+                if not pop():
+                    pc = arg
+
+            elif op == _CALL:
+                if preemptive:
+                    yield
+                proc, n = arg
+                if n:
+                    args = stack[-n:]
+                    del stack[-n:]
+                else:
+                    args = []
+                body = getattr(proc, 'body', None)
+                if type(body) is Code:
+                    memo = proc.memo
+                    if memo is not None:
+                        key = memo.key(args)
+                        if key is not None:
+                            res = memo.get(key)
+                            if res is not Missing:
+                                push(res)
+                                continue
+                    if len(frames) >= max_depth:
+                        raise StackOverflow("More than %d nested calls" % max_depth)
+                    frames.append((code, pc, env))
+                    env = proc.bind(env, args)
+                    code, pc = body, 0
+                    instructions = code.instructions
+                else:
+                    push(proc.call(env, args))
+
+            elif op == _TAIL_CALL:
+                if preemptive:
+                    yield
+                proc, n, drop_frame = arg
+                if n:
+                    args = stack[-n:]
+                    del stack[-n:]
+                else:
+                    args = []
+                body = proc.body
+                if type(body) is Code:
+                    # Replace the running call
+                    env = proc.bind(env.parent if drop_frame else env, args)
+                    code, pc = body, 0
+                    instructions = code.instructions
+                else:
+                    push(proc.call(env, args))
+
+            elif op == _RETURN:
+                if not frames:
+                    result.append(pop())
+                    return
+                memo = env.procedure.memo
+                if memo is not None:
+                    key = memo.key(env.values[:env.procedure.arity])
+                    if key is not None:
+                        memo.put(key, stack[-1])
+                code, pc, env = frames.pop()
+                instructions = code.instructions
+
+            elif op == _LIST:
+                if arg:
+                    items = stack[-arg:]
+                    del stack[-arg:]
+                else:
+                    items = []
+                push(items)
+
+            elif op == _GLOBAL:
+                push(arg[0][arg[1]])
+
+            elif op == _OUTER:
+                frame = env.up(arg[0])
+                if frame is None:
+                    raise UnknowIdentifier(arg[2])
+                push(frame.values[arg[1]])
+
+            elif op == _TEMP:
+                value = env.values[arg]
+                if type(value) is Failed:
+                    raise value.error
+                push(value)
+
+            elif op == _REPEAT_SETUP:
+                # Same validation as range(times)
+                push(len(xrange(stack[-1])))
+
+            elif op == _HOIST:
+                arg(env)
+
+            else:
+                raise ValueError("Unknown opcode %r" % op)
+    except LogoError as err:
+        err.at(code.tokens.get(pc-1))
+        raise
@@ -7,64 +7,254 @@ except:
     BLACK_THRES = 2048
 
 try:
+    import os
     import socket
     import atexit
     import time
-    from struct import pack, unpack
-    HOST = 'localhost'
-    PORT = 6571
+    import select
+    from collections import deque
+    from protocol import encode, sensors_param, parse_readings, blend, NO_READING, \
+        STREAM, STREAM_PREFIX, MOVE_WHILE, moving_param, moving_length, moved
+    from recorder import Recorder, monotonic
+    # Another robot, or a simulator (see simulator.py)
+    HOST = os.environ.get('ZUMO_HOST', 'localhost')
+    PORT = int(os.environ.get('ZUMO_PORT', 6571))
     sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     sock.connect((HOST, PORT))
     atexit.register(sock.close)
 
+    # Pipelined mode (see set_pipeline): commands whose reply is not used
+    # are queued, and sent in frames of at most MAX_FRAME commands while
+    # the robot executes the previous frame. Each frame gets one reply.
+    MAX_FRAME = 10
+    # Blended mode (see set_pipeline): queued motions in the same
+    # direction are merged, see protocol.blend
+    pipeline = False
+    blended = False
+    queued = []
+    in_flight = 0
+    received = ""
+    # Send time and commands of the frames in flight, oldest first
+    frames = deque()
+
+    # Recording of the commands (see record), or None
+    recorder = None
+
+    # Sensor stream (see subscribe): sensor values come from the latest
+    # readings pushed by the robot, if at most max_age s old and received
+    # after the last reply (hence the last motion)
+    max_age = None
+    snapshot, snapshot_time = None, 0
+    last_reply = 0
+    STREAM_TIMEOUT = 1.0
+
+    def receive(timeout=None):
+        """
+        Handle the next line from the robot and return it: readings pushed
+        by the robot update the snapshot. None if nothing was received
+        within timeout (s, None: wait).
+        """
+        global received, snapshot, snapshot_time, last_reply
+        while '\n' not in received:
+            if timeout is not None and not select.select([sock], [], [], timeout)[0]:
+                return None
+            data = sock.recv(4096)
+            if not data:
+                raise IOError("Connection to the robot closed")
+            received += data
+        line, received = received.split('\n', 1)
+        line = line.strip()
+        if line.startswith(STREAM_PREFIX):
+            snapshot, snapshot_time = parse_readings(line), time.time()
+        else:
+            last_reply = time.time()
+        return line
+
+    def read_reply():
+        """Next reply line of the robot"""
+        line = receive()
+        while line.startswith(STREAM_PREFIX):
+            line = receive()
+        return line
+
+    def frame_replied(line):
+        """Account for the reply line of the oldest frame in flight"""
+        global in_flight
+        in_flight -= 1
+        sent, commands = frames.popleft()
+        if recorder is not None:
+            recorder.frame(commands, line, sent, monotonic())
+
+    def poll_replies():
+        """Handle the lines already received, without blocking"""
+        line = receive(0)
+        while line is not None:
+            if not line.startswith(STREAM_PREFIX):
+                frame_replied(line)
+            line = receive(0)
+
+    def flush(count=None):
+        """Send the queued commands (the first count of them) in one frame"""
+        global queued, in_flight
+        count = len(queued) if count is None else count
+        if not count:
+            return
+        # The robot holds one frame while it executes another
+        while in_flight > 1:
+            frame_replied(read_reply())
+        if count == 1:
+            frame = encode(*queued[0])
+        else:
+            frame = encode('m', count) + ''.join(encode(*c) for c in queued[:count])
+        frames.append((monotonic(), queued[:count]))
+        sock.sendall(frame)
+        in_flight += 1
+        del queued[:count]
+
+    def sync():
+        """Wait until the robot has executed all commands sent"""
+        flush()
+        while in_flight:
+            frame_replied(read_reply())
+
     def send_cmd(cmd, param):
-        param = int(param)
-        cmdbytes = [ord(cmd), (param>>24)&0xff, (param>>16)&0xff, (param>>8)&0xff, param&0xff]
-        sock.sendall(''.join(map(chr, cmdbytes)))
-        resbuf = ""
-        got = sock.recv(1)
-        while got != '\n':
-            resbuf += got
-            got = sock.recv(1)
-        return resbuf.strip()
+        """Send a command and return its reply"""
+        sync()
+        sent = monotonic()
+        sock.sendall(encode(cmd, param))
+        reply = read_reply()
+        if recorder is not None:
+            recorder.record(cmd, param, reply, sent, monotonic())
+        return reply
+
+    def post(cmd, param):
+        """Send a command whose reply is not needed"""
+        if not pipeline:
+            send_cmd(cmd, param)
+            return
+        if blended:
+            blend(queued, cmd, param)
+        else:
+            queued.append((cmd, param))
+        poll_replies()
+        if len(queued) >= MAX_FRAME:
+            flush()
+        elif not in_flight:
+            # The last blended motion may still grow, it waits for the next command
+            flush(len(queued) - 1 if blended else None)
+
+    def set_pipeline(enabled, blend=False):
+        """
+        Enable the pipelined mode; the robot needs the frame command 'm'.
+        With blend, motions queued in the same direction are merged.
+        """
+        global pipeline, blended
+        sync()
+        pipeline = enabled
+        blended = enabled and blend
+
+    def subscribe(period=20, age=None):
+        """
+        Have the robot push its ground readings every period ms, and read
+        sensor values from them while at most age ms old (default: twice
+        the period). A period of 0 stops the stream.
+        """
+        global max_age
+        send_cmd(STREAM, period)
+        max_age = (age or 2*period) / 1000.0 if period else None
+
+    def record(path):
+        """Record the commands sent from now on to the file path (see recorder.py)"""
+        global recorder
+        sync()
+        recorder = Recorder(open(path, 'wb'))
+        # Run by atexit before close: the last replies are recorded
+        atexit.register(stop_recording)
+
+    def stop_recording():
+        global recorder
+        if recorder is not None:
+            sync()
+            recorder.close()
+            recorder = None
+
+    def streamed(cmd, param, reply):
+        """Record a command answered from the sensor stream"""
+        if recorder is not None:
+            now = monotonic()
+            recorder.record(cmd, param, reply, now, now, streamed=True)
+        return reply
+
+    def readings():
+        """Ground readings pushed by the robot, fresh enough"""
+        sync()
+        poll_replies()
+        while snapshot_time < last_reply or time.time() - snapshot_time > max_age:
+            if receive(STREAM_TIMEOUT) is None:
+                raise IOError("No ground readings from the robot for %gs" % STREAM_TIMEOUT)
+        return snapshot
+
+    def close():
+        sync()
+        if max_age is not None:
+            subscribe(0)
 
     def forward(length):
-        send_cmd("f", length)
+        post("f", length)
 
     def backward(length):
-        send_cmd("b", length)
+        post("b", length)
 
     def turnLeft(angle):
-        send_cmd("l", angle*ROTATION_ADJUST)
+        post("l", angle*ROTATION_ADJUST)
 
     def turnRight(angle):
-        send_cmd("r", angle*ROTATION_ADJUST)
+        post("r", angle*ROTATION_ADJUST)
 
     def changeLeftAdjust(ratio):
-        send_cmd("c", int(ratio*1000))
+        post("c", int(ratio*1000))
 
     def playMusic():
-        send_cmd("p", 0)
+        post("p", 0)
+
+    def moveWhile(direction, threshold, sensors, length, above):
+        """
+        Move in direction (see protocol.MOTIONS), at most length, while
+        one of sensors reads at least threshold (above) or while none
+        does: the robot checks every millisecond. Return the length
+        travelled.
+        """
+        sent = moving_length(direction, length, ROTATION_ADJUST)
+        travelled = send_cmd(MOVE_WHILE, moving_param(direction, threshold, sensors, sent, above))
+        return moved(length, sent, int(travelled))
 
     def sensorsAbove(threshold, sensors):
-        bitsensors = 0
-        for i in sensors:
-            assert(0 <= i < 6)
-            bitsensors |= (1 << i)
-        payload = unpack('>i', pack('>hh', threshold, bitsensors))[0]
-        x = send_cmd('t', payload)
+        if max_age is not None:
+            values = readings()
+            return streamed('t', sensors_param(threshold, sensors),
+                            any(values[i] >= threshold for i in sensors))
+        x = send_cmd('t', sensors_param(threshold, sensors))
         return x == "1"
 
     def getGroundSensor(index):
+        if max_age is not None:
+            return streamed("s", index, readings()[index])
         time.sleep(0.001)
-        res = 4294967295
-        while res == 4294967295:
+        res = NO_READING
+        while res == NO_READING:
             res = int(send_cmd("s", index))
             time.sleep(0.001)
         return res
 
+    def getGroundSensorSum():
+        if max_age is not None:
+            return streamed("a", 0, sum(readings()))
+        return int(send_cmd("a", 0))
+
     # adapt left/right motors speed for each robot    
     changeLeftAdjust(LEFT_ADJUST)
+    # last registered, first run: before closing the socket
+    atexit.register(close)
     
 except Exception as err:
     print "\033[33;1m[WARNING]\033[0m No Arduino YUN Bridge:", str(err)
@@ -75,5 +265,17 @@ except Exception as err:
             return 0
         return f
 
-    for f in ('forward', 'backward', 'turnLeft', 'turnRight', 'getGroundSensor', 'playMusic', 'getGroundSensorSum', 'sensorsAbove'):
+    def sync():
+        pass
+
+    def set_pipeline(enabled, blend=False):
+        pass
+
+    def subscribe(period=20, age=None):
+        pass
+
+    def record(path):
+        pass
+
+    for f in ('forward', 'backward', 'turnLeft', 'turnRight', 'getGroundSensor', 'playMusic', 'getGroundSensorSum', 'sensorsAbove', 'changeLeftAdjust', 'moveWhile'):
         globals()[f] = do_print(f)